@@ -0,0 +1,189 @@
+'''
+Module to integrate images on a 2D grid in polar coordinates (r, theta), also called caking.
+
+The polar coordinates are taken from ncempy.algo.radial_profile.calc_polarcoords, so distortions are corrected the same way as for radial profiles. The assignment of pixels to (r, theta) bins is precomputed once as a sparse matrix, which is then applied to single images or whole stacks.
+'''
+
+import numpy as np
+import scipy.sparse
+
+import ncempy.algo.radial_profile
+
+
+def _split_axis(vec, split):
+    '''Subpixel positions along an axis.
+    
+    Parameters:
+        vec (np.ndarray):    Dimension vector (pixel centers).
+        split (int):    Number of subpixels per pixel.
+    
+    Returns:
+        (np.ndarray):    Positions of the subpixel centers, len(vec)*split entries.
+    
+    '''
+    
+    vec = np.asarray(vec, dtype='float64')
+    
+    if split == 1:
+        return vec
+    
+    step = np.gradient(vec) if len(vec) > 1 else np.ones(1)
+    offs = (np.arange(split) + 0.5)/split - 0.5
+    
+    return np.ravel( vec[:,np.newaxis] + step[:,np.newaxis]*offs[np.newaxis,:] )
+
+
+class AzimuthalIntegrator:
+    '''Integrator for intensities on a polar (r, theta) grid.
+    
+    With split > 1 every pixel is divided into split x split subpixels, which are assigned to bins separately, distributing the pixel over the bins it covers (pixel splitting). This smooths the result for bins smaller than a pixel.
+    
+    The intensity of a bin is the weighted mean of the pixels assigned to it, bins without any pixels are NaN.
+    
+    Parameters:
+        dims (tuple):    Tuple of dimensions of the images.
+        center (np.ndarray/tuple):    Center of polar coordinate system in real coordinates.
+        rMax (float):    Maximum radial distance [dims].
+        dr (float):    Bin size along r [dims].
+        ntheta (int):    Number of bins along theta, covering [-pi, pi).
+        ns (tuple):    List of distortion orders to correct for.
+        dists (np.ndarray):    Parameters for distortions.
+        mask (np.ndarray):    Mask image, values at 0 are excluded.
+        split (int):    Number of subpixels per pixel along each axis.
+        rMin (float):    Minimum radial distance [dims].
+    
+    '''
+    
+    def __init__(self, dims, center, rMax, dr, ntheta, ns=None, dists=None, mask=None, split=1, rMin=0.):
+        '''Init precomputing the pixel to bin map.
+        
+        '''
+        
+        # check input
+        try:
+            assert(len(dims)>=2)
+            assert(len(dims[0])==3)
+            
+            rMin = float(rMin)
+            rMax = float(rMax)
+            dr = float(dr)
+            assert(rMax > rMin)
+            assert(dr > 0)
+            
+            ntheta = int(ntheta)
+            assert(ntheta >= 1)
+            
+            split = int(split)
+            assert(split >= 1)
+            
+            self.shape = (len(dims[0][0]), len(dims[1][0]))
+            
+            if not mask is None:
+                assert(isinstance(mask, np.ndarray))
+                assert(np.array_equal(mask.shape, self.shape))
+        
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        # bins
+        self.r_edges = np.arange(rMin, rMax, dr)
+        self.theta_edges = np.linspace(-np.pi, np.pi, ntheta+1)
+        self.nr = self.r_edges.shape[0]-1
+        self.ntheta = ntheta
+        
+        self.r = 0.5*(self.r_edges[1:] + self.r_edges[:-1])
+        self.theta = 0.5*(self.theta_edges[1:] + self.theta_edges[:-1])
+        
+        # polar coordinates of the (sub)pixels, includes the input check for center, ns and dists
+        sub_dims = ( (_split_axis(dims[0][0], split), dims[0][1], dims[0][2]), (_split_axis(dims[1][0], split), dims[1][1], dims[1][2]) )
+        rs, thes = ncempy.algo.radial_profile.calc_polarcoords( center, sub_dims, ns, dists )
+        
+        # pixel index for every subpixel
+        pix = ( (np.arange(self.shape[0]*split)//split)[:,np.newaxis]*self.shape[1] + (np.arange(self.shape[1]*split)//split)[np.newaxis,:] )
+        
+        rs = np.ravel(rs)
+        thes = np.ravel(thes)
+        pix = np.ravel(pix)
+        
+        # bin indices
+        ir = np.floor((rs - rMin)/dr).astype(int)
+        ith = np.floor((thes + np.pi)/(2*np.pi)*ntheta).astype(int)
+        ith[ith == ntheta] = 0
+        
+        sel = (ir >= 0)*(ir < self.nr)
+        
+        weights = np.ones(rs.shape)/split**2
+        if not mask is None:
+            mask_flat = np.ravel(mask).astype('float64')
+            use = np.logical_and(mask_flat != 0, np.logical_not(np.isnan(mask_flat)))
+            sel = np.logical_and(sel, use[pix])
+        
+        bins = ir[sel]*self.ntheta + ith[sel]
+        
+        # duplicate entries of split pixels are summed up
+        self.matrix = scipy.sparse.csc_matrix( (weights[sel], (bins, pix[sel])), shape=(self.nr*self.ntheta, self.shape[0]*self.shape[1]) )
+        self.matrix.sum_duplicates()
+        
+        # pixel count per bin, fractional for split pixels
+        self.count = np.reshape(np.asarray(self.matrix.sum(axis=1)).ravel(), (self.nr, self.ntheta))
+    
+    def __call__(self, img, normalize=True):
+        '''Integrate an image or every image in a stack.
+        
+        Parameters:
+            img (np.ndarray):    Image or stack of images (frame index first).
+            normalize (bool):    Set to divide by the pixel counts, otherwise the summed intensities are returned.
+        
+        Returns:
+            (np.ndarray):    Intensities with shape (nr, ntheta) or (N, nr, ntheta) for stacks.
+        
+        '''
+        
+        try:
+            assert(isinstance(img, np.ndarray))
+            assert(np.array_equal(img.shape[-2:], self.shape))
+            assert(len(img.shape) in (2,3))
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        if len(img.shape) == 2:
+            signal = self.matrix.dot(np.ravel(img).astype('float64'))
+            signal = np.reshape(signal, (self.nr, self.ntheta))
+        else:
+            signal = self.matrix.dot(np.reshape(img, (img.shape[0], -1)).astype('float64').transpose())
+            signal = np.reshape(signal.transpose(), (img.shape[0], self.nr, self.ntheta))
+        
+        if normalize:
+            # empty bins give nans, just ignore the warning
+            old_err_state = np.seterr(divide='ignore',invalid='ignore')
+            signal = np.divide(signal, self.count)
+            np.seterr(**old_err_state)
+        
+        return signal
+
+
+def calc_cake( img, dims, center, rMax, dr, ntheta, ns=None, dists=None, mask=None, split=1 ):
+    '''Calculate the intensity on a polar (r, theta) grid.
+    
+    Convenience wrapper around AzimuthalIntegrator, set up an integrator once to process many images with the same geometry.
+    
+    Parameters:
+        img (np.ndarray):    Image or stack of images (frame index first).
+        dims (tuple):    Tuple of dimensions of the images.
+        center (np.ndarray/tuple):    Center of polar coordinate system.
+        rMax (float):    Maximum radial distance [dims].
+        dr (float):    Bin size along r [dims].
+        ntheta (int):    Number of bins along theta.
+        ns (tuple):    List of distortion orders to correct for.
+        dists (np.ndarray):    Parameters for distortions.
+        mask (np.ndarray):    Mask image, values at 0 are excluded.
+        split (int):    Number of subpixels per pixel along each axis.
+    
+    Returns:
+        (tuple):    Bin centers along r and theta and the intensities.
+    
+    '''
+    
+    integ = AzimuthalIntegrator( dims, center, rMax, dr, ntheta, ns=ns, dists=dists, mask=mask, split=split )
+    
+    return integ.r, integ.theta, integ(img)
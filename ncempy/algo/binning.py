@@ -0,0 +1,190 @@
+'''
+Module to bin N-dimensional data by integer factors along any of its axes.
+
+The data is processed in chunks along the first axis, so memmaps and HDF5 datasets are never loaded completely. Without remainders the bins are reduced from a reshaped view, otherwise with ufunc.reduceat.
+'''
+
+import numpy as np
+
+
+def _check_factors(shape, factors):
+    '''Binning factor for every axis.
+    
+    Parameters:
+        shape (tuple):    Shape of the data.
+        factors (int/tuple):    Binning factor for all axes or one per axis.
+    
+    Returns:
+        (tuple):    Binning factors, one per axis.
+    
+    '''
+    
+    if np.ndim(factors) == 0:
+        factors = (factors,)*len(shape)
+    factors = tuple(int(f) for f in factors)
+    
+    assert(len(factors) == len(shape))
+    assert(all(f >= 1 for f in factors))
+    
+    return factors
+
+
+def binned_shape(shape, factors, remainder='crop'):
+    '''Shape of the binned data.
+    
+    Parameters:
+        shape (tuple):    Shape of the data.
+        factors (int/tuple):    Binning factor for all axes or one per axis.
+        remainder (str):    'crop' to drop incomplete bins at the end of an axis, 'pad' to keep them.
+    
+    Returns:
+        (tuple):    Shape after binning.
+    
+    '''
+    
+    try:
+        factors = _check_factors(shape, factors)
+        assert(remainder in ('crop', 'pad'))
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    if remainder == 'crop':
+        return tuple(n//f for n, f in zip(shape, factors))
+    else:
+        return tuple(-(-n//f) for n, f in zip(shape, factors))
+
+
+def accumulation_dtype(dtype, method='sum'):
+    '''Default dtype to accumulate the bins in.
+    
+    Sums follow np.sum, so integers are accumulated in 64 bits and do not overflow. Means follow np.mean, so integers give float64. The maximum keeps the dtype.
+    
+    Parameters:
+        dtype (np.dtype):    Dtype of the data.
+        method (str):    'sum', 'mean' or 'max'.
+    
+    Returns:
+        (np.dtype):    Dtype for the accumulation and the result.
+    
+    '''
+    
+    dtype = np.dtype(dtype)
+    
+    if method == 'sum':
+        return np.sum(np.zeros(1, dtype=dtype)).dtype
+    elif method == 'mean':
+        return np.mean(np.zeros(1, dtype=dtype)).dtype
+    elif method == 'max':
+        return dtype
+    else:
+        raise TypeError('{} method is not allowed'.format(str(method)))
+
+
+def _bin_block(block, factors, method, dtype):
+    '''Bin a block of data held in memory.
+    
+    Parameters:
+        block (np.ndarray):    Data block.
+        factors (tuple):    Binning factors, one per axis.
+        method (str):    'sum', 'mean' or 'max'.
+        dtype (np.dtype):    Accumulation dtype.
+    
+    Returns:
+        (np.ndarray):    Binned block, the last bin along an axis takes the remaining elements.
+    
+    '''
+    
+    if all(n % f == 0 for n, f in zip(block.shape, factors)):
+        # every axis splits into (bins, factor), reduce all factor axes at once
+        shape = []
+        for n, f in zip(block.shape, factors):
+            shape.extend((n//f, f))
+        axes = tuple(range(1, 2*block.ndim, 2))
+        view = block.reshape(shape)
+        
+        if method == 'max':
+            return view.max(axis=axes).astype(dtype, copy=False)
+        
+        out = view.sum(axis=axes, dtype=dtype)
+        if method == 'mean':
+            out = (out/np.prod(factors)).astype(dtype, copy=False)
+        return out
+    
+    out = block
+    counts = []
+    for ax, (n, f) in enumerate(zip(block.shape, factors)):
+        starts = np.arange(0, n, f)
+        counts.append(np.diff(np.append(starts, n)))
+        if f == 1:
+            continue
+        
+        if method == 'max':
+            out = np.maximum.reduceat(out, starts, axis=ax)
+        else:
+            out = np.add.reduceat(out, starts, axis=ax, dtype=dtype)
+    
+    out = out.astype(dtype, copy=False)
+    
+    if method == 'mean':
+        # number of elements per bin, the outer product of the counts along all axes
+        for ax, c in enumerate(counts):
+            shape = [1]*block.ndim
+            shape[ax] = c.shape[0]
+            out = out/np.reshape(c, shape)
+        out = out.astype(dtype, copy=False)
+    
+    return out
+
+
+def bin_array(data, factors, method='sum', remainder='crop', dtype=None, chunksize=None):
+    '''Bin data by integer factors along any of its axes.
+    
+    The data is read and binned in chunks along the first axis, so only one chunk of a memmap or HDF5 dataset is in memory at a time.
+    
+    Parameters:
+        data (np.ndarray):    Data to bin. Anything with shape and dtype which can be sliced works, e.g. a memmap or an h5py dataset.
+        factors (int/tuple):    Binning factor for all axes or one per axis, 1 leaves an axis as it is.
+        method (str):    'sum', 'mean' or 'max' of the elements in a bin.
+        remainder (str):    'crop' to drop incomplete bins at the end of an axis, 'pad' to keep them with the remaining elements (as if padded with zeros for sums, padded elements are ignored for means and maxima).
+        dtype (np.dtype):    Accumulation and output dtype, see accumulation_dtype for the default.
+        chunksize (int):    Number of bins along the first axis processed at once, chunks of about 2**22 elements are read if None.
+    
+    Returns:
+        (np.ndarray):    Binned data.
+    
+    '''
+    
+    try:
+        shape = tuple(data.shape)
+        assert(len(shape) >= 1)
+        factors = _check_factors(shape, factors)
+        assert(method in ('sum', 'mean', 'max'))
+        outshape = binned_shape(shape, factors, remainder)
+        
+        if dtype is None:
+            dtype = accumulation_dtype(data.dtype, method)
+        dtype = np.dtype(dtype)
+        
+        if chunksize is None:
+            chunksize = max(1, 2**22 // (factors[0]*max(1, int(np.prod(shape[1:], dtype=np.int64)))))
+        chunksize = int(chunksize)
+        assert(chunksize > 0)
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    out = np.empty(outshape, dtype=dtype)
+    
+    # skip the cropped remainders when reading
+    if remainder == 'crop':
+        others = tuple(slice(0, n*f) for n, f in zip(outshape[1:], factors[1:]))
+        stop = outshape[0]*factors[0]
+    else:
+        others = tuple(slice(0, n) for n in shape[1:])
+        stop = shape[0]
+    
+    for start in range(0, outshape[0], chunksize):
+        end = min(start + chunksize, outshape[0])
+        block = np.asarray(data[(slice(start*factors[0], min(end*factors[0], stop)),) + others])
+        out[start:end] = _bin_block(block, factors, method, dtype)
+    
+    return out
@@ -6,6 +6,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import scipy.optimize
 
+import ncempy.algo.math
+
 
 def filter_ring(points, center, rminmax):
     '''Filter points to be in a certain radial distance range from center.
@@ -148,7 +150,30 @@ def residuals_center( param, data):
     return (rs-np.mean(rs))
     
     
-def optimize_center(points, center, maxfev=1000, verbose=None):
+def jacobian_center( param, data):
+    '''Jacobian of residuals_center with respect to the center.
+    
+    Parameters:
+        param (np.ndarray):    The center to optimize.
+        data (np.ndarray):    The points in x,y coordinates of the original image.
+        
+    Returns:
+        (np.ndarray):   Jacobian of shape (len(data), 2).
+        
+    '''
+    
+    rs = np.sqrt( np.square(data[:,0]-param[0]) + np.square(data[:,1]-param[1]) )
+    
+    # derivatives of the radii, points at the center do not contribute
+    drs = np.zeros((data.shape[0], 2))
+    sel = rs > 0
+    drs[sel,0] = (param[0]-data[sel,0])/rs[sel]
+    drs[sel,1] = (param[1]-data[sel,1])/rs[sel]
+    
+    return drs - np.mean(drs, axis=0)
+    
+    
+def optimize_center(points, center, maxfev=1000, verbose=None, jac=True, check_jac=False, full_output=False):
     '''Optimize the center by minimizing the sum of square deviations from the mean radial distance.
     
     Parameters:
@@ -156,6 +181,9 @@ def optimize_center(points, center, maxfev=1000, verbose=None):
         center (np.ndarray/tuple):    Initial center guess.
         maxfev (int):    Max number of iterations forwarded to scipy.optimize.leastsq().
         verbose (bool):    Set to get verbose output.
+        jac (bool):    Set to use the analytic Jacobian instead of finite differences.
+        check_jac (bool):    Set to compare the analytic Jacobian against finite differences at the initial guess.
+        full_output (bool):    Set to additionally return a dict with the number of function evaluations (nfev) and the flag of scipy.optimize.leastsq().
     
     Returns:
         (np.ndarray):    The optimized center.
@@ -175,8 +203,13 @@ def optimize_center(points, center, maxfev=1000, verbose=None):
     except:
         raise TypeError('Something wrong with the input!')
 
+    if check_jac:
+        ncempy.algo.math.check_jac( residuals_center, jacobian_center, center, args=(points,) )
+    
+    Dfun = jacobian_center if jac else None
+
     # run the optimization
-    popt, flag = scipy.optimize.leastsq( residuals_center, center, args=(points), maxfev=maxfev)
+    popt, cov, info, msg, flag = scipy.optimize.leastsq( residuals_center, center, args=(points,), Dfun=Dfun, maxfev=maxfev, full_output=True)
     
     if flag not in [1,2,3,4]:
         print('WARNING: center optimization failed.')
@@ -184,6 +217,9 @@ def optimize_center(points, center, maxfev=1000, verbose=None):
     if verbose:
         print('optimized center: ({}, {})'.format(center[0], center[1]))
 
+    if full_output:
+        return popt, {'nfev': info['nfev'], 'flag': flag}
+
     return popt
     
 
@@ -205,6 +241,29 @@ def rad_dis( theta, alpha, beta, order=2 ):
     
     return (1.-np.square(beta))/np.sqrt(1.+np.square(beta)-2.*beta*np.cos(order*(theta+alpha)))
 
+
+def rad_dis_jac( theta, alpha, beta, order=2 ):
+    '''Derivatives of rad_dis with respect to alpha and beta.
+    
+    Parameters:
+        theta (np.ndarray/float):    Angles at which to evaluate.
+        alpha (float):    Orientation of major axis.
+        beta (float):    Strength of distortion.
+        order (int):    Order of distortion.
+        
+    Returns:
+        (tuple):    Derivatives with respect to alpha and beta.
+        
+    '''
+    
+    arg = order*(theta+alpha)
+    denom = 1.+np.square(beta)-2.*beta*np.cos(arg)
+    
+    d_alpha = -(1.-np.square(beta))*beta*order*np.sin(arg)/np.power(denom, 1.5)
+    d_beta = -2.*beta/np.sqrt(denom) - (1.-np.square(beta))*(beta-np.cos(arg))/np.power(denom, 1.5)
+    
+    return d_alpha, d_beta
+
     
 def residuals_dis(param, points, ns):
     '''Residual function for distortions.
@@ -226,7 +285,37 @@ def residuals_dis(param, points, ns):
     return points[:,0] - est 
     
     
-def optimize_distortion(points, ns, maxfev=1000, verbose=False):
+def jacobian_dis(param, points, ns):
+    '''Jacobian of residuals_dis with respect to the distortion parameters.
+    
+    Parameters:
+        param (np.ndarray):    Parameters for distortion.
+        points (np.ndarray):    Points to fit to.
+        ns (tuple):    List of orders to account for.
+    
+    Returns:
+        (np.ndarray):   Jacobian of shape (len(points), len(param)).
+        
+    '''
+    
+    facs = np.ones(points[:,1].shape)
+    for i in range(len(ns)):
+        facs *= rad_dis( points[:,1], param[i*2+1], param[i*2+2], ns[i])
+    
+    jac = np.zeros((points.shape[0], len(param)))
+    jac[:,0] = -facs
+    
+    # product rule: the other factors are the full product divided by this factor
+    for i in range(len(ns)):
+        d_alpha, d_beta = rad_dis_jac( points[:,1], param[i*2+1], param[i*2+2], ns[i])
+        others = param[0]*facs/rad_dis( points[:,1], param[i*2+1], param[i*2+2], ns[i])
+        jac[:,i*2+1] = -others*d_alpha
+        jac[:,i*2+2] = -others*d_beta
+    
+    return jac
+    
+    
+def optimize_distortion(points, ns, maxfev=1000, verbose=False, jac=True, check_jac=False, full_output=False):
     '''Optimize distortions.
     
     The orders in the list ns are first fitted subsequently and the result is refined in a final fit simultaneously fitting all orders.
@@ -236,6 +325,9 @@ def optimize_distortion(points, ns, maxfev=1000, verbose=False):
         ns (tuple):    List of orders to correct for.
         maxfev (int):    Max number of iterations forwarded to scipy.optimize.leastsq().
         verbose (bool):    Set for verbose output.
+        jac (bool):    Set to use the analytic Jacobian instead of finite differences.
+        check_jac (bool):    Set to compare the analytic Jacobian against finite differences at the initial guess of the full fit.
+        full_output (bool):    Set to additionally return a dict with the number of function evaluations (nfev) summed over all fits and the flag of the full fit.
     
     Returns:
         (np.ndarray):    Optimized parameters according to ns.
@@ -258,9 +350,13 @@ def optimize_distortion(points, ns, maxfev=1000, verbose=False):
     init_guess = np.ones(len(ns)*2+1)
     init_guess[0] = np.mean(points[:,0])
     
+    Dfun = jacobian_dis if jac else None
+    
     # make a temporary copy
     points_tmp = np.copy(points)
     
+    nfev = 0
+    
     if verbose:
         print('correction for {} order distortions.'.format(ns))
         print('starting with subsequent fitting:')
@@ -268,7 +364,8 @@ def optimize_distortion(points, ns, maxfev=1000, verbose=False):
     # subsequently fit the orders
     for i in range(len(ns)):
         # optimize order to points_tmp
-        popt, flag = scipy.optimize.leastsq( residuals_dis, (init_guess[0], 0.1, 0.1), args=(points_tmp, (ns[i],)), maxfev=maxfev)
+        popt, cov, info, msg, flag = scipy.optimize.leastsq( residuals_dis, (init_guess[0], 0.1, 0.1), args=(points_tmp, (ns[i],)), Dfun=Dfun, maxfev=maxfev, full_output=True)
+        nfev += info['nfev']
         
         if flag not in [1,2,3,4]:
             print('WARNING: optimization of distortions failed.')
@@ -288,7 +385,11 @@ def optimize_distortion(points, ns, maxfev=1000, verbose=False):
     if verbose:
         print('starting the full fit:')    
     
-    popt, flag = scipy.optimize.leastsq( residuals_dis, init_guess, args=(points, ns), maxfev=maxfev)
+    if check_jac:
+        ncempy.algo.math.check_jac( residuals_dis, jacobian_dis, init_guess, args=(points, ns) )
+    
+    popt, cov, info, msg, flag = scipy.optimize.leastsq( residuals_dis, init_guess, args=(points, ns), Dfun=Dfun, maxfev=maxfev, full_output=True)
+    nfev += info['nfev']
     
     if flag not in [1,2,3,4]:
         print('WARNING: optimization of distortions failed.')
@@ -298,6 +399,9 @@ def optimize_distortion(points, ns, maxfev=1000, verbose=False):
         for i in range(len(ns)):
             print('.. order={}, alpha={}, beta={}'.format(ns[i], popt[i*2+1], popt[i*2+2]))
 
+    if full_output:
+        return popt, {'nfev': nfev, 'flag': flag}
+
     return popt
     
     
@@ -0,0 +1,290 @@
+'''
+Module to estimate the drift in image series from the cross correlations of all frame pairs within a window.
+
+Registering every frame to its predecessor accumulates the errors of the single correlations, which gets bad for noisy low dose series. Here every frame is correlated with all frames up to a distance window, the shifts of the pairs give an overdetermined linear system for the shifts of the frames, which is solved in the least-squares sense. Pairs with large residuals are rejected and the system is solved again.
+
+The correlations are done by ncempy.algo.multicorr, every frame is Fourier transformed only once and kept as long as it is needed by later pairs.
+'''
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
+
+import ncempy.algo.multicorr
+
+
+def pair_list(num, window=None):
+    '''List of all frame pairs within a window.
+    
+    Parameters:
+        num (int):    Number of frames.
+        window (int):    Maximum distance of the frames in a pair, all pairs if None.
+    
+    Returns:
+        (np.ndarray):    Array (P, 2) of frame indices (i, j) with i < j <= i+window, sorted by j.
+    
+    '''
+    
+    try:
+        num = int(num)
+        assert(num >= 1)
+        if window is None:
+            window = max(num-1, 1)
+        window = int(window)
+        assert(window >= 1)
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    pairs = [ (i, j) for j in range(num) for i in range(max(0, j-window), j) ]
+    
+    return np.array(pairs, dtype=int).reshape((-1,2))
+
+
+def correlate_pairs(stack, pairs, method='cross', upsampleFactor=10, batchsize=None):
+    '''Cross correlate pairs of frames of a stack.
+    
+    Every frame is Fourier transformed once and its transform is dropped after the last pair using it. For pairs sorted by frame, like from pair_list, only the transforms within one window are kept in memory. The correlations are calculated in batches with ncempy.algo.multicorr.upsampled_correlation_stack.
+    
+    Parameters:
+        stack (np.ndarray):    Stack of images, frame index first. Anything sliceable along the first axis works, e.g. a memmap or an h5py dataset.
+        pairs (np.ndarray):    Array (P, 2) of frame indices.
+        method (str):    Correlation method, 'phase', 'cross' or 'hybrid'.
+        upsampleFactor (int):    Upsample factor for subpixel precision.
+        batchsize (int):    Number of pairs correlated at once, batches of about 2**16 pixels are used if None.
+    
+    Returns:
+        (np.ndarray):    Array (P, 2) with the shifts of frame j relative to frame i for every pair (i, j), as returned by multicorr.
+    
+    '''
+    
+    try:
+        assert(len(stack.shape) == 3)
+        pairs = np.asarray(pairs, dtype=int).reshape((-1,2))
+        assert(np.all(pairs >= 0))
+        assert(np.all(pairs < stack.shape[0]))
+        
+        if batchsize is None:
+            batchsize = max(1, 2**16 // (stack.shape[1]*stack.shape[2]))
+        batchsize = int(batchsize)
+        assert(batchsize > 0)
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    first = np.asarray(stack[0])
+    method, upsampleFactor = ncempy.algo.multicorr.parse_input(first, first, method, upsampleFactor)
+    
+    kernels = None
+    if upsampleFactor > 2:
+        kernels = ncempy.algo.multicorr.dftUpsampleKernels(first.shape, upsampleFactor)
+    halfKernels = None
+    if upsampleFactor > 1:
+        halfKernels = ncempy.algo.multicorr.dftUpsampleKernels(first.shape, 2)
+    
+    # last pair using each frame
+    last = {}
+    for ip in range(pairs.shape[0]):
+        last[pairs[ip,0]] = ip
+        last[pairs[ip,1]] = ip
+    
+    cache = {}
+    shifts = np.zeros((pairs.shape[0], 2))
+    
+    for start in range(0, pairs.shape[0], batchsize):
+        stop = min(start + batchsize, pairs.shape[0])
+        chunk = pairs[start:stop]
+        frames = np.unique(chunk)
+        
+        missing = [ k for k in frames if not k in cache ]
+        if len(missing) > 0:
+            G = np.fft.fft2(np.stack([ np.asarray(stack[k], dtype='float64') for k in missing ]), axes=(-2,-1))
+            for k, Gk in zip(missing, G):
+                cache[k] = Gk
+        
+        G1 = np.stack([ cache[k] for k in chunk[:,0] ])
+        G2 = np.stack([ cache[k] for k in chunk[:,1] ])
+        
+        imageCorr = ncempy.algo.multicorr.initial_correlation_image(G1, G2, method)
+        shifts[start:stop] = ncempy.algo.multicorr.upsampled_correlation_stack(imageCorr, upsampleFactor, kernels, direct=True, halfKernels=halfKernels)
+        
+        # drop transforms not needed anymore
+        for k in frames:
+            if last[k] < stop:
+                del cache[k]
+    
+    return shifts
+
+
+def _connected(num, pairs):
+    '''Check if all frames are connected by the pairs.
+    
+    Parameters:
+        num (int):    Number of frames.
+        pairs (np.ndarray):    Array (P, 2) of frame indices.
+    
+    Returns:
+        (bool):    True if all frames are linked to each other.
+    
+    '''
+    
+    graph = scipy.sparse.csr_matrix( (np.ones(pairs.shape[0]), (pairs[:,0], pairs[:,1])), shape=(num, num) )
+    ncomp = scipy.sparse.csgraph.connected_components(graph, directed=False, return_labels=False)
+    
+    return ncomp == 1
+
+
+def _spanning_pairs(num, pairs, res):
+    '''Pairs of the minimum spanning tree with the residuals as edge weights.
+    
+    Parameters:
+        num (int):    Number of frames.
+        pairs (np.ndarray):    Array (P, 2) of frame indices.
+        res (np.ndarray):    Residuals of the pairs.
+    
+    Returns:
+        (np.ndarray):    Boolean array marking the pairs of the tree.
+    
+    '''
+    
+    # zero weights would be missing edges
+    graph = scipy.sparse.csr_matrix( (res + 1e-12, (pairs[:,0], pairs[:,1])), shape=(num, num) )
+    tree = scipy.sparse.csgraph.minimum_spanning_tree(graph).tocoo()
+    
+    edges = set(zip(tree.row, tree.col)) | set(zip(tree.col, tree.row))
+    
+    return np.array([ (i, j) in edges for i, j in pairs ], dtype=bool)
+
+
+def solve_shifts(num, pairs, pair_shifts, weights=None):
+    '''Least-squares shifts of the frames from the shifts of frame pairs.
+    
+    The shift of pair (i, j) is modeled as d_j - d_i, the first frame is fixed at zero. The normal equations are sparse and banded for windowed pairs, so they are solved directly.
+    
+    Parameters:
+        num (int):    Number of frames.
+        pairs (np.ndarray):    Array (P, 2) of frame indices.
+        pair_shifts (np.ndarray):    Array (P, 2) of the shifts of the pairs.
+        weights (np.ndarray):    Weights of the pairs, all equal if None.
+    
+    Returns:
+        (np.ndarray):    Array (num, 2) of the shifts of the frames.
+    
+    '''
+    
+    try:
+        num = int(num)
+        pairs = np.asarray(pairs, dtype=int).reshape((-1,2))
+        pair_shifts = np.asarray(pair_shifts, dtype='float64')
+        assert(pair_shifts.shape == pairs.shape)
+        assert(np.all(pairs >= 0))
+        assert(np.all(pairs < num))
+        
+        if weights is None:
+            weights = np.ones(pairs.shape[0])
+        weights = np.asarray(weights, dtype='float64')
+        assert(weights.shape == (pairs.shape[0],))
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    if not _connected(num, pairs[weights > 0]):
+        raise RuntimeError('The pairs do not connect all frames.')
+    
+    shifts = np.zeros((num, 2))
+    if num == 1:
+        return shifts
+    
+    npairs = pairs.shape[0]
+    A = scipy.sparse.csr_matrix( (np.concatenate((-np.ones(npairs), np.ones(npairs))), (np.tile(np.arange(npairs), 2), np.concatenate((pairs[:,0], pairs[:,1])))), shape=(npairs, num) )
+    AtW = A.transpose().multiply(weights[np.newaxis,:]).tocsr()
+    
+    # drop the first frame to fix the origin
+    L = (AtW @ A).tocsc()[1:,1:]
+    b = AtW @ pair_shifts
+    
+    shifts[1:] = np.reshape(scipy.sparse.linalg.spsolve(L, b[1:]), (num-1, 2))
+    
+    return shifts
+
+
+def solve_shifts_robust(num, pairs, pair_shifts, reject=3., min_residual=0.1, iterations=5):
+    '''Least-squares shifts of the frames with rejection of outlier pairs.
+    
+    After the first solution, pairs with residuals above reject times the median residual (but at least min_residual) are rejected and the shifts solved again, until the selection does not change anymore. Rejected pairs can come back in later iterations. The pairs of a minimum spanning tree of the residuals are never rejected, so all frames stay connected.
+    
+    Parameters:
+        num (int):    Number of frames.
+        pairs (np.ndarray):    Array (P, 2) of frame indices.
+        pair_shifts (np.ndarray):    Array (P, 2) of the shifts of the pairs.
+        reject (float):    Pairs with residuals above reject times the median residual are rejected.
+        min_residual (float):    Pairs with residuals below this are never rejected [px].
+        iterations (int):    Maximum number of rejection rounds.
+    
+    Returns:
+        (tuple):    Shifts (num, 2) of the frames and a boolean array marking the pairs used.
+    
+    '''
+    
+    try:
+        reject = float(reject)
+        assert(reject > 0)
+        min_residual = float(min_residual)
+        iterations = int(iterations)
+        assert(iterations >= 0)
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    # includes the check of the other input
+    shifts = solve_shifts(num, pairs, pair_shifts)
+    
+    pairs = np.asarray(pairs, dtype=int).reshape((-1,2))
+    pair_shifts = np.asarray(pair_shifts, dtype='float64')
+    used = np.ones(pairs.shape[0], dtype=bool)
+    if pairs.shape[0] == 0:
+        return shifts, used
+    
+    for it in range(iterations):
+        res = np.sqrt(np.sum(np.square(pair_shifts - (shifts[pairs[:,1]] - shifts[pairs[:,0]])), axis=1))
+        thresh = max(reject*np.median(res[used]), min_residual)
+        new_used = np.logical_or(res <= thresh, _spanning_pairs(num, pairs, res))
+        
+        if np.array_equal(new_used, used):
+            break
+        
+        used = new_used
+        shifts = solve_shifts(num, pairs[used], pair_shifts[used])
+    
+    return shifts, used
+
+
+def estimate_drift(stack, window=10, method='cross', upsampleFactor=10, reject=3., min_residual=0.1, iterations=5, batchsize=None):
+    '''Estimate the drift of an image series from all frame pairs within a window.
+    
+    Correlates the pairs from pair_list with correlate_pairs and solves for the shifts of the frames with solve_shifts_robust.
+    
+    Parameters:
+        stack (np.ndarray):    Stack of images, frame index first.
+        window (int):    Maximum distance of the frames in a pair, all pairs if None.
+        method (str):    Correlation method, 'phase', 'cross' or 'hybrid'.
+        upsampleFactor (int):    Upsample factor for subpixel precision.
+        reject (float):    Pairs with residuals above reject times the median residual are rejected.
+        min_residual (float):    Pairs with residuals below this are never rejected [px].
+        iterations (int):    Maximum number of rejection rounds.
+        batchsize (int):    Number of pairs correlated at once, see correlate_pairs.
+    
+    Returns:
+        (tuple):    Shifts (N, 2) of the frames relative to the first one, the pairs (P, 2), their shifts (P, 2) and a boolean array marking the pairs used.
+    
+    '''
+    
+    try:
+        assert(len(stack.shape) == 3)
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    num = stack.shape[0]
+    pairs = pair_list(num, window)
+    pair_shifts = correlate_pairs(stack, pairs, method, upsampleFactor, batchsize)
+    
+    shifts, used = solve_shifts_robust(num, pairs, pair_shifts, reject, min_residual, iterations)
+    
+    return shifts, pairs, pair_shifts, used
@@ -2,21 +2,291 @@
 Module to find local maxima in an image.
 '''
 
+import os
+import time
+import concurrent.futures
+
 import numpy as np
 import scipy.ndimage.filters
 
 import matplotlib.pyplot as plt
 
 
-def local_max(img, r, thresh):
+def _circular_kernel(r):
+    '''Circular footprint of radius r.
+    
+    Parameters:
+        r (int):    Radius.
+        
+    Returns:
+        (np.ndarray):    Boolean footprint of shape (2r+1, 2r+1).
+        
+    '''
+    
+    y,x = np.ogrid[-r:r+1, -r:r+1]
+    return x**2 + y**2 <= r**2
+    
+    
+def _chord_halfwidth(r, dy):
+    '''Half width of the chord of the circular footprint at row offset dy.
+    
+    Parameters:
+        r (int):    Radius.
+        dy (int):    Row offset, abs(dy) <= r.
+        
+    Returns:
+        (int):    Largest dx with dx**2 + dy**2 <= r**2.
+        
+    '''
+    
+    rest = r*r - dy*dy
+    w = int(np.sqrt(rest))
+    # fix possible floating point rounding
+    while (w+1)**2 <= rest:
+        w += 1
+    while w*w > rest:
+        w -= 1
+    return w
+    
+
+def _rect_halfwidths(r, n_rects):
+    '''Half widths of the rectangles approximating the circular footprint.
+    
+    The corners of the rectangles lie inside the circle, so their union is contained in the circular footprint. The two lines along the axes are always included.
+    
+    Parameters:
+        r (int):    Radius.
+        n_rects (int):    Number of rectangles besides the two axis lines.
+        
+    Returns:
+        (list):    List of (row, column) half widths.
+        
+    '''
+    
+    rects = set([(0, r), (r, 0)])
+    for j in range(1, n_rects+1):
+        dy = int(np.floor(r*np.sin(j*np.pi/(2*(n_rects+1)))))
+        rects.add( (dy, _chord_halfwidth(r, dy)) )
+    
+    return sorted(rects)
+    
+
+def filter_footprint(r, mode='footprint', n_rects=4):
+    '''Effective footprint used by the max/min filters for the given mode.
+    
+    Useful to check the approximation of the 'rects' mode against the circular footprint.
+    
+    Parameters:
+        r (int):    Radius.
+        mode (str):    One of 'footprint', 'lines' (both exactly circular) or 'rects' (approximated).
+        n_rects (int):    Number of rectangles in 'rects' mode.
+        
+    Returns:
+        (np.ndarray):    Boolean footprint of shape (2r+1, 2r+1).
+        
+    '''
+    
+    try:
+        r = int(r)
+        assert(mode in ('footprint', 'lines', 'rects'))
+    except:
+        raise TypeError('Bad input!')
+    
+    if mode in ('footprint', 'lines'):
+        return _circular_kernel(r)
+    
+    y,x = np.ogrid[-r:r+1, -r:r+1]
+    kernel = np.zeros((2*r+1, 2*r+1), dtype=bool)
+    for (b, a) in _rect_halfwidths(r, int(n_rects)):
+        kernel |= (np.abs(y) <= b)*(np.abs(x) <= a)
+    return kernel
+    
+    
+def _disk_filter_lines(img, r, filter1d, combine):
+    '''Morphological filter over a circular footprint decomposed into horizontal lines.
+    
+    The footprint is the union of one chord per row offset. Each chord is a 1D running max/min along the last axis, which costs O(1) per pixel, and the chords are combined by shifting along the second to last axis. Total cost is O(r) per pixel instead of O(r**2). Boundaries are treated as scipy.ndimage's default 'reflect' mode, so results are identical to the footprint filter.
+    
+    Parameters:
+        img (np.ndarray):    Image or stack of images (last two axes).
+        r (int):    Radius.
+        filter1d (function):    scipy.ndimage maximum_filter1d or minimum_filter1d.
+        combine (function):    np.maximum or np.minimum.
+    
+    Returns:
+        (np.ndarray):    Filtered image.
+        
+    '''
+    
+    ny = img.shape[-2]
+    pad = [(0,0)]*(len(img.shape)-2) + [(r,r), (0,0)]
+    padded = np.pad(img, pad, mode='symmetric')
+    
+    out = None
+    w_line = None
+    for dy in range(0, r+1):
+        w = _chord_halfwidth(r, dy)
+        if w != w_line:
+            line = filter1d(padded, 2*w+1, axis=-1)
+            w_line = w
+        for shift in set((dy, -dy)):
+            part = line[..., r+shift:r+shift+ny, :]
+            if out is None:
+                out = np.copy(part)
+            else:
+                combine(out, part, out=out)
+    
+    return out
+    
+
+def _disk_filter_rects(img, r, n_rects, filter1d, combine):
+    '''Morphological filter over a union of rectangles approximating a circular footprint.
+    
+    Every rectangle is separable into two 1D running max/min passes, so the cost is O(n_rects) per pixel independent of r.
+    
+    Parameters:
+        img (np.ndarray):    Image or stack of images (last two axes).
+        r (int):    Radius.
+        n_rects (int):    Number of rectangles besides the two axis lines.
+        filter1d (function):    scipy.ndimage maximum_filter1d or minimum_filter1d.
+        combine (function):    np.maximum or np.minimum.
+    
+    Returns:
+        (np.ndarray):    Filtered image.
+        
+    '''
+    
+    out = None
+    for (b, a) in _rect_halfwidths(r, n_rects):
+        part = filter1d(filter1d(img, 2*a+1, axis=-1), 2*b+1, axis=-2)
+        if out is None:
+            out = part
+        else:
+            combine(out, part, out=out)
+    
+    return out
+    
+    
+def max_min_filter(img, r, mode='footprint', n_rects=4):
+    '''Calculate the maximum and minimum filtered images for a circular footprint.
+    
+    Filtering is done over the last two axes, so stacks of images are filtered frame by frame.
+    
+    The modes are:
+    
+        * 'footprint':    scipy.ndimage filters with the circular footprint, O(r**2) per pixel.
+        * 'lines':    exact decomposition into horizontal chords, O(r) per pixel.
+        * 'rects':    approximation of the footprint by a union of n_rects+2 rectangles, O(n_rects) per pixel. The approximated footprint (see filter_footprint) lies inside the circle.
+    
+    Parameters:
+        img (np.ndarray):    Input image or stack of images.
+        r (int):    Radius of the footprint.
+        mode (str):    Filter engine to use.
+        n_rects (int):    Number of rectangles in 'rects' mode.
+    
+    Returns:
+        (tuple):    Maximum and minimum filtered images.
+        
+    '''
+    
+    try:
+        r = int(r)
+        n_rects = int(n_rects)
+        assert(isinstance(img, np.ndarray))
+        assert(len(img.shape) >= 2)
+        assert(mode in ('footprint', 'lines', 'rects'))
+    except:
+        raise TypeError('Bad input!')
+    
+    if mode == 'footprint':
+        kernel = _circular_kernel(r)
+        kernel = np.reshape(kernel, (1,)*(len(img.shape)-2) + kernel.shape)
+        img_dil = scipy.ndimage.filters.maximum_filter(img, footprint=kernel)
+        img_ero = scipy.ndimage.filters.minimum_filter(img, footprint=kernel)
+    elif mode == 'lines':
+        img_dil = _disk_filter_lines(img, r, scipy.ndimage.filters.maximum_filter1d, np.maximum)
+        img_ero = _disk_filter_lines(img, r, scipy.ndimage.filters.minimum_filter1d, np.minimum)
+    else:
+        img_dil = _disk_filter_rects(img, r, n_rects, scipy.ndimage.filters.maximum_filter1d, np.maximum)
+        img_ero = _disk_filter_rects(img, r, n_rects, scipy.ndimage.filters.minimum_filter1d, np.minimum)
+    
+    return img_dil, img_ero
+    
+    
+def benchmark_max_min(radii=(5, 10, 20, 40), sizes=(512, 1024, 2048), modes=('footprint', 'lines', 'rects'), repeat=1, verbose=True):
+    '''Benchmark the filter engines of max_min_filter across radii and image sizes.
+    
+    Random square float64 images are filtered, the best of repeat runs is taken. The coverage is the fraction of the circular footprint covered by the effective footprint of the mode.
+    
+    Parameters:
+        radii (tuple):    Radii to test.
+        sizes (tuple):    Edge lengths of the square images to test.
+        modes (tuple):    Modes to test.
+        repeat (int):    Number of runs per combination.
+        verbose (bool):    Set to print a table of the results.
+    
+    Returns:
+        (list):    List of dicts with keys size, r, mode, time [s] and coverage.
+        
+    '''
+    
+    results = []
+    rng = np.random.RandomState(0)
+    
+    if verbose:
+        print('{:>6} {:>4} {:>10} {:>10} {:>9}'.format('size', 'r', 'mode', 'time /s', 'coverage'))
+    
+    for size in sizes:
+        img = rng.rand(size, size)
+        for r in radii:
+            circle = _circular_kernel(r)
+            for mode in modes:
+                times = []
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    max_min_filter(img, r, mode=mode)
+                    times.append(time.perf_counter() - start)
+                coverage = np.sum(filter_footprint(r, mode=mode))/np.sum(circle)
+                results.append( {'size': size, 'r': r, 'mode': mode, 'time': min(times), 'coverage': coverage} )
+                if verbose:
+                    print('{:>6} {:>4} {:>10} {:>10.4f} {:>9.3f}'.format(size, r, mode, min(times), coverage))
+    
+    return results
+    
+    
+def _local_max_sel(img, r, thresh, mode='footprint'):
+    '''Selection of local maxima from comparing dilated and eroded images.
+    
+    Parameters:
+        img (np.ndarray):    Input image or stack (last two axes are filtered).
+        r (int):    Radius for locality.
+        thresh (float):    Intensity difference threshold.
+        mode (str):    Filter engine, see max_min_filter.
+    
+    Returns:
+        (np.ndarray):    Boolean selection of local maxima.
+        
+    '''
+    
+    # calculate max and min images
+    img_dil, img_ero = max_min_filter(img, r, mode=mode)
+    
+    # get selection of local maxima
+    return (img==img_dil)*(img-img_ero > thresh)
+
+
+def local_max(img, r, thresh, mode='footprint'):
     '''Find local maxima from comparing dilated and eroded images.
     
     Calculates images with maximum and minimum within given radius. If the difference is larger than the threshold, the original pixel position with max value is detected as local maximum.
     
+    For large r use mode='lines' (exact) or mode='rects' (approximated footprint), see max_min_filter.
+    
     Parameters:
         img (np.ndarray):    Input image.
         r (int):    Radius for locality.
         thresh (int/float):    Intensity difference threshold.
+        mode (str):    Filter engine, one of 'footprint', 'lines' or 'rects'.
     
     Returns:
         (np.ndarray):    Array of points.
@@ -25,22 +295,15 @@ def local_max(img, r, thresh):
     
     try:
         r = int(r)
-        thresh = int(thresh)
+        thresh = float(thresh)
         assert(isinstance(img, np.ndarray))
+        assert(mode in ('footprint', 'lines', 'rects'))
     except:
         raise TypeError('Bad input!')
     
     
-    # prepare circular kernel
-    y,x = np.ogrid[-r:r+1, -r:r+1]
-    kernel = x**2 + y**2 <= r**2
-    
-    # calculate max and min images
-    img_dil = scipy.ndimage.filters.maximum_filter(img, footprint=kernel)
-    img_ero = scipy.ndimage.filters.minimum_filter(img, footprint=kernel)
-    
     # get selection of local maxima
-    sel = (img==img_dil)*(img-img_ero > thresh)
+    sel = _local_max_sel(img, r, thresh, mode=mode)
     
     if sel.any():  
         # retrieve and return points
@@ -52,6 +315,138 @@ def local_max(img, r, thresh):
         # otherwise return None to avoid having an empty list
         return None
         
+        
+def local_max_stack(stack, r, thresh, workers=None, chunksize=None, mode='footprint'):
+    '''Find local maxima in every image of a stack.
+    
+    Same detection as local_max, but the filters are applied to all images of the (N, Y, X) stack at once, extending only along the image axes. The stack is split into chunks of frames, which are processed in a thread pool (scipy.ndimage releases the GIL).
+    
+    Parameters:
+        stack (np.ndarray):    Input stack of images, frame index first.
+        r (int):    Radius for locality.
+        thresh (int/float):    Intensity difference threshold.
+        workers (int):    Number of threads, defaults to the number of CPUs.
+        chunksize (int):    Number of frames per chunk, defaults to distribute the frames evenly over the workers.
+        mode (str):    Filter engine, one of 'footprint', 'lines' or 'rects'.
+    
+    Returns:
+        (np.ndarray):    Array of points with three columns (frame index, row, column) or None if no points were found.
+        
+    '''
+    
+    try:
+        r = int(r)
+        thresh = float(thresh)
+        assert(isinstance(stack, np.ndarray))
+        assert(len(stack.shape) == 3)
+        
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = int(workers)
+        assert(workers >= 1)
+        
+        if chunksize is None:
+            chunksize = int(np.ceil(stack.shape[0]/workers))
+        chunksize = max(int(chunksize), 1)
+        
+        assert(mode in ('footprint', 'lines', 'rects'))
+    except:
+        raise TypeError('Bad input!')
+    
+    
+    # filters only extend along the image axes
+    def proc_chunk(start):
+        points = np.argwhere(_local_max_sel(stack[start:start+chunksize], r, thresh, mode=mode))
+        points[:,0] += start
+        return points
+    
+    starts = range(0, stack.shape[0], chunksize)
+    if workers == 1 or len(starts) == 1:
+        results = [proc_chunk(start) for start in starts]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(proc_chunk, starts))
+    
+    if len(results) > 0:
+        points = np.concatenate(results, axis=0)
+        if points.shape[0] > 0:
+            return points
+    
+    # otherwise return None to avoid having an empty list
+    return None
+    
+    
+def refine_points(img, points, method='quadratic', r=1):
+    '''Refine integer local maxima positions to subpixel precision.
+    
+    All points are processed at once by gathering their neighborhoods with fancy indexing. Available methods:
+    
+        * 'centroid':    Intensity weighted centroid in a (2r+1, 2r+1) window after subtracting the window minimum.
+        * 'quadratic':    Parabola through the maximum and its direct neighbors, separately along each axis.
+        * 'gaussian':    Same as 'quadratic' on the logarithm of the intensities, exact for Gaussian peaks.
+    
+    Corrections are limited to the window, points whose window exceeds the image are not refined.
+    
+    Parameters:
+        img (np.ndarray):    Input image.
+        points (np.ndarray):    Integer positions as returned by local_max.
+        method (str):    Refinement method.
+        r (int):    Window radius for 'centroid'.
+    
+    Returns:
+        (np.ndarray):    Refined positions as float array.
+        
+    '''
+    
+    try:
+        assert(isinstance(img, np.ndarray))
+        assert(len(img.shape) == 2)
+        points = np.reshape(np.array(points), (-1,2)).astype(int)
+        assert(method in ('centroid', 'quadratic', 'gaussian'))
+        r = int(r)
+        assert(r >= 1)
+    except:
+        raise TypeError('Bad input!')
+    
+    if method != 'centroid':
+        r = 1
+    
+    # points with complete window
+    inside = np.all( (points >= r) & (points < np.array(img.shape)-r), axis=1 )
+    pts = points[inside]
+    
+    # gather all windows, shape (npoints, 2r+1, 2r+1)
+    offs = np.arange(-r, r+1)
+    win = img[ pts[:,0,np.newaxis,np.newaxis] + offs[np.newaxis,:,np.newaxis], pts[:,1,np.newaxis,np.newaxis] + offs[np.newaxis,np.newaxis,:] ].astype('float64')
+    
+    # flat windows lead to divisions by zero, handled below
+    old_err_state = np.seterr(divide='ignore',invalid='ignore')
+    
+    if method == 'centroid':
+        win -= np.min(win, axis=(1,2))[:,np.newaxis,np.newaxis]
+        norm = np.sum(win, axis=(1,2))
+        dy = np.sum(win*offs[np.newaxis,:,np.newaxis], axis=(1,2))/norm
+        dx = np.sum(win*offs[np.newaxis,np.newaxis,:], axis=(1,2))/norm
+        
+    else:
+        if method == 'gaussian':
+            win = np.log(np.maximum(win, np.finfo('float64').tiny))
+        
+        dy = (win[:,0,1] - win[:,2,1])/(2.*(win[:,0,1] - 2.*win[:,1,1] + win[:,2,1]))
+        dx = (win[:,1,0] - win[:,1,2])/(2.*(win[:,1,0] - 2.*win[:,1,1] + win[:,1,2]))
+        
+    np.seterr(**old_err_state)
+    
+    # flat windows or failing fits give no correction
+    dy[np.logical_not(np.isfinite(dy))] = 0.
+    dx[np.logical_not(np.isfinite(dx))] = 0.
+    
+    refined = points.astype('float64')
+    refined[inside,0] += np.clip(dy, -r, r)
+    refined[inside,1] += np.clip(dx, -r, r)
+    
+    return refined
+    
     
 def plot_points(img, points, vminmax=(0,1), dims=None, invert=False, show=False):
     '''Plot the detected points on the input image for checking.
@@ -116,7 +511,7 @@ def plot_points(img, points, vminmax=(0,1), dims=None, invert=False, show=False)
 def points_todim(points, dims):
     '''Convert points from px coordinates to real dim.
     
-    Points are expected to be array indices for the first two dimensions in dims.
+    Points are expected to be array indices for the first two dimensions in dims. Non-integer (subpixel) points are linearly interpolated between the dimension vector entries.
     
     Parameters:
         points (np.ndarray):    Points to convert.
@@ -136,7 +531,12 @@ def points_todim(points, dims):
     except:
         raise TypeError('Something wrong with the input!')
     
-    # do the conversion by looking up thing in dimension vectors
-    points_d = np.array( [ dims[0][0][points[:,0]], dims[1][0][points[:,1]] ] ).transpose()
+    if np.issubdtype(points.dtype, np.integer):
+        # do the conversion by looking up thing in dimension vectors
+        points_d = np.array( [ dims[0][0][points[:,0]], dims[1][0][points[:,1]] ] ).transpose()
+    else:
+        # interpolate for subpixel positions
+        points_d = np.array( [ np.interp(points[:,0], np.arange(dims[0][0].shape[0]), dims[0][0]),
+                               np.interp(points[:,1], np.arange(dims[1][0].shape[0]), dims[1][0]) ] ).transpose()
     
     return points_d
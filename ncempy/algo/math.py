@@ -1,7 +1,7 @@
 '''
 Module containing definitions of basic math functions, which can be used for fitting.
 
-If you add functions here, do not forget to update the lookup table at the bottom as well.
+If you add functions here, do not forget to update the lookup table at the bottom as well. Providing the derivatives with respect to the parameters (the Jacobian) is optional, but saves the numerical differentiation during fitting.
 '''
 
 import numpy as np
@@ -24,6 +24,20 @@ def const( x, param):
     
     return param[0]*np.ones(x.shape)
 
+def const_jac( x, param):
+    '''Derivatives of constant function with respect to its parameters.
+    
+    Parameters:
+        x (np.ndarray):    Positions at which to evaluate derivatives.
+        param (np.ndarray):    Necessary parameters.
+        
+    Returns:
+        (np.ndarray):    Derivatives at x, shape (len(x), 1).
+        
+    '''
+    
+    return np.ones(x.shape + (1,))
+
 def linear( x, param):
     '''Linear function.
     
@@ -40,6 +54,20 @@ def linear( x, param):
     
     return param[0]*x + param[1]
 
+def linear_jac( x, param):
+    '''Derivatives of linear function with respect to its parameters.
+    
+    Parameters:
+        x (np.ndarray):    Positions at which to evaluate derivatives.
+        param (np.ndarray):    Necessary parameters.
+        
+    Returns:
+        (np.ndarray):    Derivatives at x, shape (len(x), 2).
+        
+    '''
+    
+    return np.stack( (x, np.ones(x.shape)), axis=-1 )
+
 def powlaw( x, param):
     '''Power law.
     
@@ -58,6 +86,29 @@ def powlaw( x, param):
     ## A*x^n
     return param[0]*np.power(x, param[1])
     
+def powlaw_jac( x, param):
+    '''Derivatives of power law with respect to its parameters.
+    
+    The derivative with respect to the exponent is set to 0 for x <= 0.
+    
+    Parameters:
+        x (np.ndarray):    Positions at which to evaluate derivatives.
+        param (np.ndarray):    Necessary parameters.
+        
+    Returns:
+        (np.ndarray):    Derivatives at x, shape (len(x), 2).
+        
+    '''
+    
+    xn = np.power(x, param[1])
+    
+    # log only defined for positive x
+    logx = np.zeros(x.shape)
+    pos = x > 0
+    logx[pos] = np.log(x[pos])
+    
+    return np.stack( (xn, param[0]*xn*logx), axis=-1 )
+    
 
 def voigt( x, param):
     '''
@@ -79,6 +130,33 @@ def voigt( x, param):
     # gamma = param[3]
     return param[0]*np.real(scipy.special.wofz((x-param[1] + 1.0j*param[3])/(param[2]*np.sqrt(2.0))))/(param[2]*np.sqrt(2.0*np.pi))
 
+def voigt_jac( x, param):
+    '''Derivatives of Voigt peak function with respect to its parameters.
+    
+    Uses the derivative of the Faddeeva function w'(z) = -2 z w(z) + 2i/sqrt(pi).
+    
+    Parameters:
+        x (np.ndarray):    Positions at which to evaluate derivatives.
+        param (np.ndarray):    Necessary parameters.
+        
+    Returns:
+        (np.ndarray):    Derivatives at x, shape (len(x), 4).
+        
+    '''
+    
+    z = (x-param[1] + 1.0j*param[3])/(param[2]*np.sqrt(2.0))
+    w = scipy.special.wofz(z)
+    dw = -2.0*z*w + 2.0j/np.sqrt(np.pi)
+    
+    norm = 1./(param[2]*np.sqrt(2.0*np.pi))
+    
+    d_A = norm*np.real(w)
+    d_mu = -param[0]*norm*np.real(dw)/(param[2]*np.sqrt(2.0))
+    d_sigma = -param[0]*norm*(np.real(z*dw) + np.real(w))/param[2]
+    d_gamma = -param[0]*norm*np.imag(dw)/(param[2]*np.sqrt(2.0))
+    
+    return np.stack( (d_A, d_mu, d_sigma, d_gamma), axis=-1 )
+
 
 def sum_functions( x, funcs, param ):
     '''
@@ -106,10 +184,303 @@ def sum_functions( x, funcs, param ):
     return est
     
 
+def sum_functions_jac( x, funcs, param ):
+    '''
+    Jacobian of the sum of functions in funcs with respect to all parameters.
+    
+    Functions without analytic derivatives in lkp_funcs are differentiated numerically.
+    
+    Parameters:
+        x (np.ndarray):    Positions at which to evaluate the derivatives.
+        funcs (list):    List of strings identifying function implemented in ncempy.algo.math.
+        param (np.ndarray):    Concatenated parameters for functions in funcs.
+        
+    Returns:
+        (np.ndarray):   Jacobian of shape (len(x), len(param)).
+        
+    '''
+    
+    jac = np.zeros(x.shape + (len(param),))
+    
+    n = 0
+    # evaluate derivatives of given functions
+    for i in range(len(funcs)):
+        func, npar, dfunc = lkp_funcs[funcs[i]][0:3]
+        if dfunc is None:
+            jac[...,n:n+npar] = num_jac( lambda p: func(x, p), param[n:n+npar] )
+        else:
+            jac[...,n:n+npar] = dfunc( x, param[n:n+npar] )
+        n += npar
+    
+    return jac
+    
+
+def num_jac( fun, param, eps=None ):
+    '''
+    Numerical Jacobian by forward differences.
+    
+    Parameters:
+        fun (function):    Function of param returning an np.ndarray.
+        param (np.ndarray):    Parameters at which to differentiate.
+        eps (float):    Relative step size, defaults to sqrt of machine precision.
+        
+    Returns:
+        (np.ndarray):    Jacobian of shape fun(param).shape + (len(param),).
+        
+    '''
+    
+    if eps is None:
+        eps = np.sqrt(np.finfo('float64').eps)
+    
+    param = np.array(param, dtype='float64')
+    # copy in case fun reuses its output buffer
+    f0 = np.array(fun(param))
+    jac = np.zeros(np.shape(f0) + (len(param),))
+    
+    for i in range(len(param)):
+        h = eps*max(abs(param[i]), 1.0)
+        p = np.copy(param)
+        p[i] += h
+        jac[...,i] = (fun(p) - f0)/h
+    
+    return jac
+    
+
+def check_jac( fun, jac, param, args=(), rtol=1e-4 ):
+    '''
+    Compare an analytic Jacobian against finite differences.
+    
+    Prints a warning if the relative deviation exceeds rtol.
+    
+    Parameters:
+        fun (function):    Function fun(param, *args) returning an np.ndarray.
+        jac (function):    Analytic Jacobian jac(param, *args), shape fun(param, *args).shape + (len(param),).
+        param (np.ndarray):    Parameters at which to compare.
+        args (tuple):    Further arguments to fun and jac.
+        rtol (float):    Tolerated deviation relative to the largest derivative of each parameter.
+        
+    Returns:
+        (float):    Largest relative deviation.
+        
+    '''
+    
+    param = np.array(param, dtype='float64')
+    
+    j_ana = np.array(jac(param, *args))
+    j_num = num_jac( lambda p: fun(p, *args), param )
+    
+    scale = np.max(np.abs(j_num), axis=0)
+    scale[scale == 0] = 1.
+    dev = np.max(np.abs(j_ana - j_num)/scale)
+    
+    if dev > rtol:
+        print('WARNING: analytic Jacobian deviates from finite differences by {:g}.'.format(dev))
+    
+    return dev
+    
+
 # lookup table for functions
-lkp_funcs = { 'const': (const, 1),
-              'linear': (linear, 2),
-              'powlaw': (powlaw, 2),
-              'voigt': (voigt, 4)
+lkp_funcs = { 'const': (const, 1, const_jac),
+              'linear': (linear, 2, linear_jac),
+              'powlaw': (powlaw, 2, powlaw_jac),
+              'voigt': (voigt, 4, voigt_jac)
             }
-'''(dict):    Look-up table for functions implemented in this module. Functions are identified by strings, the entries give handles to the functions as well as the number of arguments necessary.'''
+'''(dict):    Look-up table for functions implemented in this module. Functions are identified by strings, the entries give handles to the functions, the number of arguments necessary and handles to the functions' derivatives (or None).'''
+
+
+class CompositeModel:
+    '''Sum of functions in lkp_funcs compiled for repeated evaluation.
+    
+    The look-ups in lkp_funcs and the parameter slices are resolved once, so that fitting a sum of functions does not repeat the dispatch of sum_functions in every residual call. If positions are bound, the results are written into preallocated scratch buffers.
+    
+    Parameters:
+        funcs (list):    List of strings identifying function implemented in ncempy.algo.math.
+        x (np.ndarray):    Positions to bind, can be set later using bind().
+    
+    '''
+    
+    def __init__(self, funcs, x=None):
+        '''Init resolving functions and parameter slices.
+        
+        '''
+        
+        try:
+            assert(len(funcs)>=1)
+            for i in range(len(funcs)):
+                assert(funcs[i] in lkp_funcs)
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        self.funcs = tuple(funcs)
+        
+        self._parts = []
+        n = 0
+        for name in self.funcs:
+            func, npar, dfunc = lkp_funcs[name][0:3]
+            self._parts.append( (func, dfunc, slice(n, n+npar)) )
+            n += npar
+        self.nparams = n
+        
+        self.x = None
+        if not x is None:
+            self.bind(x)
+    
+    def bind(self, x):
+        '''Bind positions and allocate the scratch buffers.
+        
+        Parameters:
+            x (np.ndarray):    Positions at which to evaluate the functions.
+        
+        '''
+        
+        try:
+            assert(isinstance(x, np.ndarray))
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        self.x = x
+        self._est = np.zeros(x.shape)
+        self._jac = np.zeros(x.shape + (self.nparams,))
+    
+    def _check_param(self, param):
+        '''Check the parameter vector and bound positions.
+        
+        '''
+        
+        if self.x is None:
+            raise RuntimeError('No positions bound to the model!')
+        
+        param = np.asarray(param, dtype='float64')
+        if param.shape != (self.nparams,):
+            raise TypeError('Something wrong with the input!')
+        
+        return param
+    
+    def evaluate(self, param, out=None):
+        '''Evaluate the sum of functions at the bound positions.
+        
+        Parameters:
+            param (np.ndarray):    Concatenated parameters for functions in funcs.
+            out (np.ndarray):    Array to write the result to, defaults to the internal scratch buffer.
+        
+        Returns:
+            (np.ndarray):    Values of sum of functions at x, overwritten by the next call if out is None.
+        
+        '''
+        
+        param = self._check_param(param)
+        
+        if out is None:
+            out = self._est
+        
+        for i, (func, dfunc, sl) in enumerate(self._parts):
+            if i == 0:
+                out[...] = func( self.x, param[sl] )
+            else:
+                out += func( self.x, param[sl] )
+        
+        return out
+    
+    def __call__(self, param):
+        '''Evaluate the sum of functions at the bound positions into a new array.
+        
+        Parameters:
+            param (np.ndarray):    Concatenated parameters for functions in funcs.
+        
+        Returns:
+            (np.ndarray):    Values of sum of functions at x.
+        
+        '''
+        
+        return self.evaluate( param, out=np.empty(self.x.shape) if not self.x is None else None )
+    
+    def jacobian(self, param, out=None):
+        '''Jacobian with respect to all parameters at the bound positions.
+        
+        Functions without analytic derivatives are differentiated numerically.
+        
+        Parameters:
+            param (np.ndarray):    Concatenated parameters for functions in funcs.
+            out (np.ndarray):    Array to write the result to, defaults to the internal scratch buffer.
+        
+        Returns:
+            (np.ndarray):    Jacobian of shape (len(x), nparams), overwritten by the next call if out is None.
+        
+        '''
+        
+        param = self._check_param(param)
+        
+        if out is None:
+            out = self._jac
+        
+        for (func, dfunc, sl) in self._parts:
+            if dfunc is None:
+                out[...,sl] = num_jac( lambda p: func(self.x, p), param[sl] )
+            else:
+                out[...,sl] = dfunc( self.x, param[sl] )
+        
+        return out
+    
+    def residuals(self, param, intens):
+        '''Residuals intens - model for least squares fitting.
+        
+        Parameters:
+            param (np.ndarray):    Concatenated parameters for functions in funcs.
+            intens (np.ndarray):    Data to compare to.
+        
+        Returns:
+            (np.ndarray):    Residuals.
+        
+        '''
+        
+        # new array, scipy.optimize.leastsq keeps references to returned residuals
+        return intens - self.evaluate(param)
+    
+    def residuals_jac(self, param, intens):
+        '''Jacobian of residuals() with respect to all parameters.
+        
+        Parameters:
+            param (np.ndarray):    Concatenated parameters for functions in funcs.
+            intens (np.ndarray):    Data to compare to (not used).
+        
+        Returns:
+            (np.ndarray):    Jacobian of shape (len(x), nparams).
+        
+        '''
+        
+        return np.negative( self.jacobian(param) )
+    
+    def evaluate_batch(self, params, x=None):
+        '''Evaluate the model for many parameter vectors at once.
+        
+        The functions are evaluated with broadcasting parameters, so every function is called once for the whole batch.
+        
+        Parameters:
+            params (np.ndarray):    Parameter vectors with shape (M, nparams).
+            x (np.ndarray):    Positions, defaults to the bound positions.
+        
+        Returns:
+            (np.ndarray):    Values with shape (M, len(x)).
+        
+        '''
+        
+        if x is None:
+            x = self.x
+        
+        try:
+            assert(isinstance(x, np.ndarray))
+            assert(len(x.shape) == 1)
+            params = np.asarray(params, dtype='float64')
+            assert(len(params.shape) == 2)
+            assert(params.shape[1] == self.nparams)
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        # parameters as columns broadcasting against x
+        cols = params.transpose()[:,:,np.newaxis]
+        
+        out = np.zeros((params.shape[0], x.shape[0]))
+        for (func, dfunc, sl) in self._parts:
+            out += func( x, cols[sl] )
+        
+        return out
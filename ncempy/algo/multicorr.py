@@ -1,6 +1,10 @@
 '''
 Module to correlate two images, functionally written.
 
+Use the Correlator class to register many images against the same reference, it sets up the reference, the Fourier coordinates and the DFT upsampling kernels once.
+Whole image stacks are registered with register_stack and shifted with shift_stack.
+The TemplateMatcher class finds the best matching template out of a bank of templates.
+
 TODO
 ----
     - Replace makeFourierCoords with np.fft.fftfreq
@@ -8,24 +12,166 @@ TODO
     - Add testing for complex input for G1 and G2
     - upsampled_correlation has ```if upSample > 2``` but
       should it be if upSample >= 2?
-    - Cant use rfft2 currently. This gives one shift as 1/2 the value. How
-      can this be improved to improve speed?
-    - Better to make this a class. Then you can set it
-      up and change the inputs without having to run
-      through all of the setup again
     - imageShifter and multicorr output have opposite sign. ??
 
 '''
 
+import time
+
 import numpy as np
 
-def multicorr(G1, G2, method = 'cross', upsampleFactor = 1, verbose = True):
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+def _fft_backend(workers=None, precision='double'):
+    '''Select the FFT implementation.
+    
+    numpy.fft before numpy 2 always computes in double precision, so scipy.fft, which keeps float32 and complex64,
+    is used for single precision.
+    
+    Parameters
+    ----------
+        workers : int, optional
+            Number of workers for scipy.fft. If None, numpy.fft is used for double precision. (default = None)
+        precision : str, optional
+            'double' or 'single', see _precision_dtypes. (default = 'double')
+    
+    Returns
+    -------
+        fft : module
+            Module providing ifft2 and ifftn.
+        kwargs : dict
+            Keyword arguments to pass to the FFT functions.
+    '''
+    if scipy_fft is None or (workers is None and precision == 'double'):
+        return np.fft, {}
+    if workers is None:
+        return scipy_fft, {}
+    return scipy_fft, {'workers': workers}
+
+def _precision_dtypes(precision = 'double'):
+    '''Real and complex dtype for a precision.
+    
+    Parameters
+    ----------
+        precision : str
+            'double' for float64/complex128 or 'single' for float32/complex64.
+    
+    Returns
+    -------
+        dtypes : tuple
+            The real and the complex dtype.
+    '''
+    if precision == 'double':
+        return np.float64, np.complex128
+    elif precision == 'single':
+        return np.float32, np.complex64
+    else:
+        raise TypeError('{} precision is not allowed'.format(str(precision)))
+
+def _real_shape(G, shape = None):
+    '''Shape of the real space image of a half spectrum from rfft2.
+    
+    Parameters
+    ----------
+        G : complex ndarray
+            Half spectrum from rfft2 (or a stack of them).
+        shape : tuple, optional
+            Shape of the real space image. If None, an even number of columns is assumed. (default = None)
+    
+    Returns
+    -------
+        shape : tuple
+            Shape of the real space image.
+    '''
+    if shape is None:
+        shape = (G.shape[-2], 2*(G.shape[-1]-1))
+    shape = tuple(int(ii) for ii in shape)
+    if len(shape) != 2 or shape[0] != G.shape[-2] or shape[1]//2+1 != G.shape[-1]:
+        raise TypeError('Shape {0} does not fit to a half spectrum of size {1}'.format(shape, G.shape))
+    return shape
+
+def _parse_method(method = 'cross', upsampleFactor = 1):
+    '''Sanitize the correlation method and upsample factor.
+    
+    Parameters
+    ----------
+        method : str, optional
+            The correlation method to use. Must be 'phase' or 'cross' or 'hybrid' (default = 'cross')
+        upsampleFactor : int
+            Upsample factor for subpixel precision of cross correlation. (default = 1)
+    
+    Returns
+    -------
+        method : str
+            The correlation method to use.
+        upsampleFactor : int
+            The upsample factor to use.
+    '''
+    # Check to make sure method and upsample factor are the correct values
+    if method not in ['phase', 'cross', 'hybrid']:
+        print('Unknown method used, setting to cross')
+        method = 'cross'
+
+    if type(upsampleFactor) is not int and type(upsampleFactor) is not float:
+        print('Upsample factor is not an integer or float, setting to 1')
+        upsampleFactor = 1
+    elif type(upsampleFactor) is not int:
+        print('Upsample factor is not an integer, rounding down')
+        upsampleFactor = int(upsampleFactor)
+        if upsampleFactor < 1:
+            print('Upsample factor is < 1, setting to 1')
+            upsampleFactor = 1
+    
+    return method, upsampleFactor
+
+def parse_input(G1, G2, method = 'cross', upsampleFactor = 1):
+    '''Check the inputs to multicorr and sanitize the method and upsample factor.
+    
+    Parameters
+    ----------
+        G1 : ndarray
+            Fourier transform of reference image.
+        G2 : ndarray
+            Fourier transform of the image to register (the kernel).
+        method : str, optional
+            The correlation method to use. Must be 'phase' or 'cross' or 'hybrid' (default = 'cross')
+        upsampleFactor : int
+            Upsample factor for subpixel precision of cross correlation. (default = 1)
+    
+    Returns
+    -------
+        method : str
+            The correlation method to use.
+        upsampleFactor : int
+            The upsample factor to use.
+    '''
+    # Check to make sure both G1 and G2 are arrays
+    if type(G1) is not np.ndarray:
+        raise TypeError('G1 must be an ndarray')
+    elif type(G2) is not np.ndarray:
+        raise TypeError('G2 must be an ndarray')
+    
+    method, upsampleFactor = _parse_method(method, upsampleFactor)
+
+    # Verify images are the same size.
+    if G1.shape != G2.shape:
+        raise TypeError('G1 and G2 are not the same size, G1 is {0} and G2 is {1}'.format(G1.shape, G2.shape))
+    
+    return method, upsampleFactor
+
+def multicorr(G1, G2, method = 'cross', upsampleFactor = 1, verbose = True, real = False, shape = None, precision = 'double', direct = False):
     '''Align a template to an image by cross correlation. THe template
     and the image must have the same size.
     
     The function takes in FFTs so that any FFT algorithm can be used to 
     transform the image and template (fft2, mkl, scipack, etc.)
     
+    For real images the half spectra from rfft2 can be used with real = True,
+    which halves the cost and memory of the FFTs.
+    
     Parameters   
     ----------
         G1 : complex ndarray
@@ -36,6 +182,16 @@ def multicorr(G1, G2, method = 'cross', upsampleFactor = 1, verbose = True):
             The correlation method to use. Must be 'phase' or 'cross' or 'hybrid' (default = 'cross')
         upsampleFactor : int
             Upsample factor for subpixel precision of cross correlation. (default = 1)
+        real : bool, optional
+            Set if G1 and G2 are half spectra from rfft2. (default = False)
+        shape : tuple, optional
+            Shape of the real space images for real = True. If None, an even number of columns is assumed. (default = None)
+        precision : str, optional
+            Compute in 'double' (complex128) or 'single' (complex64) precision. (default = 'double')
+        direct : bool, optional
+            Set to find the half pixel peak with a 3x3 matrix multiply DFT around the integer peak instead of
+            the inverse FFT of the 2x padded spectrum. Much cheaper for large images. The shifts are identical on clean data,
+            on noise-like correlations the padded path may pick a different half pixel maximum. (default = False)
 
     Returns
     -------
@@ -52,48 +208,32 @@ def multicorr(G1, G2, method = 'cross', upsampleFactor = 1, verbose = True):
         >>> im0FFT = np.fft.fft2(im0)
         >>> im1FFT = np.fft.fft2(im1)
         >>> shifts = mc.multicorr(im0FFT,im1FFT)
+        
+        The same with half spectra.
+        
+        >>> shifts = mc.multicorr(np.fft.rfft2(im0), np.fft.rfft2(im1), real = True, shape = im0.shape)
     
     '''
     
-    #method, upsampleFactor = parse_input(G1, G2, method, upsampleFactor)
-    # Check to make sure both G1 and G2 are arrays
-    if type(G1) is not np.ndarray:
-        raise TypeError('G1 must be an ndarray')
-    elif type(G2) is not np.ndarray:
-        raise TypeError('G2 must be an ndarray')
+    method, upsampleFactor = parse_input(G1, G2, method, upsampleFactor)
     
     #Check that the inputs are complex FFTs (common error)
     if not np.iscomplexobj(G1) or not np.iscomplexobj(G2):
         raise TypeError('G1 and G2 must be complex FFTs.')
     
-    # Check to make sure method and upsample factor are the correct values
-    if method not in ['phase', 'cross', 'hybrid']:
-        print('Unknown method used, setting to cross.')
-        method = 'cross'
-
-    if type(upsampleFactor) is not int and type(upsampleFactor) is not float:
-        print('Upsample factor is not an integer or float, setting to 1')
-        upsampleFactor = 1
-    elif type(upsampleFactor) is not int:
-        print('Upsample factor is not an integer, rounding down')
-        upsampleFactor = int(upsampleFactor)
-        if upsampleFactor < 1:
-            print('Upsample factor is < 1, setting to 1')
-            upsampleFactor = 1
-
-    # Verify images are the same size.
-    if G1.shape != G2.shape:
-        raise TypeError('G1 and G2 are not the same size, G1 is {0} and G2 is {1}'.format(G1.shape, G2.shape))
-
+    if real:
+        shape = _real_shape(G1, shape)
     
-    imageCorr = initial_correlation_image(G1, G2, method, upsampleFactor)
-    xyShift = upsampled_correlation(imageCorr, upsampleFactor)
+    imageCorr = initial_correlation_image(G1, G2, method, upsampleFactor, precision = precision)
+    xyShift = upsampled_correlation(imageCorr, upsampleFactor, real = real, shape = shape, precision = precision, direct = direct)
     
     return xyShift
 
-def initial_correlation_image(G1, G2, method = 'cross', upsampleFactor = 1):
+def initial_correlation_image(G1, G2, method = 'cross', upsampleFactor = 1, precision = 'double'):
     '''Generate correlation image at initial resolution using the method specified.
 
+    All operations are elementwise, so this works the same for half spectra from rfft2.
+
     Parameters   
     ----------
         G1 : complex ndarray
@@ -104,13 +244,37 @@ def initial_correlation_image(G1, G2, method = 'cross', upsampleFactor = 1):
             The correlation method to use. Must be 'phase' or 'cross' or 'hybrid' (default = 'cross')
         upsampleFactor : int
             Upsample factor for subpixel precision of cross correlation. (default = 1)
+        precision : str, optional
+            Compute in 'double' (complex128) or 'single' (complex64) precision. (default = 'double')
 
     Returns
     -------
         imageCorr : ndarray complex
             Correlation array which has not yet been inverse Fourier transformed.
     '''
+    cdtype = _precision_dtypes(precision)[1]
+    G1 = np.asarray(G1).astype(cdtype, copy=False)
+    G2 = np.asarray(G2).astype(cdtype, copy=False)
+
     G12 = np.multiply(G2, np.conj(G1)) # is this the correct order that we want?
+    
+    return _weight_correlation(G12, method)
+
+def _weight_correlation(G12, method):
+    '''Apply the weighting of the correlation method to the product of the FFTs.
+
+    Parameters
+    ----------
+        G12 : complex ndarray
+            Product of G2 and the complex conjugate of G1.
+        method : str
+            The correlation method to use. Must be 'phase' or 'cross' or 'hybrid'.
+
+    Returns
+    -------
+        imageCorr : ndarray complex
+            Correlation array which has not yet been inverse Fourier transformed.
+    '''
     if method == 'phase':
         imageCorr = np.exp(1j * np.angle(G12))
     elif method == 'cross':
@@ -122,26 +286,51 @@ def initial_correlation_image(G1, G2, method = 'cross', upsampleFactor = 1):
 
     return imageCorr
 
-def upsampled_correlation(imageCorr, upsampleFactor):
+def upsampled_correlation(imageCorr, upsampleFactor, kernels = None, workers = None, real = False, shape = None, precision = 'double', direct = False, halfKernels = None):
     '''Upsamples the correlation image by a set integer factor upsampleFactor.
     If upsampleFactor == 2, then it is naively Fourier upsampled.
     If the upsampleFactoris higher than 2, then it uses dftUpsample, which is
     a more efficient way to Fourier upsample the image.
 
+    With direct = True the naive Fourier upsampling is replaced by dftUpsample on the
+    half pixel positions around the integer peak.
+
     Parameters
     ----------
         imageCorr : ndarray complex 
             Fourier transformed correlation image returned by initial_correlation_image.
         upsampleFactor : int
             Upsampling factor.
+        kernels : tuple, optional
+            DFT upsampling kernels from dftUpsampleKernels for the size of imageCorr and upsampleFactor. Computed if None. (default = None)
+        workers : int, optional
+            Number of workers to use scipy.fft, numpy.fft is used if None. (default = None)
+        real : bool, optional
+            Set if imageCorr is a half spectrum of real images from rfft2. (default = False)
+        shape : tuple, optional
+            Shape of the real space images for real = True. If None, an even number of columns is assumed. (default = None)
+        precision : str, optional
+            Compute in 'double' (complex128) or 'single' (complex64) precision. (default = 'double')
+        direct : bool, optional
+            Set to find the half pixel peak with a 3x3 matrix multiply DFT around the integer peak instead of
+            the inverse FFT of the 2x padded spectrum. Much cheaper for large images. The shifts are identical on clean data,
+            on noise-like correlations the padded path may pick a different half pixel maximum. (default = False)
+        halfKernels : tuple, optional
+            DFT upsampling kernels from dftUpsampleKernels for the image size and a factor of 2, used for direct = True. Computed if None. (default = None)
 
     Returns
     -------
         xyShift : list
             Shift in x and y of G2 with respect to G1.
     '''
+    fft, fftargs = _fft_backend(workers, precision)
+    imageCorr = imageCorr.astype(_precision_dtypes(precision)[1], copy=False)
 
-    imageCorrIFT = np.real(np.fft.ifft2(imageCorr))
+    if real:
+        shape = _real_shape(imageCorr, shape)
+        imageCorrIFT = fft.irfft2(imageCorr, s=shape, **fftargs)
+    else:
+        imageCorrIFT = np.real(fft.ifft2(imageCorr, **fftargs))
     xyShift = list(np.unravel_index(imageCorrIFT.argmax(), imageCorrIFT.shape, 'C'))
 
     if upsampleFactor == 1:
@@ -149,8 +338,17 @@ def upsampled_correlation(imageCorr, upsampleFactor):
         xyShift[0] = ((xyShift[0] + imageSize[0]/2) % imageSize[0]) - imageSize[0]/2
         xyShift[1] = ((xyShift[1] + imageSize[1]/2) % imageSize[1]) - imageSize[1]/2
         
+    elif direct:
+        # the 2x upsampled correlation at the half pixel positions around the integer peak
+        imageSize = imageCorrIFT.shape
+        imageSizeLarge = tuple(ii + 2*int(ii/2) for ii in imageSize)
+        xyShift = [((xyShift[ii] + imageSize[ii]/2) % imageSize[ii]) - imageSize[ii]/2 for ii in range(2)]
+        imageCorrHalf = dftUpsample(np.conj(imageCorr), 2, 1 - np.multiply(xyShift, 2), kernels = halfKernels, real = real, shape = shape, precision = precision)
+        xySubShift2 = np.unravel_index(imageCorrHalf.argmax(), imageCorrHalf.shape, 'C')
+        xyShift = [xyShift[ii] + (xySubShift2[ii] - 1)/2 for ii in range(2)]
+
     else:
-        imageCorrLarge = upsampleFFT(imageCorr, 2)
+        imageCorrLarge = upsampleFFT(imageCorr, 2, workers = workers, real = real, shape = shape, precision = precision)
         imageSizeLarge = imageCorrLarge.shape
         xySubShift2 = list(np.unravel_index(imageCorrLarge.argmax(), imageSizeLarge, 'C'))
         #print('xySubShift2 = {}'.format(xySubShift2))
@@ -159,38 +357,164 @@ def upsampled_correlation(imageCorr, upsampleFactor):
         xyShift = [i/2 for i in xySubShift2] #signs have to flip, or mod wrong?
         #print('xyShiftln127 = {}.format(xyShift))
 
-        if upsampleFactor > 2:
-            # here is where we use DFT registration to make things much faster
-            # we cut out and upsample a peak 1.5 by 1.5 px from our original correlation image.
+    if upsampleFactor > 2:
+        # here is where we use DFT registration to make things much faster
+        # we cut out and upsample a peak 1.5 by 1.5 px from our original correlation image.
+
+        xyShift[0] = np.round(xyShift[0] * upsampleFactor) / upsampleFactor
+        xyShift[1] = np.round(xyShift[1] * upsampleFactor) / upsampleFactor
+
+        globalShift = np.fix(np.ceil(upsampleFactor * 1.5)/2)# this line might have an off by one error based. The associated matlab comment is "this will be used to center the output array at dftshift + 1"
+        #print('globalShift', globalShift, 'upsampleFactor', upsampleFactor, 'xyShift', xyShift)
+
+        imageCorrUpsample = np.conj(dftUpsample(np.conj(imageCorr), upsampleFactor, globalShift - np.multiply(xyShift, upsampleFactor), kernels = kernels, real = real, shape = shape, precision = precision)) / (np.fix(imageSizeLarge[0]) * np.fix(imageSizeLarge[1]) * upsampleFactor ** 2)
+
+        xySubShift = np.unravel_index(imageCorrUpsample.argmax(), imageCorrUpsample.shape, 'C')
+        #print('xySubShift = {}'.format(xySubShift))
+
+        # add a subpixel shift via parabolic fitting
+        dx, dy = _parabolic_peak(imageCorrUpsample, xySubShift)
+        #print('dxdy = {}, {}'.format(dx, dy))
+        #print('xyShift = {}'.format(xyShift))
+        xySubShift = xySubShift - globalShift;
+        #print('xysubShift2 = {}'.format(xySubShift))
+        xyShift = xyShift + (xySubShift + np.array([dx, dy])) / upsampleFactor
+        #print('xyShift2 = {}'.format(xyShift))
+
+    return xyShift
+
+def _parabolic_peak(imageCorrUpsample, xySubShift):
+    '''Subpixel position of a peak by parabolic fitting of its 3x3 neighborhood.
+
+    Parameters
+    ----------
+        imageCorrUpsample : ndarray
+            Upsampled correlation image.
+        xySubShift : tuple
+            Index of the maximum in imageCorrUpsample.
+
+    Returns
+    -------
+        dx, dy : float
+            Subpixel offsets of the peak, 0 if the peak is at the edge.
+    '''
+    try:
+        icc = np.real(imageCorrUpsample[xySubShift[0] - 1 : xySubShift[0] + 2, xySubShift[1] - 1 : xySubShift[1] + 2])
+        dx = (icc[2,1] - icc[0,1]) / (4 * icc[1,1] - 2 * icc[2,1] - 2 * icc[0,1])
+        dy = (icc[1,2] - icc[1,0]) / (4 * icc[1,1] - 2 * icc[1,2] - 2 * icc[1,0])
+    except:
+        dx, dy = 0, 0 # this is the case when the peak is near the edge and one of the above values does not exist
+    return dx, dy
+
+def _argmax_stack(images):
+    '''Index of the maximum in every image of a stack.
+
+    Parameters
+    ----------
+        images : ndarray
+            Stack of images, frame index first.
+
+    Returns
+    -------
+        peaks : ndarray
+            (N, 2) array of the row and column of the maxima.
+    '''
+    ind = np.reshape(images, (images.shape[0], -1)).argmax(axis=1)
+    return np.stack(np.unravel_index(ind, images.shape[1:]), axis=1)
+
+def _dftUpsample_stack(imageCorr, dftShift, kernels):
+    '''Batched dftUpsample for a stack of correlation images.
+
+    Parameters
+    ----------
+        imageCorr : ndarray
+            Stack of correlation images in Fourier space, frame index first.
+        dftShift : ndarray
+            (N, 2) array of the shifts passed to dftUpsample for every frame.
+        kernels : tuple
+            Kernels from dftUpsampleKernels.
+
+    Returns
+    -------
+        imageUpsample : ndarray
+            Stack of the upsampled regions around the correlation peaks.
+    '''
+    pixels, rowConst, rowFreq, colFreq = kernels
+
+    colKern = np.exp(colFreq[np.newaxis, np.newaxis, :] * (pixels[np.newaxis, :] - dftShift[:, 1:2])[:, :, np.newaxis])
+    rowKern = np.exp(rowConst * (pixels[np.newaxis, :] - dftShift[:, 0:1])[:, np.newaxis, :] * rowFreq[np.newaxis, :, :])
+
+    return np.real(np.matmul(np.matmul(np.swapaxes(rowKern, 1, 2), imageCorr), np.swapaxes(colKern, 1, 2)))
+
+def upsampled_correlation_stack(imageCorr, upsampleFactor, kernels = None, workers = None, direct = False, halfKernels = None):
+    '''Batched version of upsampled_correlation for a stack of correlation images.
+
+    The FFTs run on the last two axes of the whole stack and the DFT upsampling is done as batched matrix products.
+
+    Parameters
+    ----------
+        imageCorr : ndarray complex 
+            Stack of Fourier transformed correlation images, frame index first.
+        upsampleFactor : int
+            Upsampling factor.
+        kernels : tuple, optional
+            DFT upsampling kernels from dftUpsampleKernels for the image size and upsampleFactor. Computed if None. (default = None)
+        workers : int, optional
+            Number of workers to use scipy.fft, numpy.fft is used if None. (default = None)
+        direct : bool, optional
+            Set to find the half pixel peak with a 3x3 matrix multiply DFT around the integer peak instead of
+            the inverse FFT of the 2x padded spectrum. Much cheaper for large images. The shifts are identical on clean data,
+            on noise-like correlations the padded path may pick a different half pixel maximum. (default = False)
+        halfKernels : tuple, optional
+            DFT upsampling kernels from dftUpsampleKernels for the image size and a factor of 2, used for direct = True. Computed if None. (default = None)
+
+    Returns
+    -------
+        xyShift : ndarray
+            (N, 2) array of the shifts in x and y for every frame.
+    '''
+    fft, fftargs = _fft_backend(workers)
+    imageSize = np.array(imageCorr.shape[-2:])
+
+    if upsampleFactor == 1 or direct:
+        imageCorrIFT = np.real(fft.ifft2(imageCorr, axes=(-2,-1), **fftargs))
+        xyShift = _argmax_stack(imageCorrIFT)
+        xyShift = ((xyShift + imageSize/2) % imageSize) - imageSize/2
+        if upsampleFactor == 1:
+            return xyShift
+
+        # the 2x upsampled correlation at the half pixel positions around the integer peaks
+        imageSizeLarge = imageSize + 2*(imageSize//2)
+        if halfKernels is None:
+            halfKernels = dftUpsampleKernels(imageSize, 2)
+        imageCorrHalf = _dftUpsample_stack(np.conj(imageCorr), 1 - xyShift * 2, halfKernels)
+        xyShift = xyShift + (_argmax_stack(imageCorrHalf) - 1) / 2
+
+    else:
+        ss = [int(ii*2/4) for ii in imageSize] # pad size
+        imageCorrLarge = np.pad(np.fft.fftshift(imageCorr, axes=(-2,-1)), ((0,0), (ss[0],ss[0]), (ss[1],ss[1])), mode='constant')
+        imageCorrLarge = np.real(fft.ifft2(np.fft.ifftshift(imageCorrLarge, axes=(-2,-1)), axes=(-2,-1), **fftargs))
+        imageSizeLarge = np.array(imageCorrLarge.shape[-2:])
+        xyShift = (((_argmax_stack(imageCorrLarge) + imageSizeLarge/2) % imageSizeLarge) - imageSizeLarge/2) / 2
 
-            xyShift[0] = np.round(xyShift[0] * upsampleFactor) / upsampleFactor
-            xyShift[1] = np.round(xyShift[1] * upsampleFactor) / upsampleFactor
+    if upsampleFactor > 2:
+        xyShift = np.round(xyShift * upsampleFactor) / upsampleFactor
+        globalShift = np.fix(np.ceil(upsampleFactor * 1.5)/2)
 
-            globalShift = np.fix(np.ceil(upsampleFactor * 1.5)/2)# this line might have an off by one error based. The associated matlab comment is "this will be used to center the output array at dftshift + 1"
-            #print('globalShift', globalShift, 'upsampleFactor', upsampleFactor, 'xyShift', xyShift)
+        if kernels is None:
+            kernels = dftUpsampleKernels(imageSize, upsampleFactor)
 
-            imageCorrUpsample = np.conj(dftUpsample(np.conj(imageCorr), upsampleFactor, globalShift - np.multiply(xyShift, upsampleFactor))) / (np.fix(imageSizeLarge[0]) * np.fix(imageSizeLarge[1]) * upsampleFactor ** 2)
+        imageCorrUpsample = _dftUpsample_stack(np.conj(imageCorr), globalShift - xyShift * upsampleFactor, kernels)
+        imageCorrUpsample /= (imageSizeLarge[0] * imageSizeLarge[1] * upsampleFactor ** 2)
 
-            xySubShift = np.unravel_index(imageCorrUpsample.argmax(), imageCorrUpsample.shape, 'C')
-            #print('xySubShift = {}'.format(xySubShift))
+        xySubShift = _argmax_stack(imageCorrUpsample)
+        dxy = np.array([_parabolic_peak(imageCorrUpsample[ii], xySubShift[ii]) for ii in range(imageCorr.shape[0])])
 
-            # add a subpixel shift via parabolic fitting
-            try:
-                icc = np.real(imageCorrUpsample[xySubShift[0] - 1 : xySubShift[0] + 2, xySubShift[1] - 1 : xySubShift[1] + 2])
-                dx = (icc[2,1] - icc[0,1]) / (4 * icc[1,1] - 2 * icc[2,1] - 2 * icc[0,1])
-                dy = (icc[1,2] - icc[1,0]) / (4 * icc[1,1] - 2 * icc[1,2] - 2 * icc[1,0])
-            except:
-                dx, dy = 0, 0 # this is the case when the peak is near the edge and one of the above values does not exist
-            #print('dxdy = {}, {}'.format(dx, dy))
-            #print('xyShift = {}'.format(xyShift))
-            xySubShift = xySubShift - globalShift;
-            #print('xysubShift2 = {}'.format(xySubShift))
-            xyShift = xyShift + (xySubShift + np.array([dx, dy])) / upsampleFactor
-            #print('xyShift2 = {}'.format(xyShift))
+        xyShift = xyShift + (xySubShift - globalShift + dxy) / upsampleFactor
 
     return xyShift
 
-def upsampleFFT(imageInit, upsampleFactor):
+def upsampleFFT(imageInit, upsampleFactor, workers = None, real = False, shape = None, precision = 'double'):
     '''This does a Fourier upsample of the imageInit. imageInit is the Fourier transform of the correlation image. 
     The function returns the real space correlation image that has been Fourier upsampled by the upsampleFactor.
     An upsample factor of 2 is generally sufficient.
@@ -203,6 +527,14 @@ def upsampleFFT(imageInit, upsampleFactor):
             The image to be Fourier upsampled. This should be in the Fourier domain.
         upsampleFactor : int
             THe upsample factor (usually 2).
+        workers : int, optional
+            Number of workers to use scipy.fft, numpy.fft is used if None. (default = None)
+        real : bool, optional
+            Set if imageInit is a half spectrum of a real image from rfft2. (default = False)
+        shape : tuple, optional
+            Shape of the real space image for real = True. If None, an even number of columns is assumed. (default = None)
+        precision : str, optional
+            Compute in 'double' (complex128) or 'single' (complex64) precision. (default = 'double')
 
     Returns
     -------
@@ -218,13 +550,104 @@ def upsampleFFT(imageInit, upsampleFactor):
     return imageUpsampleReal
     '''
     
+    fft, fftargs = _fft_backend(workers, precision)
+    imageInit = imageInit.astype(_precision_dtypes(precision)[1], copy=False)
+    
+    if real:
+        return _upsampleRFFT(imageInit, upsampleFactor, _real_shape(imageInit, shape), fft, fftargs)
+    
     ss = [int(ii*upsampleFactor/4) for ii in imageInit.shape] # pad size
-    imageInit2 = np.pad(imageInit, ss, mode='constant') # pad the FFT
-    imageUpsampleReal = np.real(np.fft.ifftn(np.fft.ifftshift(imageInit2))) # inverse FFT
+    imageInit2 = np.pad(np.fft.fftshift(imageInit), [(ii, ii) for ii in ss], mode='constant') # pad the centered FFT
+    imageUpsampleReal = np.real(fft.ifftn(np.fft.ifftshift(imageInit2), **fftargs)) # inverse FFT
 
     return imageUpsampleReal
 
-def dftUpsample(imageCorr, upsampleFactor, xyShift):
+def _upsampleRFFT(imageInit, upsampleFactor, shape, fft, fftargs):
+    '''Fourier upsample a half spectrum from rfft2, see upsampleFFT.
+
+    The complex path takes the real part of the inverse FFT, which splits the unpaired Nyquist frequencies of even sizes
+    evenly between the positive and negative frequency of the larger array. This is done explicitly here, the rest of the 
+    negative frequencies is implied by the half spectrum.
+
+    Parameters
+    ----------
+        imageInit : ndarray  complex
+            Half spectrum to be Fourier upsampled.
+        upsampleFactor : int
+            THe upsample factor (usually 2).
+        shape : tuple
+            Shape of the real space image.
+        fft : module
+            FFT implementation from _fft_backend.
+        fftargs : dict
+            Keyword arguments for the FFT functions.
+
+    Returns
+    -------
+        imageUpsampleReal : ndarray
+            The inverse Fourier transform of imageInit upsampled by the upsampleFactor.
+    '''
+    ss = [int(ii*upsampleFactor/4) for ii in shape] # pad size
+    sizeLarge = (shape[0] + 2*ss[0], shape[1] + 2*ss[1])
+
+    # center along the full axis, pad at the end of the half axis
+    imageInit2 = np.zeros((sizeLarge[0], sizeLarge[1]//2+1), dtype=imageInit.dtype)
+    imageInit2[ss[0]:ss[0]+shape[0], :imageInit.shape[1]] = np.fft.fftshift(imageInit, axes=0)
+
+    nyq = imageInit.shape[1]-1
+    if shape[0] % 2 == 0 and ss[0] > 0:
+        imageInit2[ss[0]] /= 2
+        imageInit2[ss[0]+shape[0]] = imageInit2[ss[0]]
+    if shape[1] % 2 == 0 and ss[1] > 0:
+        imageInit2[:, nyq] /= 2
+        if shape[0] % 2 == 0 and ss[0] > 0:
+            # the corner only pairs with the opposite corner
+            imageInit2[ss[0]+shape[0], nyq] = np.conj(imageInit2[ss[0], nyq])*2
+            imageInit2[ss[0], nyq] = 0
+
+    imageUpsampleReal = fft.irfft2(np.fft.ifftshift(imageInit2, axes=0), s=sizeLarge, **fftargs) # inverse FFT
+
+    return imageUpsampleReal
+
+def dftUpsampleKernels(imageSize, upsampleFactor, precision = 'double'):
+    '''
+    Precompute the parts of the dftUpsample kernels which do not depend on the shift.
+
+    The kernels of the matrix multiply DFT are exp(c * (k - shift) * q) for output pixel k and frequency q. Everything apart 
+    from the shift only depends on the image size and upsample factor, so it can be reused for many correlations.
+
+    Parameters
+    ----------
+        imageSize : tuple
+            Shape of the correlation image.
+        upsampleFactor : int 
+            Scalar integer of how much to upsample.
+        precision : str, optional
+            Compute in 'double' (complex128) or 'single' (complex64) precision. (default = 'double')
+
+    Returns
+    -------
+        kernels : tuple
+            Output pixel indices, constant of the row exponent, row frequencies and column frequencies times their constant.
+    '''
+    pixelRadius = 1.5
+    numRow = np.ceil(pixelRadius * upsampleFactor)
+
+    pixels = np.arange(numRow)
+    rowConst = (-1j * 2 * np.pi / (imageSize[0] * upsampleFactor))
+    rowFreq = (np.fft.ifftshift(np.arange(imageSize[0])) - np.floor(imageSize[0]/2))[:, np.newaxis]
+    colFreq = (-1j * 2 * np.pi / (imageSize[1] * upsampleFactor)) * (np.fft.ifftshift( (np.arange(imageSize[1])) ) - np.floor(imageSize[1]/2))
+
+    if precision != 'double':
+        fdtype, cdtype = _precision_dtypes(precision)
+        pixels = pixels.astype(fdtype)
+        rowConst = cdtype(rowConst)
+        rowFreq = rowFreq.astype(fdtype)
+        colFreq = colFreq.astype(cdtype)
+
+    return pixels, rowConst, rowFreq, colFreq
+
+def dftUpsample(imageCorr, upsampleFactor, xyShift, kernels = None, real = False, shape = None, precision = 'double'):
     '''
     This performs a matrix multiply DFT around a small neighboring region of the inital correlation peak.
     By using the matrix multiply DFT to do the Fourier upsampling, the efficiency is greatly improved.
@@ -245,6 +668,15 @@ def dftUpsample(imageCorr, upsampleFactor, xyShift):
         xyShift : list of 2 floats 
             Single pixel shift between images previously computed. Used to center the matrix multiplication 
             on the correlation peak.
+        kernels : tuple, optional
+            Precomputed kernels from dftUpsampleKernels for the size of imageCorr and upsampleFactor. (default = None)
+        real : bool, optional
+            Set if imageCorr is a half spectrum of real images from rfft2. The sum over the missing negative frequencies
+            is replaced by counting the positive ones twice. (default = False)
+        shape : tuple, optional
+            Shape of the real space images for real = True. If None, an even number of columns is assumed. (default = None)
+        precision : str, optional
+            Compute in 'double' (complex128) or 'single' (complex64) precision. The kernels have to be computed with the same precision. (default = 'double')
         
     Returns
     -------
@@ -252,39 +684,63 @@ def dftUpsample(imageCorr, upsampleFactor, xyShift):
             Upsampled image from region around correlation peak.
         
     '''
-    imageSize = imageCorr.shape
-    pixelRadius = 1.5
-    numRow = np.ceil(pixelRadius * upsampleFactor)
-    numCol = numRow
-
-    colKern = np.exp(
-    (-1j * 2 * np.pi / (imageSize[1] * upsampleFactor))
-    * (np.fft.ifftshift( (np.arange(imageSize[1])) )
-    - np.floor(imageSize[1]/2))
-    * (np.arange(numCol) - xyShift[1])[:, np.newaxis]
-    ) # I think this can be written differently without the need for np.newaxis. This might require np.outer to compute the matrix itself instead of just using np.dot.
-
-    rowKern = np.exp(
-    (-1j * 2 * np.pi / (imageSize[0] * upsampleFactor))
-    * (np.arange(numRow) - xyShift[0])
-    * (np.fft.ifftshift(np.arange(imageSize[0]))
-    - np.floor(imageSize[0]/2))[:, np.newaxis]
-    ) # Comment from above applies.
+    if real:
+        shape = _real_shape(imageCorr, shape)
+    else:
+        shape = imageCorr.shape
+
+    fdtype, cdtype = _precision_dtypes(precision)
+    imageCorr = imageCorr.astype(cdtype, copy=False)
+    xyShift = np.asarray(xyShift, dtype=fdtype)
+
+    if kernels is None:
+        kernels = dftUpsampleKernels(shape, upsampleFactor, precision)
+    pixels, rowConst, rowFreq, colFreq = kernels
+
+    if real:
+        # the half spectrum has the frequencies at the start of the full one
+        colFreq = colFreq[:imageCorr.shape[1]]
+        weights = np.full(imageCorr.shape[1], 2., dtype=fdtype)
+        weights[0] = 1
+        if shape[1] % 2 == 0:
+            weights[-1] = 1
+        imageCorrFull = imageCorr
+        imageCorr = imageCorr * weights[np.newaxis, :]
+
+    colKern = np.exp(colFreq * (pixels - xyShift[1])[:, np.newaxis])
+
+    rowKern = np.exp(rowConst * (pixels - xyShift[0]) * rowFreq)
+
+    if real and shape[0] % 2 == 0:
+        # the Nyquist row is its own mirror, so its negative frequencies are added explicitly
+        nyq = shape[0]//2
+        imageCorr[nyq] = imageCorrFull[nyq]
+        inner = slice(1, shape[1]//2 + (shape[1] % 2))
+        neg = np.dot(np.conj(imageCorrFull[nyq, inner]), np.conj(colKern[:, inner]).transpose())
 
     imageUpsample = np.real(np.dot(np.dot(rowKern.transpose(), imageCorr), colKern.transpose()))
 
+    if real and shape[0] % 2 == 0:
+        imageUpsample += np.real(np.outer(rowKern[nyq], neg))
+
     return imageUpsample
 
-def imageShifter(G2, xyShift):
+def imageShifter(G2, xyShift, real = False, shape = None, precision = 'double'):
     '''
     This function multiplies G2 by a plane wave that has the real space effect of shifting ifft2(G2) by [x, y] pixels.
 
     Parameters
    -----------
         G2 : complex ndarray
-            The Fourier transform of an image.
+            The Fourier transform of an image or a stack of images (frame index first).
         xyShift : list
-            A two element list of the shifts along each axis.
+            A two element list of the shifts along each axis, or an (N, 2) array with the shifts of every frame.
+        real : bool, optional
+            Set if G2 is a half spectrum from rfft2. (default = False)
+        shape : tuple, optional
+            Shape of the real space image for real = True. If None, an even number of columns is assumed. (default = None)
+        precision : str, optional
+            Compute in 'double' (complex128) or 'single' (complex64) precision. (default = 'double')
 
     Returns
     -------
@@ -298,17 +754,141 @@ def imageShifter(G2, xyShift):
         >>> plt.imshow(shiftIm0)
         
     '''
-    imageSize = G2.shape
+    if real:
+        imageSize = _real_shape(G2, shape)
+    else:
+        imageSize = G2.shape[-2:]
     qx = makeFourierCoords(imageSize[0], 1) # does this need to be a column vector
     if imageSize[1] == imageSize[0]:
         qy = qx
     else:
         qy = makeFourierCoords(imageSize[1], 1)
+    if real:
+        qy = qy[:G2.shape[-1]]
+
+    fdtype, cdtype = _precision_dtypes(precision)
+    if precision != 'double':
+        G2 = G2.astype(cdtype, copy=False)
+        qx = qx.astype(fdtype)
+        qy = qy.astype(fdtype)
 
-    G2shift = np.multiply(G2, np.outer( np.exp(-2j * np.pi * qx * xyShift[0]),  np.exp(-2j * np.pi * qy * xyShift[1])))
+    stacked = np.ndim(xyShift) == 2
+    xyShift = np.asarray(xyShift, dtype=fdtype)
+    if stacked:
+        phase = np.exp(-2j * np.pi * qx[np.newaxis, :, np.newaxis] * xyShift[:, 0, np.newaxis, np.newaxis]) * np.exp(-2j * np.pi * qy[np.newaxis, np.newaxis, :] * xyShift[:, 1, np.newaxis, np.newaxis])
+    else:
+        phase = np.outer( np.exp(-2j * np.pi * qx * xyShift[0]),  np.exp(-2j * np.pi * qy * xyShift[1]))
+
+    if real and imageSize[0] % 2 == 0:
+        # the complex path averages the unpaired Nyquist frequencies with their mirrors when taking the real part
+        nyq = imageSize[0]//2
+        rowPhase = np.exp(-2j * np.pi * qx[nyq] * xyShift[..., 0])
+        phase[..., nyq, :] *= (np.real(rowPhase)/rowPhase)[..., np.newaxis]
+        if imageSize[1] % 2 == 0:
+            phase[..., nyq, -1] = np.real(np.exp(-2j * np.pi * (qx[nyq] * xyShift[..., 0] + qy[-1] * xyShift[..., 1])))
+
+    G2shift = np.multiply(G2, phase)
 
     return G2shift
 
+def shift_stack(stack, shifts, batchsize = None, workers = None, precision = 'double'):
+    '''Shift every image of a stack by a (sub)pixel amount with periodic boundaries.
+    
+    Same result as np.real(np.fft.ifft2(imageShifter(np.fft.fft2(image), shift))) for every frame, but the frames are
+    transformed in batches with rfft2 and the phase ramps are applied as a row ramp times a column ramp, the full
+    phase ramp is never built. Frames with integer shifts are rolled without any FFT.
+    
+    Parameters
+    ----------
+        stack : ndarray
+            Stack of real images, frame index first. Anything sliceable along the first axis works, e.g. a memmap or an h5py dataset.
+        shifts : ndarray
+            (N, 2) array with the shift of every frame, or two element list to shift all frames by the same amount.
+        batchsize : int, optional
+            Number of frames transformed at once. If None, batches of about 2**16 pixels are used. (default = None)
+        workers : int, optional
+            Number of workers to use scipy.fft, numpy.fft is used if None. (default = None)
+        precision : str, optional
+            Compute in 'double' (float64) or 'single' (float32) precision. (default = 'double')
+    
+    Returns
+    -------
+        shifted : ndarray
+            The shifted stack.
+    
+    Example
+    -------
+        >>> import ncempy.algo.multicorr as mc
+        >>> shifts = mc.register_stack(stack, upsampleFactor = 10)
+        >>> aligned = mc.shift_stack(stack, -shifts)
+    
+    '''
+    
+    fdtype, cdtype = _precision_dtypes(precision)
+    
+    try:
+        assert(len(stack.shape) == 3)
+        num = stack.shape[0]
+        imageSize = stack.shape[1:]
+        
+        shifts = np.asarray(shifts, dtype='float64')
+        if shifts.shape == (2,):
+            shifts = np.repeat(shifts[np.newaxis, :], num, axis=0)
+        assert(shifts.shape == (num, 2))
+        
+        if batchsize is None:
+            batchsize = max(1, 2**16 // (imageSize[0]*imageSize[1]))
+        batchsize = int(batchsize)
+        assert(batchsize > 0)
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    fft, fftargs = _fft_backend(workers, precision)
+    shifted = np.empty(stack.shape, dtype=fdtype)
+    
+    # integer shifts are just rolls
+    integer = np.all(shifts == np.round(shifts), axis=1)
+    for ii in np.nonzero(integer)[0]:
+        shifted[ii] = np.roll(np.asarray(stack[ii], dtype=fdtype), (int(shifts[ii, 0]), int(shifts[ii, 1])), axis=(0, 1))
+    
+    frames = np.nonzero(np.logical_not(integer))[0]
+    if frames.shape[0] == 0:
+        return shifted
+    
+    qx = makeFourierCoords(imageSize[0], 1)
+    qy = makeFourierCoords(imageSize[1], 1)[:imageSize[1]//2+1]
+    
+    for start in range(0, frames.shape[0], batchsize):
+        sel = frames[start:start+batchsize]
+        xyShift = shifts[sel]
+        
+        # contiguous frames are read as one slice
+        if sel[-1] - sel[0] == sel.shape[0] - 1:
+            images = np.asarray(stack[sel[0]:sel[-1]+1], dtype=fdtype)
+        else:
+            images = np.stack([ np.asarray(stack[ii], dtype=fdtype) for ii in sel ])
+        G = fft.rfft2(images, axes=(-2,-1), **fftargs).astype(cdtype, copy=False)
+        
+        rowRamp = np.exp(-2j * np.pi * qx[np.newaxis, :] * xyShift[:, 0, np.newaxis]).astype(cdtype, copy=False)
+        colRamp = np.exp(-2j * np.pi * qy[np.newaxis, :] * xyShift[:, 1, np.newaxis]).astype(cdtype, copy=False)
+        
+        if imageSize[0] % 2 == 0:
+            # the complex path averages the unpaired Nyquist frequencies with their mirrors when taking the real part
+            nyq = imageSize[0]//2
+            if imageSize[1] % 2 == 0:
+                corner = G[:, nyq, -1] * np.real(rowRamp[:, nyq] * colRamp[:, -1])
+            rowRamp[:, nyq] = np.real(rowRamp[:, nyq])
+        
+        G *= rowRamp[:, :, np.newaxis]
+        G *= colRamp[:, np.newaxis, :]
+        
+        if imageSize[0] % 2 == 0 and imageSize[1] % 2 == 0:
+            G[:, nyq, -1] = corner
+        
+        shifted[sel] = fft.irfft2(G, s=imageSize, axes=(-2,-1), **fftargs)
+    
+    return shifted
+
 def makeFourierCoords(N, pSize):
     '''
     This function creates Fourier coordinates such that (0,0) is in the center of the array.
@@ -332,3 +912,565 @@ def makeFourierCoords(N, pSize):
     else:
         q = np.roll(np.arange((1-N)/2, (N+1)/2) / (N * pSize), int((1-N)/2), axis=0)
     return q
+
+class Correlator:
+    '''Register images against a fixed reference by cross correlation.
+    
+    The setup of multicorr is done once: the inputs are checked, the complex conjugate of the 
+    reference FFT, the Fourier coordinates and the dftUpsample kernels are computed and cached.
+    This makes it cheap to register many images against the same reference.
+    
+    Parameters
+    ----------
+        G1 : complex ndarray
+            Fourier transform of reference image.
+        method : str, optional
+            The correlation method to use. Must be 'phase' or 'cross' or 'hybrid' (default = 'cross')
+        upsampleFactor : int
+            Upsample factor for subpixel precision of cross correlation. (default = 1)
+        workers : int, optional
+            Number of workers to use scipy.fft, numpy.fft is used if None. (default = None)
+        real : bool, optional
+            Set to work with half spectra of real images from rfft2. (default = False)
+        imageShape : tuple, optional
+            Shape of the real space images for real = True. If None, an even number of columns is assumed. (default = None)
+        precision : str, optional
+            Compute in 'double' (complex128) or 'single' (complex64) precision. (default = 'double')
+        direct : bool, optional
+            Set to find the half pixel peak with a 3x3 matrix multiply DFT around the integer peak instead of
+            the inverse FFT of the 2x padded spectrum. Much cheaper for large images. The shifts are identical on clean data,
+            on noise-like correlations the padded path may pick a different half pixel maximum. (default = False)
+    
+    Example
+    -------
+        Register a stack of images to its first image.
+        
+        >>> import ncempy.algo.multicorr as mc
+        >>> corr = mc.Correlator(np.fft.fft2(stack[0]), 'hybrid', 10)
+        >>> shifts = [corr(np.fft.fft2(im)) for im in stack]
+    
+    '''
+    
+    def __init__(self, G1, method = 'cross', upsampleFactor = 1, workers = None, real = False, imageShape = None, precision = 'double', direct = False):
+        '''Init checking the inputs and precomputing the kernels.
+        
+        '''
+        
+        self.method, self.upsampleFactor = parse_input(G1, G1, method, upsampleFactor)
+        self.shape = G1.shape
+        self.workers = workers
+        self.real = real
+        self.precision = precision
+        self.direct = direct
+        self.dtypes = _precision_dtypes(precision)
+        if real:
+            self.imageShape = _real_shape(G1, imageShape)
+        else:
+            self.imageShape = self.shape
+        
+        # kernels for the matrix multiply DFT
+        if self.upsampleFactor > 2:
+            self.kernels = dftUpsampleKernels(self.imageShape, self.upsampleFactor, precision)
+        else:
+            self.kernels = None
+        if self.direct and self.upsampleFactor > 1:
+            self.halfKernels = dftUpsampleKernels(self.imageShape, 2, precision)
+        else:
+            self.halfKernels = None
+        
+        # Fourier coordinates for imageShifter
+        self.qx = makeFourierCoords(self.imageShape[0], 1).astype(self.dtypes[0])
+        self.qy = makeFourierCoords(self.imageShape[1], 1).astype(self.dtypes[0])
+        
+        self.set_reference(G1)
+    
+    def set_reference(self, G1):
+        '''Replace the reference keeping the setup.
+        
+        Parameters
+        ----------
+            G1 : complex ndarray
+                Fourier transform of reference image, same shape as before.
+        '''
+        self._check(G1)
+        
+        self.G1 = G1.astype(self.dtypes[1], copy=False)
+        self.G1conj = np.conj(self.G1)
+    
+    def _check(self, G):
+        '''Check that G is a complex FFT of the correct size.
+        
+        '''
+        if type(G) is not np.ndarray:
+            raise TypeError('G1 and G2 must be ndarrays')
+        if not np.iscomplexobj(G):
+            raise TypeError('G1 and G2 must be complex FFTs.')
+        if G.shape != self.shape:
+            raise TypeError('G1 and G2 are not the same size, G1 is {0} and G2 is {1}'.format(self.shape, G.shape))
+    
+    def fft2(self, image):
+        '''Fourier transform of an image with the FFT implementation in use.
+        
+        Parameters
+        ----------
+            image : ndarray
+                Image of the same shape as the reference.
+        
+        Returns
+        -------
+            G : complex ndarray
+                Fourier transform of the image, the half spectrum for real = True.
+        '''
+        fft, fftargs = _fft_backend(self.workers, self.precision)
+        
+        image = np.asarray(image).astype(self.dtypes[0], copy=False)
+        
+        if self.real:
+            return fft.rfft2(image, **fftargs)
+        else:
+            return fft.fft2(image, **fftargs)
+    
+    def initial_correlation_image(self, G2):
+        '''Generate the correlation image of G2 with the reference at initial resolution.
+        
+        Parameters
+        ----------
+            G2 : complex ndarray
+                Fourier transform of the image to register (the kernel).
+        
+        Returns
+        -------
+            imageCorr : ndarray complex
+                Correlation array which has not yet been inverse Fourier transformed.
+        '''
+        self._check(G2)
+        
+        return _weight_correlation(np.multiply(G2.astype(self.dtypes[1], copy=False), self.G1conj), self.method)
+    
+    def __call__(self, G2):
+        '''Align an image to the reference.
+        
+        Parameters
+        ----------
+            G2 : complex ndarray
+                Fourier transform of the image to register (the kernel).
+        
+        Returns
+        -------
+            xyShift : list of floats
+                The shift between the reference and G2 in pixels, as returned by multicorr.
+        '''
+        imageCorr = self.initial_correlation_image(G2)
+        
+        return upsampled_correlation(imageCorr, self.upsampleFactor, kernels = self.kernels, workers = self.workers, real = self.real, shape = self.imageShape, precision = self.precision, direct = self.direct, halfKernels = self.halfKernels)
+    
+    def shift(self, G2, xyShift):
+        '''Shift an image by multiplication with a plane wave, see imageShifter.
+        
+        Parameters
+        ----------
+            G2 : complex ndarray
+                The Fourier transform of an image.
+            xyShift : list
+                A two element list of the shifts along each axis.
+        
+        Returns
+        -------
+            G2shift : complex ndarray
+                Fourier shifted image FFT
+        '''
+        if self.real:
+            return imageShifter(G2, xyShift, real = True, shape = self.imageShape, precision = self.precision)
+        
+        xyShift = np.asarray(xyShift, dtype=self.dtypes[0])
+        G2 = G2.astype(self.dtypes[1], copy=False)
+        return np.multiply(G2, np.outer( np.exp(-2j * np.pi * self.qx * xyShift[0]),  np.exp(-2j * np.pi * self.qy * xyShift[1])))
+
+class TemplateMatcher:
+    '''Match a bank of templates against images by cross correlation.
+    
+    The templates are set up once: every template is made zero mean and unit norm, zero padded to the image size
+    with the template centered and the complex conjugate of its half spectrum (rfft2) is cached. Per image the
+    correlation maps of a batch of templates are calculated with one product and one batched inverse FFT. The
+    template with the highest correlation peak is refined to subpixel precision with upsampled_correlation.
+    
+    The shift of the best template is the shift of its center against the image center, as returned by multicorr
+    for the padded template as reference. Thus a template matching at the image center has zero shift.
+    
+    Parameters
+    ----------
+        templates : list of ndarray
+            The template images, each at most as large as the images. A 3D array is taken as a stack of templates.
+        imageShape : tuple
+            Shape of the images to match.
+        method : str, optional
+            The correlation method to use. Must be 'phase' or 'cross' or 'hybrid' (default = 'cross')
+        upsampleFactor : int
+            Upsample factor for subpixel precision of cross correlation. (default = 1)
+        batchsize : int, optional
+            Number of templates correlated at once. The batch of correlation maps is the largest intermediate array.
+            If None, batches of about 2**17 pixels are used. (default = None)
+        workers : int, optional
+            Number of workers to use scipy.fft, numpy.fft is used if None. (default = None)
+        direct : bool, optional
+            Set to find the half pixel peak with a 3x3 matrix multiply DFT around the integer peak, see upsampled_correlation. (default = False)
+        precision : str, optional
+            Compute the template spectra and correlations in 'double' (complex128) or 'single' (complex64) precision.
+            The templates are normalized in double precision before. (default = 'double')
+    
+    Example
+    -------
+        Find the best matching orientation in every frame.
+        
+        >>> import ncempy.algo.multicorr as mc
+        >>> matcher = mc.TemplateMatcher(rotated_templates, stack.shape[1:], 'hybrid', 10)
+        >>> index, score, xyShift = matcher.match_stack(stack)
+    
+    '''
+    
+    def __init__(self, templates, imageShape, method = 'cross', upsampleFactor = 1, batchsize = None, workers = None, direct = False, precision = 'double'):
+        '''Init checking the inputs and precomputing the template spectra.
+        
+        '''
+        
+        try:
+            self.imageShape = tuple(int(ii) for ii in imageShape)
+            assert(len(self.imageShape) == 2)
+            
+            templates = [ np.asarray(t, dtype='float64') for t in templates ]
+            assert(len(templates) > 0)
+            for t in templates:
+                assert(t.ndim == 2)
+                assert(t.shape[0] <= self.imageShape[0] and t.shape[1] <= self.imageShape[1])
+            
+            if batchsize is None:
+                batchsize = max(1, 2**17 // (self.imageShape[0]*self.imageShape[1]))
+            self.batchsize = int(batchsize)
+            assert(self.batchsize > 0)
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        self.method, self.upsampleFactor = _parse_method(method, upsampleFactor)
+        self.workers = workers
+        self.direct = direct
+        self.precision = precision
+        self.dtypes = _precision_dtypes(precision)
+        self.num = len(templates)
+        
+        # kernels for the matrix multiply DFT
+        if self.upsampleFactor > 2:
+            self.kernels = dftUpsampleKernels(self.imageShape, self.upsampleFactor, precision)
+        else:
+            self.kernels = None
+        if self.direct and self.upsampleFactor > 1:
+            self.halfKernels = dftUpsampleKernels(self.imageShape, 2, precision)
+        else:
+            self.halfKernels = None
+        
+        padded = np.zeros((self.num,) + self.imageShape)
+        for ii, t in enumerate(templates):
+            t = t - np.mean(t)
+            norm = np.sqrt(np.sum(np.square(t)))
+            if norm > 0:
+                t = t/norm
+            
+            # centered in the padded image
+            off0 = self.imageShape[0]//2 - t.shape[0]//2
+            off1 = self.imageShape[1]//2 - t.shape[1]//2
+            padded[ii, off0:off0+t.shape[0], off1:off1+t.shape[1]] = t
+        
+        fft, fftargs = _fft_backend(self.workers, self.precision)
+        self.templatesConj = np.conj(fft.rfft2(padded.astype(self.dtypes[0], copy=False), axes=(-2,-1), **fftargs))
+    
+    def fft2(self, image):
+        '''Half spectrum of an image as used by the matcher.
+        
+        Parameters
+        ----------
+            image : ndarray
+                Image or stack of images of shape imageShape.
+        
+        Returns
+        -------
+            G : complex ndarray
+                Half spectrum from rfft2.
+        '''
+        fft, fftargs = _fft_backend(self.workers, self.precision)
+        
+        return fft.rfft2(np.asarray(image).astype(self.dtypes[0], copy=False), axes=(-2,-1), **fftargs)
+    
+    def correlation_maps(self, G2, start = 0, stop = None):
+        '''Correlation maps of an image with a range of templates.
+        
+        Parameters
+        ----------
+            G2 : complex ndarray
+                Half spectrum of the image from fft2.
+            start : int, optional
+                First template. (default = 0)
+            stop : int, optional
+                Template to stop before, all remaining templates if None. (default = None)
+        
+        Returns
+        -------
+            maps : ndarray
+                Stack of the real space correlation maps, zero shift at index (0, 0).
+        '''
+        self._check(G2)
+        fft, fftargs = _fft_backend(self.workers, self.precision)
+        
+        imageCorr = _weight_correlation(np.multiply(G2.astype(self.dtypes[1], copy=False)[np.newaxis, :, :], self.templatesConj[start:stop]), self.method)
+        
+        return fft.irfft2(imageCorr, s=self.imageShape, axes=(-2,-1), **fftargs)
+    
+    def _check(self, G):
+        '''Check that G is a complex half spectrum of the correct size.
+        
+        '''
+        if type(G) is not np.ndarray:
+            raise TypeError('G2 must be an ndarray')
+        if not np.iscomplexobj(G):
+            raise TypeError('G2 must be a complex FFT.')
+        if G.shape != self.templatesConj.shape[1:]:
+            raise TypeError('G2 does not fit to the templates, expected {0} and got {1}'.format(self.templatesConj.shape[1:], G.shape))
+    
+    def __call__(self, G2):
+        '''Find the best matching template for an image.
+        
+        Parameters
+        ----------
+            G2 : complex ndarray
+                Half spectrum of the image from fft2.
+        
+        Returns
+        -------
+            index : int
+                Index of the best matching template.
+            score : float
+                Peak value of its correlation map.
+            xyShift : list of floats
+                The shift of the template center against the image center.
+        '''
+        index = 0
+        score = -np.inf
+        
+        for start in range(0, self.num, self.batchsize):
+            maps = self.correlation_maps(G2, start, start + self.batchsize)
+            peaks = np.max(np.reshape(maps, (maps.shape[0], -1)), axis=1)
+            
+            best = np.argmax(peaks)
+            if peaks[best] > score:
+                index = start + int(best)
+                score = float(peaks[best])
+        
+        imageCorr = _weight_correlation(np.multiply(G2.astype(self.dtypes[1], copy=False), self.templatesConj[index]), self.method)
+        xyShift = upsampled_correlation(imageCorr, self.upsampleFactor, kernels = self.kernels, workers = self.workers, real = True, shape = self.imageShape, precision = self.precision, direct = self.direct, halfKernels = self.halfKernels)
+        
+        return index, score, xyShift
+    
+    def match_stack(self, stack):
+        '''Find the best matching template for every image of a stack.
+        
+        Parameters
+        ----------
+            stack : ndarray
+                Stack of images, frame index first. Anything sliceable along the first axis works, e.g. a memmap or an h5py dataset.
+        
+        Returns
+        -------
+            index : ndarray
+                Index of the best matching template for every image.
+            score : ndarray
+                Peak value of the correlation map of the best template.
+            xyShift : ndarray
+                (N, 2) array of the shifts of the best template.
+        '''
+        try:
+            assert(len(stack.shape) == 3)
+            assert(tuple(stack.shape[1:]) == self.imageShape)
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        num = stack.shape[0]
+        index = np.zeros(num, dtype=int)
+        score = np.zeros(num)
+        xyShift = np.zeros((num, 2))
+        
+        for ii in range(num):
+            index[ii], score[ii], xyShift[ii] = self(self.fft2(stack[ii]))
+        
+        return index, score, xyShift
+
+def register_stack(stack, reference = None, mode = 'reference', method = 'cross', upsampleFactor = 1, align = False, batchsize = None, workers = None, direct = False):
+    '''Register all frames of an image stack.
+    
+    The FFTs and correlations are calculated for batches of frames at once and the upsampling is done with upsampled_correlation_stack.
+    
+    The modes are
+        - 'reference': every frame is correlated with the reference.
+        - 'sequential': every frame is correlated with the previous one and the shifts are accumulated, the first frame is correlated with the reference.
+        - 'running_mean': every frame is correlated with the mean of the reference and all frames aligned before. This is done frame by frame.
+    
+    Parameters
+    ----------
+        stack : ndarray
+            Stack of images, frame index first. Anything sliceable along the first axis works, e.g. a memmap or an h5py dataset.
+        reference : ndarray, optional
+            Reference image, the first frame is used if None. (default = None)
+        mode : str, optional
+            Registration mode, 'reference', 'sequential' or 'running_mean'. (default = 'reference')
+        method : str, optional
+            The correlation method to use. Must be 'phase' or 'cross' or 'hybrid' (default = 'cross')
+        upsampleFactor : int
+            Upsample factor for subpixel precision of cross correlation. (default = 1)
+        align : bool, optional
+            Set to also return the stack aligned with the shifts. (default = False)
+        batchsize : int, optional
+            Number of frames processed at once. The intermediate arrays of the upsampling are four times larger than a batch, so
+            large batches run out of cache. If None, batches of about 2**16 pixels are used. (default = None)
+        workers : int, optional
+            Number of workers to use scipy.fft, numpy.fft is used if None. (default = None)
+        direct : bool, optional
+            Set to find the half pixel peak with a 3x3 matrix multiply DFT around the integer peak instead of
+            the inverse FFT of the 2x padded spectrum. Much cheaper for large images. The shifts are identical on clean data,
+            on noise-like correlations the padded path may pick a different half pixel maximum. (default = False)
+    
+    Returns
+    -------
+        xyShift : ndarray
+            (N, 2) array of the shifts of every frame with respect to the reference, as returned by multicorr.
+        aligned : ndarray
+            The aligned stack, only returned if align is True.
+    
+    Example
+    -------
+        >>> import ncempy.algo.multicorr as mc
+        >>> shifts, aligned = mc.register_stack(stack, mode = 'running_mean', upsampleFactor = 10, align = True)
+    
+    '''
+    
+    if mode not in ['reference', 'sequential', 'running_mean']:
+        raise TypeError('{} mode is not allowed'.format(str(mode)))
+    
+    try:
+        assert(len(stack.shape) == 3)
+        assert(stack.shape[0] > 0)
+        if batchsize is None:
+            batchsize = max(1, 2**16 // (stack.shape[1]*stack.shape[2]))
+        batchsize = int(batchsize)
+        assert(batchsize > 0)
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    if reference is None:
+        reference = np.asarray(stack[0])
+    method, upsampleFactor = parse_input(reference, np.asarray(stack[0]), method, upsampleFactor)
+    
+    fft, fftargs = _fft_backend(workers)
+    num = stack.shape[0]
+    
+    kernels = None
+    if upsampleFactor > 2:
+        kernels = dftUpsampleKernels(reference.shape, upsampleFactor)
+    halfKernels = None
+    if direct and upsampleFactor > 1:
+        halfKernels = dftUpsampleKernels(reference.shape, 2)
+    
+    xyShift = np.zeros((num, 2))
+    if align:
+        aligned = np.zeros(stack.shape)
+    
+    Gref = fft.fft2(reference, **fftargs)
+    Gsum = Gref.copy()
+    count = 1
+    
+    for start in range(0, num, batchsize):
+        stop = min(start + batchsize, num)
+        G = fft.fft2(np.asarray(stack[start:stop], dtype='float64'), axes=(-2,-1), **fftargs)
+        
+        if mode == 'reference':
+            imageCorr = _weight_correlation(np.multiply(G, np.conj(Gref)), method)
+            xyShift[start:stop] = upsampled_correlation_stack(imageCorr, upsampleFactor, kernels, workers, direct, halfKernels)
+        
+        elif mode == 'sequential':
+            # previous frames, the one before the first frame is the reference
+            Gprev = np.concatenate((Gref[np.newaxis, :, :], G[:-1]))
+            imageCorr = _weight_correlation(np.multiply(G, np.conj(Gprev)), method)
+            steps = upsampled_correlation_stack(imageCorr, upsampleFactor, kernels, workers, direct, halfKernels)
+            xyShift[start:stop] = np.cumsum(steps, axis=0) + (xyShift[start-1] if start > 0 else 0)
+            Gref = G[-1]
+        
+        else:
+            for ii in range(G.shape[0]):
+                imageCorr = _weight_correlation(np.multiply(G[ii], np.conj(Gsum/count)), method)
+                xyShift[start+ii] = upsampled_correlation(imageCorr, upsampleFactor, kernels = kernels, workers = workers, direct = direct, halfKernels = halfKernels)
+                Gsum += imageShifter(G[ii], -xyShift[start+ii])
+                count += 1
+        
+        if align:
+            aligned[start:stop] = np.real(fft.ifft2(imageShifter(G, -xyShift[start:stop]), axes=(-2,-1), **fftargs))
+    
+    if align:
+        return xyShift, aligned
+    else:
+        return xyShift
+
+def benchmark_precision(sizes = (256, 1024, 2048), precisions = ('double', 'single'), method = 'hybrid', upsampleFactor = 20, num = 5, repeat = 1, verbose = True):
+    '''Benchmark the accuracy and speed of the precisions for full and half spectra.
+
+    Synthetic frames of Gaussian blobs with noise are shifted by random amounts of up to 20 pixels and registered
+    against the unshifted frame with a Correlator. The time per frame includes its FFT, the best of repeat runs is taken.
+
+    Parameters
+    ----------
+        sizes : tuple, optional
+            Edge lengths of the square frames to test. (default = (256, 1024, 2048))
+        precisions : tuple, optional
+            Precisions to test. (default = ('double', 'single'))
+        method : str, optional
+            The correlation method to use. (default = 'hybrid')
+        upsampleFactor : int, optional
+            Upsample factor for subpixel precision. (default = 20)
+        num : int, optional
+            Number of shifted frames per size. (default = 5)
+        repeat : int, optional
+            Number of runs per combination. (default = 1)
+        verbose : bool, optional
+            Set to print a table of the results. (default = True)
+
+    Returns
+    -------
+        results : list
+            List of dicts with keys size, precision, real, error (maximum deviation from the true shifts in pixels) and time (per frame in s).
+    '''
+    results = []
+    rng = np.random.RandomState(0)
+
+    if verbose:
+        print('{:>6} {:>9} {:>6} {:>10} {:>10}'.format('size', 'precision', 'real', 'error /px', 'time /s'))
+
+    for size in sizes:
+        yy, xx = np.mgrid[0:size, 0:size]
+        ref = np.zeros((size, size))
+        for ii in range(20):
+            cy, cx = rng.uniform(0, size, 2)
+            ref += np.exp(-((yy - cy)**2 + (xx - cx)**2)/(2*(size/64.)**2))
+
+        shifts = rng.uniform(-20, 20, (num, 2))
+        Gref = np.fft.fft2(ref)
+        stack = [np.real(np.fft.ifft2(imageShifter(Gref, shift))) + rng.normal(0, 0.05, ref.shape) for shift in shifts]
+
+        for real in (False, True):
+            for precision in precisions:
+                corr = Correlator(np.fft.rfft2(ref) if real else Gref, method, upsampleFactor, real = real, imageShape = ref.shape, precision = precision)
+                times = []
+                for ii in range(repeat):
+                    start = time.perf_counter()
+                    out = np.array([corr(corr.fft2(image)) for image in stack])
+                    times.append((time.perf_counter() - start)/num)
+                error = np.max(np.abs(out - shifts))
+                results.append( {'size': size, 'precision': precision, 'real': real, 'error': error, 'time': min(times)} )
+                if verbose:
+                    print('{:>6} {:>9} {:>6} {:>10.4f} {:>10.4f}'.format(size, precision, str(real), error, min(times)))
+
+    return results
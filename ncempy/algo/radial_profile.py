@@ -23,19 +23,220 @@ The **settings** dict used for the evaluation has the following entries:
         * rad_sigma (float): Sigma for Gaussian used as kernel density estimator [dims].
         * mask (np.ndarray): Binary image as img, 0 for pixels to exclude.
         * fit_maxfev (int): Maxfev forwarded to scipy optimize.
+        * lmax_refine (str): Method to refine local maxima to subpixel positions, see ncempy.algo.local_max.refine_points.
+        * fit_warmstart (bool): Set to initialize the fits of a frame in a stack with the results of the previous frame.
 
 '''
 
-import copy
+import collections
+import concurrent.futures
+import os
+import time
 import numpy as np
+import scipy.ndimage
 import scipy.ndimage.filters
 import scipy.interpolate
+import scipy.optimize
+import scipy.sparse
 import matplotlib.pyplot as plt
 
 import ncempy.algo.math
 import ncempy.algo.distortion
+import ncempy.algo.local_max
 
-def calc_polarcoords ( center, dims, ns=None, dists=None ):
+def _polar_grid( xs, ys, center, ns=None, dists=None, dtype='float64' ):
+    '''Calculate polar coordinates on the grid spanned by the axis vectors xs and ys.
+    
+    Parameters:
+        xs (np.ndarray):    Coordinates along the first axis.
+        ys (np.ndarray):    Coordinates along the second axis.
+        center (np.ndarray):    Center of polar coordinate system.
+        ns (tuple):    List of distortion orders to correct for.
+        dists (np.ndarray):    Parameters for distortions.
+        dtype (str):    Dtype of the returned arrays.
+    
+    Returns:
+        (tuple):    Polar coordinates (r, theta) as two np.ndarrays of shape (len(xs), len(ys)).
+        
+    '''
+    
+    # broadcasting instead of meshgrid
+    dx = (xs - center[0])[:,np.newaxis]
+    dy = (ys - center[1])[np.newaxis,:]
+    
+    # calculate polar coordinate system
+    rs = np.sqrt( np.square(dx) + np.square(dy) )
+    thes = np.arctan2(dy, dx)
+    
+    # correct for distortions
+    if not ns is None:
+        for i in range(len(ns)):
+            rs /= ncempy.algo.distortion.rad_dis(thes, dists[i*2+1], dists[i*2+2], ns[i])
+    
+    return rs.astype(dtype, copy=False), thes.astype(dtype, copy=False)
+    
+
+class PolarGridCache:
+    '''Least recently used cache for polar coordinate grids.
+    
+    Grids are keyed by the image dims, the center, ns and dists. Within a series of patterns the center usually moves by a few pixels only. For equidistant dims the grids are therefore computed once on an image extended by margin pixels on all sides. Any center with the same subpixel offset within margin pixels of the original one is served as a shifted view of that base grid without any computation.
+    
+    To also reuse grids for centers differing in their subpixel offset, set quantum to snap the center to a multiple of quantum pixels. This limits the error of r to about quantum/2 pixels.
+    
+    Returned arrays are read-only views into the cache, copy them before modifying.
+    
+    Parameters:
+        max_bytes (int):    Memory cap for all cached grids in bytes.
+        margin (int):    Extension of the base grids in [px].
+        quantum (float):    Quantization of the center in [px], None to only reuse for exactly matching subpixel offsets.
+        dtype (str):    Dtype of the grids, float32 keeps the relative precision of r at about 1e-7, far below usual radial bin sizes.
+        
+    '''
+    
+    def __init__(self, max_bytes=256*2**20, margin=16, quantum=None, dtype='float32'):
+        '''Init an empty cache.
+        
+        '''
+        
+        try:
+            self.max_bytes = int(max_bytes)
+            self.margin = int(margin)
+            assert(self.margin >= 0)
+            if not quantum is None:
+                quantum = float(quantum)
+                assert(quantum > 0)
+            self.quantum = quantum
+            self.dtype = np.dtype(dtype)
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        self._entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        
+    def clear(self):
+        '''Remove all cached grids.
+        
+        '''
+        
+        self._entries.clear()
+        self.nbytes = 0
+        
+    def _store(self, key, entry):
+        '''Insert entry and evict least recently used entries above the memory cap.
+        
+        '''
+        
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)['nbytes']
+        
+        if entry['nbytes'] > self.max_bytes:
+            # does not fit at all
+            return
+        
+        self._entries[key] = entry
+        self.nbytes += entry['nbytes']
+        while self.nbytes > self.max_bytes:
+            old_key, old_entry = self._entries.popitem(last=False)
+            self.nbytes -= old_entry['nbytes']
+            
+    def get(self, center, dims, ns=None, dists=None):
+        '''Get the polar coordinates for an image of given dims.
+        
+        Same arguments as calc_polarcoords, input is expected to be checked already.
+        
+        Parameters:
+            center (np.ndarray):    Center of polar coordinate system.
+            dims (tuple):    Tuple of dimensions.
+            ns (tuple):    List of distortion orders to correct for.
+            dists (np.ndarray):    Parameters for distortions.
+            
+        Returns:
+            (tuple):    Polar coordinates (r, theta) as read-only np.ndarrays.
+            
+        '''
+        
+        xs = np.asarray(dims[0][0])
+        ys = np.asarray(dims[1][0])
+        
+        if ns is None:
+            dist_key = None
+        else:
+            dist_key = (tuple(int(n) for n in ns), np.asarray(dists, dtype='float64').tobytes())
+        
+        # shift-based reuse only possible on equidistant grids
+        steps = []
+        for vec in (xs, ys):
+            if vec.shape[0] >= 2 and np.allclose(np.diff(vec), vec[1]-vec[0], rtol=1e-9, atol=0):
+                steps.append(float(vec[1]-vec[0]))
+            else:
+                steps.append(None)
+        
+        if None in steps:
+            # exact key only
+            key = ('exact', xs.tobytes(), ys.tobytes(), float(center[0]), float(center[1]), dist_key)
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                entry = self._entries[key]
+                return entry['rs'], entry['thes']
+            
+            self.misses += 1
+            rs, thes = _polar_grid(xs, ys, center, ns, dists, self.dtype)
+            rs.flags.writeable = False
+            thes.flags.writeable = False
+            self._store(key, {'rs': rs, 'thes': thes, 'nbytes': rs.nbytes + thes.nbytes})
+            return rs, thes
+        
+        # center in px, split in integer and subpixel part
+        pxs = []
+        for i in range(2):
+            pos = (float(center[i]) - float((xs, ys)[i][0]))/steps[i]
+            if not self.quantum is None:
+                pos = np.round(pos/self.quantum)*self.quantum
+            k = int(np.floor(pos))
+            # round the subpixel offset to make it usable as key
+            frac = round(pos - k, 12)
+            if frac >= 1.:
+                k += 1
+                frac = 0.
+            pxs.append((k, frac))
+        
+        key = ('shift', xs.shape[0], ys.shape[0], float(xs[0]), float(ys[0]), steps[0], steps[1], pxs[0][1], pxs[1][1], dist_key)
+        
+        entry = self._entries.get(key)
+        if not entry is None:
+            dk = (pxs[0][0] - entry['k'][0], pxs[1][0] - entry['k'][1])
+            if max(abs(dk[0]), abs(dk[1])) > self.margin:
+                entry = None
+        
+        if entry is None:
+            self.misses += 1
+            
+            # base grid centered on this center, extended by margin
+            m = self.margin
+            xs_ext = xs[0] + np.arange(-m, xs.shape[0]+m)*steps[0]
+            ys_ext = ys[0] + np.arange(-m, ys.shape[0]+m)*steps[1]
+            center_q = (xs[0] + (pxs[0][0]+pxs[0][1])*steps[0], ys[0] + (pxs[1][0]+pxs[1][1])*steps[1])
+            
+            rs, thes = _polar_grid(xs_ext, ys_ext, center_q, ns, dists, self.dtype)
+            rs.flags.writeable = False
+            thes.flags.writeable = False
+            entry = {'rs': rs, 'thes': thes, 'k': (pxs[0][0], pxs[1][0]), 'nbytes': rs.nbytes + thes.nbytes}
+            self._store(key, entry)
+            dk = (0, 0)
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        
+        # a center moved by dk px corresponds to the base grid shifted by -dk px
+        sl = ( slice(self.margin - dk[0], self.margin - dk[0] + xs.shape[0]), slice(self.margin - dk[1], self.margin - dk[1] + ys.shape[0]) )
+        
+        return entry['rs'][sl], entry['thes'][sl]
+        
+
+def calc_polarcoords ( center, dims, ns=None, dists=None, cache=None ):
     '''Calculate the polar coordinates for an image of given shape.
     
     Center is assumed to be in real coordinates (if not just fake the dims).
@@ -46,6 +247,7 @@ def calc_polarcoords ( center, dims, ns=None, dists=None ):
         dims (tuple):    Tuple of dimensions.
         ns (tuple):    List of distortion orders to correct for.
         dists (np.ndarray):    Parameters for distortions.
+        cache (PolarGridCache):    Cache to take the grids from, the returned arrays are read-only then.
     
     Returns:
         (tuple):    Polarcoordinates (r, theta) of polar coordinate system as two np.ndarrays with same dimensions as original image.
@@ -69,33 +271,30 @@ def calc_polarcoords ( center, dims, ns=None, dists=None ):
             # check dists
             assert(dists.shape[0] == len(ns)*2+1)
             
+        if not cache is None:
+            assert(isinstance(cache, PolarGridCache))
+            
     except:
         raise TypeError('Something wrong with the input!')
     
-    # create coordinates
-    xx, yy = np.meshgrid( dims[0][0], dims[1][0], indexing='ij' )
+    if not cache is None:
+        return cache.get(center, dims, ns, dists)
     
-    # calculate polar coordinate system
-    rs = np.sqrt( np.square(xx-center[0]) + np.square(yy-center[1]) )
-    thes = np.arctan2(yy-center[1], xx-center[0])
-    
-    # correct for distortions
-    if not ns is None:
-        for i in range(len(ns)):
-            rs /= ncempy.algo.distortion.rad_dis(thes, dists[i*2+1], dists[i*2+2], ns[i])    
-    
-    return rs, thes
+    return _polar_grid(dims[0][0], dims[1][0], center, ns, dists)
     
       
-def correct_distortion( img, dims, center, ns, dists ):
+def correct_distortion( img, dims, center, ns, dists, cache=None ):
     '''Give corrected version of img with respect to distortions.
     
+    A spline is fitted to the image on every call. To correct many images with the same center and distortions use a DistortionCorrector instead.
+    
     Parameters:
         img (np.ndarray):    Image (2D).
         dims (tuple):    Dimensions tuple.
         center (np.ndarray/tuple):    Center to be used.
         ns (tuple):    List of distortion orders.
         dists (np.ndarray):    Distortion parameters.
+        cache (PolarGridCache):    Cache to take the polar grids from.
         
     Returns:
         (np.ndarray):   Corrected image.
@@ -123,11 +322,11 @@ def correct_distortion( img, dims, center, ns, dists ):
     except:
         raise TypeError('Something wrong with the input!')
     
-    rs, thes = calc_polarcoords (center, dims )
+    rs, thes = calc_polarcoords (center, dims, cache=cache )
     
-    # anti distort
+    # anti distort, not in place as cached grids are read-only
     for i in range(len(ns)):
-        rs *= ncempy.algo.distortion.rad_dis(thes, dists[i*2+1], dists[i*2+2], ns[i]) 
+        rs = rs * ncempy.algo.distortion.rad_dis(thes, dists[i*2+1], dists[i*2+2], ns[i]) 
     
     dis_xx = rs*np.cos(thes)+center[0]
     dis_yy = rs*np.sin(thes)+center[1]
@@ -137,11 +336,335 @@ def correct_distortion( img, dims, center, ns, dists ):
     return f.ev(dis_xx, dis_yy)
         
     
+def _dim_topx( vals, vec ):
+    '''Convert real coordinates to (fractional) pixel indices along a dimension vector.
+    
+    Positions outside are clamped to the edges.
+    
+    Parameters:
+        vals (np.ndarray):    Real coordinates.
+        vec (np.ndarray):    Dimension vector, monotonic.
+        
+    Returns:
+        (np.ndarray):    Pixel indices.
+        
+    '''
+    
+    ix = np.arange(vec.shape[0], dtype='float64')
+    if vec.shape[0] > 1 and vec[0] > vec[-1]:
+        return np.interp(vals, vec[::-1], ix[::-1])
+    return np.interp(vals, vec, ix)
+    
+    
+def _interp_weights( pos, n, order ):
+    '''Taps and weights for 1D interpolation at fractional pixel positions.
+    
+    Order 1 is linear interpolation, order 3 the cubic convolution kernel of Keys (a=-0.5). Taps outside are clamped to the edges.
+    
+    Parameters:
+        pos (np.ndarray):    Fractional pixel positions.
+        n (int):    Number of pixels along the axis.
+        order (int):    Interpolation order, 1 or 3.
+        
+    Returns:
+        (tuple):    Tap indices and weights, both of shape (len(pos), order+1).
+        
+    '''
+    
+    i0 = np.floor(pos).astype(int)
+    f = (pos - i0)[:,np.newaxis]
+    
+    if order == 1:
+        taps = i0[:,np.newaxis] + np.arange(2)[np.newaxis,:]
+        weights = np.concatenate( (1.-f, f), axis=1 )
+    else:
+        taps = i0[:,np.newaxis] + np.arange(-1,3)[np.newaxis,:]
+        t = np.abs(f - np.arange(-1,3)[np.newaxis,:])
+        a = -0.5
+        weights = np.where( t <= 1., ((a+2.)*t - (a+3.))*t*t + 1., ((a*t - 5.*a)*t + 8.*a)*t - 4.*a )
+    
+    return np.clip(taps, 0, n-1), weights
+    
+    
+class DistortionCorrector:
+    '''Reusable correction of distortions for images sharing dims, center and distortions.
+    
+    The resampling coordinates are computed once. Two methods are available:
+    
+        * 'map':    Spline interpolation of the given order with scipy.ndimage.map_coordinates. With order 3 this corresponds to the spline used in correct_distortion (up to the boundary conditions).
+        * 'sparse':    Precomputed sparse interpolation matrix, linear (order 1) or cubic convolution (order 3). Applying it is a single sparse product, also for whole stacks.
+    
+    Stacks are processed in chunks of frames by a thread pool. Set dtype to float32 to halve memory traffic, the interpolation is then done in single precision.
+    
+    Parameters:
+        dims (tuple):    Dimensions tuple.
+        center (np.ndarray/tuple):    Center to be used.
+        ns (tuple):    List of distortion orders.
+        dists (np.ndarray):    Distortion parameters.
+        method (str):    Resampling method, 'map' or 'sparse'.
+        order (int):    Interpolation order, 0 to 5 for 'map', 1 or 3 for 'sparse'.
+        dtype (str):    Dtype used for coordinates and results, float64 or float32.
+        cache (PolarGridCache):    Cache to take the polar grids from.
+        
+    '''
+    
+    def __init__(self, dims, center, ns, dists, method='map', order=3, dtype='float64', cache=None):
+        '''Init precomputing the resampling coordinates.
+        
+        '''
+        
+        # check input
+        try:
+            # check center 
+            center = np.array(center)
+            center = np.reshape(center, 2)
+            
+            # check if enough dims availabel
+            assert(len(dims)>=2)
+            assert(len(dims[0])==3)
+            
+            # check orders
+            assert(len(ns)>=1)
+            
+            # check dists
+            assert(dists.shape[0] == len(ns)*2+1)
+            
+            assert(method in ('map', 'sparse'))
+            order = int(order)
+            if method == 'map':
+                assert(order in range(6))
+            else:
+                assert(order in (1,3))
+            
+            self.dtype = np.dtype(dtype)
+            assert(self.dtype in (np.dtype('float32'), np.dtype('float64')))
+            
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        self.method = method
+        self.order = order
+        self.shape = (len(dims[0][0]), len(dims[1][0]))
+        
+        rs, thes = calc_polarcoords (center, dims, cache=cache )
+        
+        # anti distort
+        for i in range(len(ns)):
+            rs = rs * ncempy.algo.distortion.rad_dis(thes, dists[i*2+1], dists[i*2+2], ns[i]) 
+        
+        dis_xx = rs*np.cos(thes)+center[0]
+        dis_yy = rs*np.sin(thes)+center[1]
+        
+        # coordinates in px
+        px = _dim_topx(np.ravel(dis_xx), np.asarray(dims[0][0], dtype='float64'))
+        py = _dim_topx(np.ravel(dis_yy), np.asarray(dims[1][0], dtype='float64'))
+        
+        if method == 'map':
+            self.coords = np.array([np.reshape(px, self.shape), np.reshape(py, self.shape)], dtype=self.dtype)
+            self.matrix = None
+        
+        else:
+            self.coords = None
+            
+            # outer product of the 1D interpolation kernels
+            tx, wx = _interp_weights(px, self.shape[0], order)
+            ty, wy = _interp_weights(py, self.shape[1], order)
+            
+            cols = tx[:,:,np.newaxis]*self.shape[1] + ty[:,np.newaxis,:]
+            vals = wx[:,:,np.newaxis]*wy[:,np.newaxis,:]
+            rows = np.repeat(np.arange(px.shape[0]), cols.shape[1]*cols.shape[2])
+            
+            # clamped taps are summed up
+            self.matrix = scipy.sparse.csr_matrix( (np.ravel(vals).astype(self.dtype), (rows, np.ravel(cols))), shape=(px.shape[0], px.shape[0]) )
+    
+    def _correct_chunk(self, chunk):
+        '''Correct a stack of frames.
+        
+        '''
+        
+        if self.method == 'map':
+            out = np.empty(chunk.shape, dtype=self.dtype)
+            for i in range(chunk.shape[0]):
+                scipy.ndimage.map_coordinates(chunk[i].astype(self.dtype, copy=False), self.coords, output=out[i], order=self.order, mode='nearest')
+            return out
+        
+        else:
+            flat = np.reshape(chunk, (chunk.shape[0], -1)).astype(self.dtype, copy=False)
+            return np.reshape(self.matrix.dot(flat.transpose()).transpose(), chunk.shape)
+    
+    def __call__(self, img, workers=None, chunksize=None):
+        '''Correct an image or every image in a stack.
+        
+        Parameters:
+            img (np.ndarray):    Image or stack of images (frame index first).
+            workers (int):    Number of threads for stacks, defaults to the number of CPUs.
+            chunksize (int):    Number of frames per chunk, defaults to distribute the frames evenly over the workers.
+            
+        Returns:
+            (np.ndarray):    Corrected image or stack.
+            
+        '''
+        
+        try:
+            assert(isinstance(img, np.ndarray))
+            assert(np.array_equal(img.shape[-2:], self.shape))
+            assert(len(img.shape) in (2,3))
+            
+            if workers is None:
+                workers = os.cpu_count() or 1
+            workers = int(workers)
+            assert(workers >= 1)
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        if len(img.shape) == 2:
+            return self._correct_chunk(img[np.newaxis,:,:])[0]
+        
+        if chunksize is None:
+            chunksize = int(np.ceil(img.shape[0]/workers))
+        chunksize = max(int(chunksize), 1)
+        
+        starts = range(0, img.shape[0], chunksize)
+        if workers == 1 or len(starts) == 1:
+            results = [self._correct_chunk(img[start:start+chunksize]) for start in starts]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda start: self._correct_chunk(img[start:start+chunksize]), starts))
+        
+        return np.concatenate(results, axis=0)
+        
+        
+class RadialIntegrator:
+    '''Reusable integrator for radial profiles of images sharing the same radial coordinates.
+    
+    Everything not depending on the image intensities is precomputed once: the radial bin of every used pixel, the number of (unmasked) pixels per bin and its smoothed version. A profile then costs a single np.bincount or sparse matrix-vector product plus the 1D smoothing. A whole (N, Y, X) stack is integrated with one sparse matrix-matrix product.
+    
+    Results equal calc_radialprofile (same bins, Gaussian kernel density estimator and masking).
+    
+    Parameters:
+        rs (np.ndarray):    Array containing the radial distance, same shape as the images.
+        rMax (float):      Maximum radial distance used for the radial profile.
+        dr (float):    Stepsize for r-axis of radial distance.
+        rsigma (float):    Sigma for Gaussian used as kernel density estimator.
+        mask (np.ndarray):    Mask image, values at 0 are excluded from radial profile.
+        method (str):    Use 'bincount' or 'sparse' for single images, stacks always use the sparse matrix.
+        
+    '''
+    
+    def __init__(self, rs, rMax, dr, rsigma, mask=None, method='bincount'):
+        '''Init precomputing the bin indices and counts.
+        
+        '''
+        
+        # check input
+        try:
+            assert(isinstance(rs, np.ndarray))
+            
+            rMax = float(rMax)
+            dr = float(dr)
+            rsigma = float(rsigma)
+            
+            if not mask is None:
+                assert(isinstance(mask, np.ndarray))
+                assert(np.array_equal(rs.shape, mask.shape))
+                
+            assert(method in ('bincount', 'sparse'))
+            
+        except:
+            raise TypeError('Something wrong with input.')
+        
+        self.shape = rs.shape
+        self.method = method
+        self.sigma = rsigma/dr
+        
+        # prepare radial axis for hist
+        rBins = np.arange(0, rMax, dr)
+        self.nbins = max(len(rBins)-1, 0)
+        self.r = rBins[:-1]
+        
+        # select pixels within the bins and the mask
+        rs_flat = np.ravel(rs)
+        sel = np.logical_and(rs_flat >= 0, rs_flat <= rBins[-1]) if self.nbins > 0 else np.zeros(rs_flat.shape, dtype=bool)
+        if not mask is None:
+            mask_flat = np.ravel(mask).astype('float64')
+            sel = np.logical_and(sel, np.logical_and(mask_flat != 0, np.logical_not(np.isnan(mask_flat))))
+        
+        self.ix = np.flatnonzero(sel)
+        
+        # bins as in np.histogram, intervals closed on the left, last one closed on both sides
+        bins = np.searchsorted(rBins, rs_flat[self.ix], side='right') - 1
+        bins[bins == self.nbins] = self.nbins - 1
+        self.bins = bins
+        
+        # pixel counts
+        self.count = np.bincount(self.bins, minlength=self.nbins).astype('float64')
+        self.count_sm = scipy.ndimage.filters.gaussian_filter1d(self.count, self.sigma)
+        
+        self._matrix = None
+        
+    @property
+    def matrix(self):
+        '''(scipy.sparse.csc_matrix):    Sparse (bins, pixels) matrix summing the pixels into bins, built on first use.'''
+        
+        if self._matrix is None:
+            # column compressed to stream through the pixels of C-ordered stacks
+            self._matrix = scipy.sparse.csc_matrix( (np.ones(self.ix.shape[0]), (self.bins, self.ix)), shape=(self.nbins, int(np.prod(self.shape))) )
+        return self._matrix
+        
+    def _normalize(self, signal, axis=-1):
+        '''Smooth the signal and divide by the smoothed counts.
+        
+        '''
+        
+        signal_sm = scipy.ndimage.filters.gaussian_filter1d(signal, self.sigma, axis=axis)
+        
+        # masked regions lead to 0 in count_sm, divide produces nans, just ignore the warning    
+        old_err_state = np.seterr(divide='ignore',invalid='ignore')    
+        signal_sm = np.divide(signal_sm, self.count_sm)
+        np.seterr(**old_err_state)
+        
+        return signal_sm
+        
+    def __call__(self, img):
+        '''Calculate the radial profile of an image or of every image in a stack.
+        
+        Parameters:
+            img (np.ndarray):    Image with shape of rs or stack of those images (frame index first).
+            
+        Returns:
+            (tuple):    Tuple of radial and intensity axes. For stacks the intensities are given as (N, bins) array.
+            
+        '''
+        
+        try:
+            assert(isinstance(img, np.ndarray))
+            assert(np.array_equal(img.shape[-len(self.shape):], self.shape))
+            assert(len(img.shape) in (len(self.shape), len(self.shape)+1))
+        except:
+            raise TypeError('Something wrong with input.')
+        
+        if len(img.shape) == len(self.shape):
+            if self.method == 'bincount':
+                signal = np.bincount(self.bins, weights=np.ravel(img)[self.ix], minlength=self.nbins)
+            else:
+                signal = self.matrix.dot(np.ravel(img).astype('float64'))
+            
+            return self.r, self._normalize(signal)
+        
+        else:
+            # (bins, pixels) x (pixels, N)
+            signal = self.matrix.dot(np.reshape(img, (img.shape[0], -1)).astype('float64').transpose())
+            
+            return self.r, self._normalize(signal.transpose(), axis=-1)
+            
+    
 def calc_radialprofile( img, rs, rMax, dr, rsigma, mask=None):
     '''Calculate the radial profile using Gaussian kernel density estimator.
     
     It is suggested to use an rMax such that all directions are still in the image, otherwise outer areas will contribute differently and lead to different signal-to-noise. A value of dr corresponding to 1/10 px and rsigma corresponding to 1 px are good parameters.
     
+    For many images sharing rs, set up a RadialIntegrator once instead.
+    
     Parameters:
         img (np.ndarray):    Image to take radial profile of intensity from.
         rs (np.ndarray):    Array containing the radial distance, same shape as img.
@@ -172,35 +695,7 @@ def calc_radialprofile( img, rs, rMax, dr, rsigma, mask=None):
     except:
         raise TypeError('Something wrong with input.')
     
-    # process mask
-    if mask is None:
-        mask = np.ones(img.shape)
-    mask = mask.astype('float64')
-    mask[np.where( mask > 0 )] = 1
-    mask[np.where( mask == 0 )] = np.nan
-    
-    
-    # prepare radial axis for hist  
-    rBins = np.arange(0, rMax, dr)
-    
-    radialIndex = np.round(rs/dr)+1
-    rBinMax = len(rBins)
-    sel = (radialIndex<=rBinMax)
-    
-    sel = np.logical_and(sel, np.logical_not(np.isnan(mask)) )
-    
-    signal = np.histogram(rs[sel], rBins, weights=img[sel])
-    count = np.histogram(rs[sel], rBins, weights=np.ones(img[sel].shape))
-
-    signal_sm = scipy.ndimage.filters.gaussian_filter1d(signal[0], rsigma/dr)
-    count_sm = scipy.ndimage.filters.gaussian_filter1d(count[0], rsigma/dr)
-    
-    # masked regions lead to 0 in count_sm, divide produces nans, just ignore the warning    
-    old_err_state = np.seterr(divide='ignore',invalid='ignore')    
-    signal_sm = np.divide(signal_sm,count_sm)
-    np.seterr(**old_err_state)    
-        
-    return rBins[:-1], signal_sm
+    return RadialIntegrator(rs, rMax, dr, rsigma, mask=mask)(img)
     
     
 def plot_radialprofile( r, intens, dims, show=False ):
@@ -269,7 +764,24 @@ def residuals_fit( param, r, intens, funcs ):
     return intens - ncempy.algo.math.sum_functions(r, funcs, param)
     
     
-def fit_radialprofile( r, intens, funcs, init_guess, maxfev=None ):
+def jacobian_fit( param, r, intens, funcs ):
+    '''Jacobian of residuals_fit with respect to the fit parameters.
+    
+    Parameters:
+        param (np.ndarray):    Fit parameters.
+        r (np.ndarray):    r-axis.
+        intens (np.ndarray):    Intensity-axis.
+        funcs (tuple):    List of functions to include.
+        
+    Returns:
+        (np.ndarray):    Jacobian of shape (len(r), len(param)).
+        
+    '''
+    
+    return -ncempy.algo.math.sum_functions_jac(r, funcs, param)
+    
+    
+def fit_radialprofile( r, intens, funcs, init_guess, maxfev=None, jac=True, check_jac=False ):
     '''Fit the radial profile.
     
     Convenience wrapper for fitting.
@@ -279,6 +791,9 @@ def fit_radialprofile( r, intens, funcs, init_guess, maxfev=None ):
         intens (np.ndarray):    Intensity-axis of radial profile.
         funcs (tuple):    List of functions.
         init_guess (np.ndarray):    Initial guess for parameters of functions in funcs.
+        maxfev (int):    Max number of function evaluations forwarded to scipy.optimize.leastsq().
+        jac (bool):    Set to use the analytic Jacobian instead of finite differences.
+        check_jac (bool):    Set to compare the analytic Jacobian against finite differences at the initial guess.
         
     Returns:
         (np.ndarray):    Optimized parameters.
@@ -305,7 +820,15 @@ def fit_radialprofile( r, intens, funcs, init_guess, maxfev=None ):
     if maxfev is None:
         maxfev = 1000
  
-    popt, flag = scipy.optimize.leastsq( residuals_fit, init_guess, args=(r, intens, funcs), maxfev=maxfev)
+    # resolve functions and buffers once for all residual calls
+    model = ncempy.algo.math.CompositeModel(funcs, r)
+    
+    if check_jac:
+        ncempy.algo.math.check_jac( model.residuals, model.residuals_jac, init_guess, args=(intens,) )
+    
+    Dfun = model.residuals_jac if jac else None
+ 
+    popt, flag = scipy.optimize.leastsq( model.residuals, init_guess, args=(intens,), Dfun=Dfun, maxfev=maxfev)
 
     if flag not in [1,2,3,4]:
         print('WARNING: fitting of radial profile failed.')
@@ -313,6 +836,129 @@ def fit_radialprofile( r, intens, funcs, init_guess, maxfev=None ):
     return popt
 
 
+def _fit_profiles_chunk( r, intens, funcs, init_guess, maxfev, warm_start, jac ):
+    '''Fit a chunk of radial profiles one after another.
+    
+    Module level function to be usable in worker processes.
+    
+    Parameters:
+        r (np.ndarray):    r-axis shared by all profiles.
+        intens (np.ndarray):    Intensities with shape (N, len(r)).
+        funcs (tuple):    List of functions.
+        init_guess (np.ndarray):    Initial guess for the first profile.
+        maxfev (int):    Max number of function evaluations per fit.
+        warm_start (bool):    Set to start each fit from the previous result.
+        jac (bool):    Set to use the analytic Jacobian.
+        
+    Returns:
+        (tuple):    Optimized parameters (N, nparams), leastsq flags, function evaluations and restart indicators per profile.
+        
+    '''
+    
+    model = ncempy.algo.math.CompositeModel(funcs, r)
+    Dfun = model.residuals_jac if jac else None
+    
+    popts = np.zeros((intens.shape[0], model.nparams))
+    flags = np.zeros(intens.shape[0], dtype=int)
+    nfevs = np.zeros(intens.shape[0], dtype=int)
+    restarted = np.zeros(intens.shape[0], dtype=bool)
+    
+    guess = init_guess
+    for i in range(intens.shape[0]):
+        popt, cov, info, msg, flag = scipy.optimize.leastsq( model.residuals, guess, args=(intens[i],), Dfun=Dfun, maxfev=maxfev, full_output=True )
+        nfev = info['nfev'] + info.get('njev', 0)
+        
+        # failed warm start, retry from the initial guess
+        if flag not in [1,2,3,4] and not guess is init_guess:
+            popt, cov, info, msg, flag = scipy.optimize.leastsq( model.residuals, init_guess, args=(intens[i],), Dfun=Dfun, maxfev=maxfev, full_output=True )
+            nfev += info['nfev'] + info.get('njev', 0)
+            restarted[i] = True
+        
+        popts[i] = popt
+        flags[i] = flag
+        nfevs[i] = nfev
+        
+        if warm_start and flag in [1,2,3,4]:
+            guess = popt
+        else:
+            guess = init_guess
+    
+    return popts, flags, nfevs, restarted
+
+
+def fit_radialprofile_stack( r, intens, funcs, init_guess, maxfev=None, warm_start=True, workers=1, chunksize=None, jac=True ):
+    '''Fit a series of radial profiles sharing the same r-axis.
+    
+    With warm_start each profile is fitted starting from the result of the previous one, which saves most iterations for slowly changing series. If a warm-started fit fails, it is repeated from init_guess.
+    
+    With several workers the profiles are split into contiguous chunks fitted in separate processes. Warm starts then only propagate within a chunk, each chunk starts from init_guess.
+    
+    Parameters:
+        r (np.ndarray):    r-axis of the radial profiles.
+        intens (np.ndarray):    Intensities with shape (N, len(r)).
+        funcs (tuple):    List of functions.
+        init_guess (np.ndarray):    Initial guess for parameters of functions in funcs.
+        maxfev (int):    Max number of function evaluations per profile forwarded to scipy.optimize.leastsq().
+        warm_start (bool):    Set to start each fit from the previous result.
+        workers (int):    Number of worker processes.
+        chunksize (int):    Number of profiles per chunk, defaults to distribute the profiles evenly over the workers.
+        jac (bool):    Set to use the analytic Jacobian instead of finite differences.
+        
+    Returns:
+        (tuple):    Optimized parameters with shape (N, nparams) and a dict of per profile statistics (converged, flag, nfev, restarted).
+        
+    '''
+    
+    try:
+        # check data
+        assert(isinstance(r, np.ndarray))
+        assert(isinstance(intens, np.ndarray))
+        assert(len(intens.shape) == 2)
+        assert(intens.shape[1] == r.shape[0])
+        
+        # funcs and params
+        assert(len(funcs)>=1)
+        for i in range(len(funcs)):
+            assert(funcs[i] in ncempy.algo.math.lkp_funcs)
+        
+        init_guess = np.array(init_guess, dtype='float64')
+        init_guess = np.reshape(init_guess, sum(map(lambda x: ncempy.algo.math.lkp_funcs[x][1], funcs)))
+        
+        workers = int(workers)
+        assert(workers >= 1)
+    except:
+        raise TypeError('Something wrong with the input!')
+    
+    if maxfev is None:
+        maxfev = 1000
+    
+    if chunksize is None:
+        chunksize = int(np.ceil(intens.shape[0]/workers))
+    chunksize = max(int(chunksize), 1)
+    
+    starts = range(0, intens.shape[0], chunksize)
+    args = (funcs, init_guess, maxfev, warm_start, jac)
+    if workers == 1 or len(starts) == 1:
+        results = [_fit_profiles_chunk(r, intens[start:start+chunksize], *args) for start in starts]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_fit_profiles_chunk, r, intens[start:start+chunksize], *args) for start in starts]
+            results = [future.result() for future in futures]
+    
+    popts = np.concatenate([res[0] for res in results], axis=0)
+    flags = np.concatenate([res[1] for res in results])
+    
+    stats = { 'converged': np.isin(flags, [1,2,3,4]),
+              'flag': flags,
+              'nfev': np.concatenate([res[2] for res in results]),
+              'restarted': np.concatenate([res[3] for res in results]) }
+    
+    if not np.all(stats['converged']):
+        print('WARNING: fitting of {} radial profiles failed.'.format(np.count_nonzero(np.logical_not(stats['converged']))))
+    
+    return popts, stats
+
+
 def plot_fit( r, intens, dims, funcs, param, show=False ):
     '''Plot the fit results to the radial profile.
     
@@ -380,14 +1026,303 @@ def plot_fit( r, intens, dims, funcs, param, show=False ):
     return plot
     
     
-def run_singleImage( img, dims, settings, show=False ):
+class RingDiffPipeline:
+    '''Evaluation of ring diffraction patterns, set up once for many frames with the same settings and dims.
+    
+    Everything not depending on the image is prepared in the constructor: the defaults of the optional settings, the initial center in real coordinates, the r-axis of the radial profile, the selection of the fit range and of the background fixpoints, and the compiled fit models. Frames are then processed by calling the pipeline, see run_singleImage for the single stages.
+    
+    With timing enabled the wall time of every stage is accumulated in timings and passed to hook(stage, elapsed). With profile enabled additionally a record per frame is appended to records, holding the wall times of the stages, the function evaluations of the fits and the sizes of the processed arrays, see profile_summary to aggregate them. Without both, no measurements are taken.
+    
+    Parameters:
+        settings (dict):    Dict of settings necessary for the evaluation.
+        dims (tuple):    Corresponding dim vectors of the frames.
+        warm_start (bool):    Set to start the fits of a frame from the results of the previous frame, defaults to settings['fit_warmstart'].
+        timing (bool):    Set to record stage timings.
+        hook (function):    Called as hook(stage, elapsed) after every stage, enables timing.
+        cache (PolarGridCache):    Cache for the polar coordinate grids.
+        profile (bool):    Set to keep per frame records of timings, function evaluations and sizes.
+    
+    '''
+    
+    stages = ('local_max', 'filter_ring', 'center', 'distortion', 'polar', 'histogram', 'background', 'fit')
+    '''(tuple):    Names of the timed stages.'''
+    
+    fit_stages = ('center', 'distortion', 'background', 'fit')
+    '''(tuple):    Names of the stages counting function evaluations.'''
+    
+    size_labels = ('points', 'ring_points', 'pixels', 'profile')
+    '''(tuple):    Names of the recorded sizes: local maxima, local maxima on the ring, pixels in the radial profile and its length.'''
+    
+    def __init__(self, settings, dims, warm_start=None, timing=False, hook=None, cache=None, profile=False):
+        '''Init resolving the settings and precomputing the image independent parts.
+        
+        '''
+        
+        try:
+            assert(type(settings) is dict)
+            
+            # check if dims available
+            assert(len(dims)>=2)
+            assert(len(dims[0])==3)
+            assert(len(dims[1])==3)
+            
+            if not hook is None:
+                assert(callable(hook))
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        self.dims = dims
+        self.shape = (len(dims[0][0]), len(dims[1][0]))
+        self.cache = cache
+        
+        # shallow copy, the mask is only read
+        self.settings = dict(settings)
+        
+        # defaults for optional settings
+        step = np.abs(dims[0][0][0]-dims[0][0][1])
+        if self.settings.get('rad_rmax') is None:
+            self.settings['rad_rmax'] = step*np.min(self.shape)/2.0
+        if self.settings.get('rad_dr') is None:
+            self.settings['rad_dr'] = step/10.
+        if self.settings.get('rad_sigma') is None:
+            self.settings['rad_sigma'] = step
+        if self.settings.get('plt_imgminmax') is None:
+            self.settings['plt_imgminmax'] = (0.,1.)
+        self.settings.setdefault('mask', None)
+        self.settings.setdefault('fit_maxfev', None)
+        
+        if warm_start is None:
+            warm_start = self.settings.get('fit_warmstart')
+        self.warm_start = bool(warm_start)
+        
+        # initial center in real space
+        self.center_init = ncempy.algo.local_max.points_todim(self.settings['lmax_cinit'], dims)
+        
+        # r-axis of the radial profile, cut to the fit range
+        r = np.arange(0, self.settings['rad_rmax'], self.settings['rad_dr'])[:-1]
+        self.sel = np.flatnonzero( (r>=self.settings['fit_rrange'][0])*(r<=self.settings['fit_rrange'][1]) )
+        self.r = r[self.sel]
+        
+        # indices of the points around the background fixpoints
+        self.back_ix = np.concatenate( [np.flatnonzero(np.abs(self.r-xpoint) < self.settings['back_xswidth']) for xpoint in self.settings['back_xs']] + [np.zeros(0, dtype=int)] )
+        
+        # fit models bound to their r-axes
+        self.funcs_back = ('const', 'powlaw')
+        self.model_back = ncempy.algo.math.CompositeModel(self.funcs_back, self.r[self.back_ix])
+        self.model_back_full = ncempy.algo.math.CompositeModel(self.funcs_back, self.r)
+        self.model_fit = ncempy.algo.math.CompositeModel(self.settings['fit_funcs'], self.r)
+        
+        self.back_init = np.reshape(np.array(self.settings['back_init'], dtype='float64'), self.model_back.nparams)
+        self.fit_init = np.reshape(np.array(self.settings['fit_init'], dtype='float64'), self.model_fit.nparams)
+        
+        # timing and profiling
+        self.hook = hook
+        self.profile = bool(profile)
+        self.timing = bool(timing) or not hook is None or self.profile
+        self.timings = collections.OrderedDict( (stage, 0.) for stage in self.stages )
+        self.records = []
+        self._record_ix = dict( (stage, i) for (i, stage) in enumerate(self.stages) )
+        self._frame = None
+        self.nframes = 0
+        
+        self.reset()
+    
+    def reset(self):
+        '''Reset the warm start guesses to the initial guesses from the settings.
+        
+        '''
+        
+        self._back_guess = self.back_init
+        self._fit_guess = self.fit_init
+    
+    def _record(self, stage, t):
+        '''Accumulate the time since t for stage.
+        
+        Parameters:
+            stage (str):    Name of the stage.
+            t (float):    Start time, None if timing is disabled.
+        
+        Returns:
+            (float):    Start time of the next stage.
+        
+        '''
+        
+        if t is None:
+            return None
+        
+        now = time.perf_counter()
+        self.timings[stage] += now-t
+        if not self._frame is None:
+            self._frame[0][self._record_ix[stage]] += now-t
+        if not self.hook is None:
+            self.hook(stage, now-t)
+        
+        return now
+    
+    def _fit(self, model, guess, intens, maxfev, stage):
+        '''Least squares fit of a compiled model.
+        
+        '''
+        
+        popt, cov, info, msg, flag = scipy.optimize.leastsq( model.residuals, guess, args=(intens,), Dfun=model.residuals_jac, maxfev=maxfev, full_output=True )
+        
+        if flag not in [1,2,3,4]:
+            print('WARNING: fitting of radial profile failed.')
+        
+        if not self._frame is None:
+            self._frame[1][self.fit_stages.index(stage)] = info['nfev']
+        
+        return popt, flag in [1,2,3,4]
+    
+    def _size(self, label, size):
+        '''Record a size for the profile of the current frame.
+        
+        '''
+        
+        if not self._frame is None:
+            self._frame[2][self.size_labels.index(label)] = size
+    
+    def __call__(self, img, show=False, points=None):
+        '''Evaluate a single ring diffraction pattern.
+        
+        Parameters:
+            img (np.ndarray):    Image.
+            show (bool):    Set to directly show plots interactively.
+            points (np.ndarray):    Precomputed local maxima in [px], e.g. from local_max_stack. If None, they are detected in img.
+        
+        Returns:
+            (tuple):    Radial profile after background subtraction, optimized fit parameters, center, distortions, raw radial profile, background parameters and the resolved settings (not to be modified).
+        
+        '''
+        
+        try:
+            assert(isinstance(img, np.ndarray))
+            assert(np.array_equal(img.shape, self.shape))
+        except:
+            raise TypeError('Something wrong with the input!')
+        
+        settings = self.settings
+        t = time.perf_counter() if self.timing else None
+        if self.profile:
+            # times, function evaluations and sizes of this frame
+            self._frame = ( np.zeros(len(self.stages)), np.zeros(len(self.fit_stages), dtype=int), np.zeros(len(self.size_labels), dtype=int) )
+        
+        # get local maxima an turn them into real space coords
+        if points is None:
+            points = ncempy.algo.local_max.local_max(img, settings['lmax_r'], settings['lmax_thresh'])
+        if not settings.get('lmax_refine') is None and not points is None:
+            points = ncempy.algo.local_max.refine_points(img, points, method=settings['lmax_refine'])
+        points = ncempy.algo.local_max.points_todim(points, self.dims)
+        t = self._record('local_max', t)
+        self._size('points', 0 if points is None else points.shape[0])
+        
+        # filter to single ring
+        points = ncempy.algo.distortion.filter_ring(points, self.center_init, settings['lmax_range'])
+        t = self._record('filter_ring', t)
+        self._size('ring_points', 0 if points is None else points.shape[0])
+        
+        if show:
+            plot = ncempy.algo.local_max.plot_points(img, points, vminmax=settings['plt_imgminmax'], dims=self.dims, invert=True, show=show)
+        
+        # optimize center
+        if self.profile:
+            center, info = ncempy.algo.distortion.optimize_center(points, self.center_init, verbose=show, full_output=True)
+            self._frame[1][0] = info['nfev']
+        else:
+            center = ncempy.algo.distortion.optimize_center(points, self.center_init, verbose=show)
+        t = self._record('center', t)
+        
+        # fit distortions
+        points_plr = ncempy.algo.distortion.points_topolar(points, center)
+        if self.profile:
+            dists, info = ncempy.algo.distortion.optimize_distortion(points_plr, settings['ns'], full_output=True)
+            self._frame[1][1] = info['nfev']
+        else:
+            dists = ncempy.algo.distortion.optimize_distortion(points_plr, settings['ns'])
+        t = self._record('distortion', t)
+        if show:
+            plot = ncempy.algo.distortion.plot_distpolar(points_plr, self.dims, dists, settings['ns'], show=show)
+        
+        # calc coordinates in optimized system
+        rs, thes = calc_polarcoords( center, self.dims, settings['ns'], dists, cache=self.cache )
+        t = self._record('polar', t)
+        
+        # extract radial profile
+        integ = RadialIntegrator( rs, settings['rad_rmax'], settings['rad_dr'], settings['rad_sigma'], mask=settings['mask'] )
+        R, I = integ(img)
+        I = I[self.sel]
+        R = R[self.sel]
+        
+        rawRI = np.array([R,I]).transpose()
+        t = self._record('histogram', t)
+        self._size('pixels', integ.ix.shape[0])
+        self._size('profile', R.shape[0])
+        
+        # subtract a power law background fitted to specific points
+        res_back, ok = self._fit( self.model_back, self._back_guess, I[self.back_ix], 1000, 'background' )
+        if show:
+            plot = plot_fit( R, I, self.dims, self.funcs_back, res_back, show=show )
+        
+        I = I - self.model_back_full(res_back)
+        t = self._record('background', t)
+        
+        # fit
+        maxfev = settings['fit_maxfev'] if not settings['fit_maxfev'] is None else 1000
+        res, ok_fit = self._fit( self.model_fit, self._fit_guess, I, maxfev, 'fit' )
+        t = self._record('fit', t)
+        
+        if show:
+            plot = plot_fit( R, I, self.dims, settings['fit_funcs'], res, show=show )
+        
+        # next frame starts from these results
+        if self.warm_start:
+            self._back_guess = res_back if ok else self.back_init
+            self._fit_guess = res if ok_fit else self.fit_init
+        
+        self.nframes += 1
+        if self.profile:
+            self.records.append(self._frame)
+            self._frame = None
+        
+        return np.array([R,I]).transpose(), res, center, dists, rawRI, res_back, settings
+
+
+def profile_summary( records ):
+    '''Aggregate the per frame profile records of RingDiffPipeline.
+    
+    Parameters:
+        records (list):    Records as in RingDiffPipeline.records.
+    
+    Returns:
+        (dict):    Number of frames and for every stage (time, nfev) or size label its total, mean and max.
+        
+    '''
+    
+    summary = {'frames': len(records)}
+    
+    for (i, (key, labels)) in enumerate( (('time', RingDiffPipeline.stages), ('nfev', RingDiffPipeline.fit_stages), ('size', RingDiffPipeline.size_labels)) ):
+        if len(records) > 0:
+            vals = np.array([record[i] for record in records])
+        else:
+            vals = np.zeros((1, len(labels)))
+        
+        summary[key] = collections.OrderedDict( (label, {'total': vals[:,j].sum().item(), 'mean': vals[:,j].mean().item(), 'max': vals[:,j].max().item()}) for (j, label) in enumerate(labels) )
+    
+    return summary
+
+
+def run_singleImage( img, dims, settings, show=False, points=None, cache=None ):
     '''Evaluate a single ring diffraction pattern with given settings.
     
+    To evaluate many frames with the same settings, set up a RingDiffPipeline once instead.
+    
     Parameters:
         img (np.ndarray):    Image.
         dims (tuple):    Corresponding dim vectors.
         settings (dict):    Dict of settings necessary for the evaluation.
         show (bool):    Set to directly show plots interactively.
+        points (np.ndarray):    Precomputed local maxima in [px], e.g. from local_max_stack. If None, they are detected in img.
+        cache (PolarGridCache):    Cache for the polar coordinate grids.
 
     Returns:
         (np.ndarray):    Optimized parameters of fitting the radial profile according to the settings.
@@ -405,77 +1340,7 @@ def run_singleImage( img, dims, settings, show=False ):
         
     except:
         raise RuntimeError('Something wrong with the input')
-        
-    
-    # create a copy of settings to decouple
-    mysettings = copy.deepcopy(settings)
-    
-    # get local maxima an turn them into real space coords
-    points = ncempy.algo.local_max.local_max(img, mysettings['lmax_r'], mysettings['lmax_thresh'])
-    points = ncempy.algo.local_max.points_todim(points, dims)
-    
-    # convert center to real space
-    center_init = ncempy.algo.local_max.points_todim(mysettings['lmax_cinit'], dims)
-    
-    # filter to single ring
-    points = ncempy.algo.distortion.filter_ring(points, center_init, mysettings['lmax_range'])
-    
-    if show:
-        if settings['plt_imgminmax'] is None:
-            mysettings['plt_imgminmax'] = (0.,1.)
-            
-        plot = ncempy.algo.local_max.plot_points(img, points, vminmax=mysettings['plt_imgminmax'], dims=dims, invert=True, show=show)
     
-    # optimize center
-    center = ncempy.algo.distortion.optimize_center(points, center_init, verbose=show)
-        
-    # fit distortions
-    points_plr = ncempy.algo.distortion.points_topolar(points, center)
-    dists = ncempy.algo.distortion.optimize_distortion(points_plr, mysettings['ns'])
-    if show:
-        plot = ncempy.algo.distortion.plot_distpolar(points_plr, dims, dists, mysettings['ns'], show=show)
-    
-    # calc coordinates in optimized system
-    rs, thes = ncempy.algo.radial_profile.calc_polarcoords( center, dims, mysettings['ns'], dists )
-    
-    if settings['rad_rmax'] is None:
-        mysettings['rad_rmax'] = np.abs(dims[0][0][0]-dims[0][0][1])*np.min(img.shape)/2.0
-    if settings['rad_dr'] is None:
-        mysettings['rad_dr'] = np.abs(dims[0][0][0]-dims[0][0][1])/10.
-    if settings['rad_sigma'] is None:
-        mysettings['rad_sigma'] = np.abs(dims[0][0][0]-dims[0][0][1])
-        
-    # extract radial profile
-    R, I = ncempy.algo.radial_profile.calc_radialprofile( img, rs, mysettings['rad_rmax'], mysettings['rad_dr'], mysettings['rad_sigma'], mask=mysettings['mask'] )
-    
-    # cut radial profile
-    sel = (R>=mysettings['fit_rrange'][0])*(R<=mysettings['fit_rrange'][1])
-    I = I[sel]
-    R = R[sel]
-    
-    rawRI = np.copy(np.array([R,I]).transpose())
-    
-    # subtract a power law background fitted to specific points
-    fit_R = np.array([])
-    fit_I = np.array([])
-    for xpoint in mysettings['back_xs']:
-        ix = np.where( np.abs(R-xpoint) < mysettings['back_xswidth'] )
-        fit_R = np.append(fit_R, R[ix])
-        fit_I = np.append(fit_I, I[ix])
-            
-    funcs_back = [ 'const', 'powlaw']
-    res_back = ncempy.algo.radial_profile.fit_radialprofile( fit_R, fit_I, funcs_back, mysettings['back_init'], maxfev=1000 )
-    if show:
-        plot = ncempy.algo.radial_profile.plot_fit( R, I, dims, funcs_back, res_back, show=show )
-        
-    I = I - ncempy.algo.math.sum_functions(R, funcs_back, res_back)    
-    
-    
-    # fit
-    res = ncempy.algo.radial_profile.fit_radialprofile( R, I, mysettings['fit_funcs'], mysettings['fit_init'], maxfev=mysettings['fit_maxfev'])
-    
-    if show:
-        plot = ncempy.algo.radial_profile.plot_fit( R, I, dims, mysettings['fit_funcs'], res, show=show )
-        
-    return np.array([R,I]).transpose(), res, center, dists, rawRI, res_back, mysettings
+    pipeline = RingDiffPipeline( settings, dims, warm_start=False, cache=cache )
     
+    return pipeline( img, show=show, points=points )
@@ -3,8 +3,12 @@
 import argparse
 from ncempy.io.dm import fileDM
 from ncempy.io.ser import fileSER
+import concurrent.futures
+import glob
 import ntpath
 import os
+import sys
+import time
 
 from matplotlib import cm
 from matplotlib.image import imsave
@@ -24,6 +28,80 @@ def _discover_emi(file_route):
     
     return emi_file_route
 
+_supported_extensions = ["dm3", "dm4", "ser"]
+
+def _extension(file_route):
+    return file_route.split(".")[-1].lower()
+
+def collect_source_files(sources, recursive=False):
+    """ Expands the list of sources into a list of files. Sources can be
+    files, directories or glob patterns. Directories and patterns only
+    contribute files with a supported extension, directories are walked
+    when recursive is set."""
+    source_files = []
+    for source in sources:
+        if os.path.isdir(source):
+            found = []
+            if recursive:
+                for root, dirs, files in os.walk(source):
+                    dirs.sort()
+                    found.extend(os.path.join(root, name)
+                                 for name in sorted(files))
+            else:
+                found.extend(os.path.join(source, name)
+                             for name in sorted(os.listdir(source)))
+        elif glob.has_magic(source):
+            found = sorted(glob.glob(source, recursive=recursive))
+        else:
+            if not _extension(source) in _supported_extensions:
+                raise ValueError("Extension/filetype {} not supported!".format(
+                                                        _extension(source)))
+            source_files.append(source)
+            continue
+        source_files.extend(f for f in found if os.path.isfile(f) and
+                            _extension(f) in _supported_extensions)
+    
+    # remove duplicates but keep the order
+    unique_files = []
+    seen = set()
+    for source_file in source_files:
+        key = os.path.abspath(source_file)
+        if key not in seen:
+            seen.add(key)
+            unique_files.append(source_file)
+    return unique_files
+
+def is_up_to_date(source_file, dest_file):
+    """ True if dest_file exists and is not older than source_file."""
+    if not os.path.isfile(source_file) or not os.path.isfile(dest_file):
+        return False
+    return os.path.getmtime(dest_file) >= os.path.getmtime(source_file)
+
+def read_manifest(manifest_file):
+    """ Reads the manifest of finished conversions. Returns a dict mapping
+    the absolute source path to the source mtime at conversion time."""
+    finished = {}
+    if manifest_file is None or not os.path.isfile(manifest_file):
+        return finished
+    with open(manifest_file, "r") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) != 2:
+                # partially written line of an interrupted run
+                continue
+            try:
+                finished[parts[0]] = float(parts[1])
+            except ValueError:
+                continue
+    return finished
+
+def append_manifest(manifest_file, source_file):
+    """ Records source_file as finished in the manifest."""
+    with open(manifest_file, "a") as f:
+        f.write("{}\t{!r}\n".format(os.path.abspath(source_file),
+                                    os.path.getmtime(source_file)))
+        f.flush()
+
 def extract_dimension(img, fixed_dimensions=None):
     out_img=img
 
@@ -86,14 +164,55 @@ def ser_to_png(source_file, dest_file):
     img = ds[0]
     imsave(dest_file, img, format="png")
     return f
-    
+
+def convert_file(source_file, dest_file, fixed_dimensions=None):
+    """ Converts a single source_file to the PNG dest_file. Returns the
+    source_file, the dest_file, the time needed in seconds and the error
+    message or None. Meant to be run in a worker process, so exceptions
+    are reported back instead of raised."""
+    start = time.perf_counter()
+    error = None
+    try:
+        if not os.path.isfile(source_file):
+            raise FileNotFoundError("No such file: {}".format(source_file))
+        extension = _extension(source_file)
+        if extension in ["dm3","dm4"]:
+            dm_to_png(source_file, dest_file,
+                      fixed_dimensions=fixed_dimensions)
+        elif extension in ["ser"]:
+            ser_to_png(source_file, dest_file)
+        else:
+            raise ValueError("Extension/filetype {} not supported!".format(
+                                                                extension))
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    return source_file, dest_file, time.perf_counter()-start, error
+
+def print_summary(results, skipped, total_time):
+    """ Prints per-file timings and a summary of a batch run."""
+    for source_file, dest_file, elapsed, error in results:
+        if error is None:
+            print("{:8.3f} s  {}".format(elapsed, source_file))
+        else:
+            print("{:8.3f} s  {} FAILED ({})".format(elapsed, source_file,
+                                                     error))
+    failed = [r for r in results if r[3] is not None]
+    print("Converted {} file(s), {} failed, {} skipped in {:.3f} s.".format(
+        len(results)-len(failed), len(failed), skipped, total_time))
+    if len(results) > 0:
+        times = [r[2] for r in results]
+        print("Per file: mean {:.3f} s, max {:.3f} s.".format(
+            sum(times)/len(times), max(times)))
+
 def main():
     parser = argparse.ArgumentParser(description='Extracts a preview png from'
                                      ' a SER, DM3, or DM4 file.')
     
     parser.add_argument('source_files', metavar='source_files', type=str,
                         nargs="+",
-                    help='Source files, must have ser, dm3, o dm4 extension.')
+                    help='Source files, must have ser, dm3, o dm4 extension.'
+                    ' Directories and glob patterns are expanded to all'
+                    ' supported files they contain.')
     
     parser.add_argument('--out_file', dest='dest_file', action='store', 
                         type=str, nargs=1,
@@ -113,10 +232,35 @@ def main():
                         " extract all the values x,z for y=1/2shapeY, and w=2.",
                         default=None)
     
+    parser.add_argument('-r', '--recursive', dest='recursive',
+                        action='store_true',
+                        help='Walk directories (and ** in glob patterns)'
+                        ' recursively.')
+    
+    parser.add_argument('-j', '--jobs', dest='jobs', action='store',
+                        type=int, default=1,
+                        help='Number of worker processes used to convert'
+                        ' files in parallel. Defaults to 1.')
+    
+    parser.add_argument('--skip-existing', dest='skip_existing',
+                        action='store_true',
+                        help='Skip source files whose png exists and is not'
+                        ' older than the source file.')
+    
+    parser.add_argument('--manifest', dest='manifest', action='store',
+                        type=str, default=None,
+                        help='File recording finished conversions. Files'
+                        ' listed in it with an unchanged modification time'
+                        ' are skipped, so interrupted runs can be resumed.')
+    
     args = parser.parse_args()
     
+    if args.jobs < 1:
+        raise ValueError("--jobs needs to be at least 1.")
     
-    if args.dest_file is not None and len(args.source_files)>1:
+    source_files = collect_source_files(args.source_files, args.recursive)
+    
+    if args.dest_file is not None and len(source_files)>1:
         raise ValueError("--out_file only can be used when a single input file"
                          " is processed.")
     
@@ -124,23 +268,65 @@ def main():
     if fixed_dimensions is not None:
         fixed_dimensions=fixed_dimensions[0].split(',')
     
-    for source_file in args.source_files:
+    finished = read_manifest(args.manifest)
+    
+    tasks = []
+    skipped = 0
+    for source_file in source_files:
         
         if args.dest_file is None:
             dest_file="{}.png".format(source_file)
         else:
             dest_file=args.dest_file[0]
-        extension = source_file.split(".")[-1].lower()
-        if  not extension in ["dm3", "dm4", "ser"]:
-            raise ValueError("Extension/filetype {} not supported!".format(
-                                                                extension))
-        print("Extracting from {}, saving image as {}".format(source_file,
-                                                      dest_file ))
-        if extension in ["dm3","dm4"]:
-            dm_to_png(source_file, dest_file, fixed_dimensions=fixed_dimensions)
         
-        if extension in ["ser"]:
-            ser_to_png(source_file, dest_file)
+        # missing files are not skipped but reported as failed by convert_file
+        if args.manifest is not None and os.path.isfile(source_file) and \
+           finished.get(os.path.abspath(source_file)) == \
+           os.path.getmtime(source_file) and os.path.isfile(dest_file):
+            skipped += 1
+            continue
+        if args.skip_existing and is_up_to_date(source_file, dest_file):
+            skipped += 1
+            continue
+        tasks.append((source_file, dest_file))
+    
+    results = []
+    start = time.perf_counter()
+    
+    def finish(result):
+        source_file, dest_file, elapsed, error = result
+        if error is None:
+            if args.jobs > 1:
+                print("Extracted from {}, saved image as {}".format(
+                    source_file, dest_file))
+            if args.manifest is not None:
+                append_manifest(args.manifest, source_file)
+        else:
+            print("Failed to extract from {}: {}".format(source_file, error))
+        results.append(result)
+    
+    if args.jobs == 1:
+        for source_file, dest_file in tasks:
+            print("Extracting from {}, saving image as {}".format(source_file,
+                                                          dest_file ))
+            finish(convert_file(source_file, dest_file, fixed_dimensions))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.jobs) as executor:
+            futures = [executor.submit(convert_file, source_file, dest_file,
+                                       fixed_dimensions)
+                       for source_file, dest_file in tasks]
+            for future in concurrent.futures.as_completed(futures):
+                finish(future.result())
+        # report in input order
+        order = {task[0]: i for i, task in enumerate(tasks)}
+        results.sort(key=lambda r: order[r[0]])
+    
+    print_summary(results, skipped, time.perf_counter()-start)
+    
+    if any(r[3] is not None for r in results):
+        return 1
+    return 0
 
 if __name__ =="__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -3,10 +3,15 @@ import re
 from collections import OrderedDict
 import json
 import numpy as np
-from skimage.external import tifffile
+try:
+    from skimage.external import tifffile
+except ImportError:
+    # only needed to write and read TIFFs, removed from newer scikit-image
+    tifffile = None
 from scipy.ndimage.interpolation import shift
 from ncempy.edstomo.CharacteristicEmission import GetFluorescenceLineEnergy
 from ncempy.io.emd import fileEMD
+from ncempy.algo.binning import bin_array
 
 def BinEDSSpatialDimensions(Arr, Binning=4):
     if len(Arr.shape) != 3:
@@ -17,16 +22,92 @@ def BinEDSSpatialDimensions(Arr, Binning=4):
         print('Input stack needs to have dimensions that are evenly divided by the binning factor.')
         return Arr
 
-    # Create new axes with a length of Binning and fold the array into them.
-    ArrNew = Arr.reshape((  Arr.shape[0],                                   # Tilt dimension untouched
-                            Binning,int(Arr.shape[1]/Binning),              # Spatial dimension binned
-                            Binning,int(Arr.shape[2]/Binning)), order='F')   # Spatial dimension binned
-    # Sum along the binning directions.
-    ArrNew = np.sum(np.sum(ArrNew, axis=3), axis=1)
+    # Sum blocks of Binning x Binning pixels, the tilt dimension is untouched.
+    ArrNew = bin_array(Arr, (1, Binning, Binning))
     # print('Old shape: ' + str(Arr.shape))
     # print('New shape: ' + str(ArrNew.shape))
     return ArrNew
 
+def ExtractEnergyWindows(EDS, Windows, Binning=1):
+    ''' Sum several energy windows of an EDS tilt stack in one pass, reading one tilt at a time.
+
+    Parameters:
+        EDS (np.ndarray or h5py.Dataset): EDS tilt stack with dimensions (tilt, x, y, energy).  Only one tilt is read at a time and only the energy range covered by the windows, so a HDF5 dataset is never loaded completely.
+
+        Windows (list of tuples): (LowEnergyIndex, HighEnergyIndex) for each window, both energy bins are included in the sum.
+
+        Binning (int): Spatial binning like BinEDSSpatialDimensions.  1 means no binning.
+
+    Returns:
+        Signals (list of np.ndarray): One stack with dimensions (tilt, x, y) for each window.
+
+    '''
+
+    if len(EDS.shape) != 4:
+        print('Input stack needs to have a shape like (tilt, x, y, energy).')
+        return []
+
+    if len(Windows) == 0:
+        return []
+
+    if ((EDS.shape[1] % Binning) != 0) or ((EDS.shape[2] % Binning) != 0):
+        print('Input stack needs to have dimensions that are evenly divided by the binning factor.')
+        Binning = 1
+
+    LowIndices = np.array([w[0] for w in Windows], dtype=int)
+    HighIndices = np.array([w[1] for w in Windows], dtype=int) + 1
+
+    # Only read the energy range covered by any window.
+    EnergyStart = LowIndices.min()
+    EnergyStop = HighIndices.max()
+
+    # Same accumulator type np.sum would use, integer counts stay exact.
+    AccDtype = np.sum(np.zeros(1, dtype=EDS.dtype)).dtype
+
+    Signals = np.zeros((len(Windows), EDS.shape[0], EDS.shape[1]//Binning, EDS.shape[2]//Binning), dtype=AccDtype)
+    Cumulative = np.zeros((EDS.shape[1]//Binning, EDS.shape[2]//Binning, EnergyStop-EnergyStart+1), dtype=AccDtype)
+
+    for t in range(EDS.shape[0]):
+        # One hyperslab per tilt.
+        Slab = np.asarray(EDS[t, :, :, EnergyStart:EnergyStop])
+
+        # Binning commutes with the energy sums, so bin first to work on fewer spectra.
+        if Binning > 1:
+            Slab = bin_array(Slab, (Binning, Binning, 1), dtype=AccDtype)
+
+        # Cumulative sum along energy with a leading zero, then every window is the difference of two planes.
+        np.cumsum(Slab, axis=-1, dtype=AccDtype, out=Cumulative[:, :, 1:])
+        Signals[:, t] = np.moveaxis(Cumulative[:, :, HighIndices-EnergyStart] - Cumulative[:, :, LowIndices-EnergyStart], -1, 0)
+
+    return list(Signals)
+
+def GetEnergyRangeWindow(RangeName, Energies):
+    ''' Energy window of a signal given as an energy range.
+
+    Parameters:
+        RangeName (str): Signal name 'eV1-eV2' with start and stop energies in eV, the range is [eV1, eV2).
+
+        Energies (np.ndarray): Ascending energies of the energy bins in eV.
+
+    Returns:
+        Window (tuple): (LowEnergyIndex, HighEnergyIndex) of the first and last energy bin in the range, None if the name is not a range or the range contains no energy bins.
+
+    '''
+
+    try:
+        LowEnergy, HighEnergy = [float(e) for e in RangeName.split('-')]
+    except ValueError:
+        print(': Unrecognized energy range, ignoring this signal.')
+        return None
+
+    LowEnergyIndex = np.searchsorted(Energies, LowEnergy)
+    HighEnergyIndex = np.searchsorted(Energies, HighEnergy) - 1
+    if HighEnergyIndex < LowEnergyIndex:
+        print(': No energy bins in range, ignoring this signal.')
+        return None
+
+    return (LowEnergyIndex, HighEnergyIndex)
+
 def ExtractSignalsFromEMD(InputEMD=None, SignalNames=['HAADF', 'Mg_K', 'Fe_Ka'], Binning=4):
     ''' Read in a set of Bruker bcf files containing EDS acquisitions.
 
@@ -67,9 +148,10 @@ def ExtractSignalsFromEMD(InputEMD=None, SignalNames=['HAADF', 'Mg_K', 'Fe_Ka'],
     print('Energy resolution of Mn-Ka is: ' + str(EnergyResolutionMnKa) + ' eV.')
     print('Assumed FWHM of peaks will be (%g*sqrt(E))/2., hence at Mn-Ka: %g eV.' % (K, K*np.sqrt(Mn_Ka_Energy)/2))
 
-    # Get links to the data we'll need from the EMD.
+    # Get links to the data we'll need from the EMD.  The EDS cube stays in the file and is read tilt by tilt.
     HAADF, HAADF_dims = EMD.get_emdgroup(EMD.data['HAADF_TiltStack'])
-    EDS, EDS_dims  = EMD.get_emdgroup(EMD.data['EDS_TiltStack'])
+    EDS = EMD.data['EDS_TiltStack']['data']
+    EDS_dims = EMD.get_emddims(EMD.data['EDS_TiltStack'])
     Tilts = HAADF_dims[0][0]
     print('HAADF dimensions are (%d, %d).'%(len(HAADF_dims[1][0]), len(HAADF_dims[1][0])))
 
@@ -78,6 +160,10 @@ def ExtractSignalsFromEMD(InputEMD=None, SignalNames=['HAADF', 'Mg_K', 'Fe_Ka'],
     rebinsize_n = int(len(EDS_dims[2][0])/Binning)
     print('Binning is %d so rebinned EDS cubes will have spatial dimension (%d, %d).' % (Binning, rebinsize_m, rebinsize_n))
 
+    # Energy windows of all EDS signals, they are extracted together afterwards.
+    WindowNames = []
+    Windows = []
+
     for sig in SignalDict.keys():
         print(sig, end='')
         if sig == 'HAADF':
@@ -96,12 +182,22 @@ def ExtractSignalsFromEMD(InputEMD=None, SignalNames=['HAADF', 'Mg_K', 'Fe_Ka'],
             LowEnergyIndex = np.argmin((EDS_dims[3][0] - LowEnergy)**2)
             HighEnergyIndex = np.argmin((EDS_dims[3][0] - HighEnergy)**2)
             print(', %g-%g eV window, energy bins: %d-%d.'% (LowEnergy, HighEnergy, LowEnergyIndex, HighEnergyIndex))
-            Cube = np.sum(EDS[:, :, :, LowEnergyIndex:HighEnergyIndex+1], axis=-1)
-            SignalDict[sig] = BinEDSSpatialDimensions(Cube, Binning)
+            WindowNames.append(sig)
+            Windows.append((LowEnergyIndex, HighEnergyIndex))
             # fluor[0].rebin((rebinsize_m,rebinsize_n)).data.copy().astype("float32"))
         
         if '-' in sig:
-            print('Energy range signals not implemented yet.')
+            # This is an energy range [eV1, eV2).
+            Window = GetEnergyRangeWindow(sig, EDS_dims[3][0])
+            if Window is None:
+                continue
+            print(', energy bins: %d-%d.'% Window)
+            WindowNames.append(sig)
+            Windows.append(Window)
+
+    # Sum all energy windows in a single pass over the EDS cube.
+    for sig, Signal in zip(WindowNames, ExtractEnergyWindows(EDS, Windows, Binning)):
+        SignalDict[sig] = Signal
     
     print('Signals Extracted.')
 
@@ -333,6 +429,9 @@ def WriteSignalsToTIFFs(OutputDirectory, SignalDict):
         print('Creating directory: '+OutputDirectory)
         os.makedirs(OutputDirectory)
 
+    if tifffile is None:
+        raise ImportError('Writing TIFFs needs skimage.external.tifffile from scikit-image.')
+
     # Write out all the stacks as tiff files.
     for k, v in SignalDict.items():
         # Reformat the stacks to have the correct shape and bit depth to write to tifs.
@@ -366,6 +465,9 @@ def ReadSignalsFromTIFFs(InputDirectory, SignalNames=['HAADF', 'Mg_Ka', 'Fe_Ka']
 
 
     '''
+    if tifffile is None:
+        raise ImportError('Reading TIFFs needs skimage.external.tifffile from scikit-image.')
+
     SignalDict = OrderedDict()
     for SigName in SignalNames:
         npStack = tifffile.imread(os.path.join(InputDirectory, SigName+'.tif')).astype(float)
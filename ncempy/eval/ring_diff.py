@@ -8,6 +8,8 @@ import ncempy.algo.radial_profile
 import ncempy.algo.math
 import ncempy.io.emd
 
+import concurrent.futures
+
 import matplotlib.pyplot as plt
 import numpy as np
 import h5py
@@ -36,7 +38,9 @@ dummie_settings = { 'lmax_r': 1,
                     'back_init': (1.0, 1.0, 1.0),
                     'fit_funcs': ('voigt',),
                     'fit_init': (1.0, 1.0, 1.0, 1.0),
-                    'fit_maxfev':10
+                    'fit_maxfev':10,
+                    'lmax_refine': 'quadratic',
+                    'fit_warmstart': True
                   }
 '''(dict):    Dummy settings with all parameters set.'''
 
@@ -56,7 +60,9 @@ min_dummie_settings = { 'lmax_r': 1,
                         'back_init': (1.0, 1.0, 1.0),
                         'fit_funcs': ('voigt',),
                         'fit_init': (1.0, 1.0, 1.0, 1.0),
-                        'fit_maxfev': None
+                        'fit_maxfev': None,
+                        'lmax_refine': None,
+                        'fit_warmstart': None
                     }
 '''(dict):    Dummy settings with all parameters set but all optional ones as Nones.'''
 
@@ -138,6 +144,21 @@ def get_settings( parent ):
     else:
         settings['fit_maxfev'] = None
 
+    if 'lmax_refine' in parent.attrs:
+        lmax_refine = parent.attrs['lmax_refine']
+        if isinstance(lmax_refine, np.ndarray):
+            lmax_refine = lmax_refine[0]
+        if isinstance(lmax_refine, bytes):
+            lmax_refine = lmax_refine.decode('utf-8')
+        settings['lmax_refine'] = lmax_refine
+    else:
+        settings['lmax_refine'] = None
+
+    if 'fit_warmstart' in parent.attrs:
+        settings['fit_warmstart'] = bool(parent.attrs['fit_warmstart'])
+    else:
+        settings['fit_warmstart'] = None
+
     return settings
 
 
@@ -200,6 +221,10 @@ def put_settings( parent, settings ):
         grp_set.create_dataset('mask', data=settings['mask'])
     if not settings['fit_maxfev'] is None:
         grp_set.attrs['fit_maxfev'] = settings['fit_maxfev']
+    if not settings.get('lmax_refine') is None:
+        grp_set.attrs['lmax_refine'] = np.string_(settings['lmax_refine'])
+    if not settings.get('fit_warmstart') is None:
+        grp_set.attrs['fit_warmstart'] = bool(settings['fit_warmstart'])
         
     return grp_set
 
@@ -239,51 +264,66 @@ def put_sglgroup(parent, label, data_grp):
     return grp
     
 
-def run_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False):
-    '''Run evaluation on a single group.
+def _find_settings(group):
+    '''Find the settings for an evaluation group moving upwards in hierarchy.
     
     Parameters:
-        group (h5py._hl.group.Group):    Handle to evaluation group to execute.
-        outfile (ncempy.io.emd.fileEMD):    Emdfile for output.
-        overwrite (bool):    Set to overwrite existing results in outfile.
-        verbose (bool):    Set to get verbose output during run.
-        showplots (bool):    Set to directly show plots interactively.
+        group (h5py._hl.group.Group):    Handle to evaluation group.
+    
+    Returns:
+        (h5py._hl.group.Group):    Handle to the settings group or None.
         
     '''
+    
+    def proc_group(grp):
+        #print('scanning group {}'.format(grp))
+        if 'settings_ringdiffraction' in grp:
+            stt = grp['settings_ringdiffraction']
+            if stt.attrs['type'] == np.string_(cur_set_vers):
+                return stt
+        else:
+            if not grp == grp.file:
+                return proc_group(grp.parent)
+
+    return proc_group(group)
 
+
+def _prepare_sglgroup(group, verbose=False):
+    '''Gather everything to evaluate a single group without reading the data.
+    
+    Parameters:
+        group (h5py._hl.group.Group):    Handle to evaluation group to execute.
+        verbose (bool):    Set to get verbose output.
+    
+    Returns:
+        (tuple):    Filename and internal path of the data, its shape and dims and the settings.
+        
+    '''
+    
     try:
         assert(isinstance(group, h5py._hl.group.Group))
         assert( group.attrs['type'] == np.string_(cur_eva_vers) )
-        
-        assert(isinstance(outfile, ncempy.io.emd.fileEMD))
     except:
         raise TypeError('Something wrong with the input.')
-        
     
     if verbose:
         print('Running evaluation of "{}".'.format(group.name))
         
-        
-    # get the emdgroup
+    # where to find the emdgroup
+    filename = group.attrs['filename'].decode('utf-8')
+    internal_path = group.attrs['internal_path'].decode('utf-8')
     if verbose:
-        print('.. getting data from {}:{}'.format(group.attrs['filename'].decode('utf-8'), group.attrs['internal_path'].decode('utf-8')))
-    readfile = ncempy.io.emd.fileEMD( group.attrs['filename'].decode('utf-8'), readonly=True )
-    data, dims = readfile.get_emdgroup(readfile.file_hdl[group.attrs['internal_path'].decode('utf-8')])
+        print('.. getting data from {}:{}'.format(filename, internal_path))
+    
+    readfile = ncempy.io.emd.fileEMD( filename, readonly=True )
+    shape = readfile.file_hdl[internal_path]['data'].shape
+    dims = readfile.get_emddims(readfile.file_hdl[internal_path])
+    del readfile
     
     # find the settings moving upwards in hierarchy
     if verbose:
         print('.. searching for settings.')
-    def proc_group(grp):
-        #print('scanning group {}'.format(grp))
-        if 'settings_ringdiffraction' in grp:
-            stt = grp['settings_ringdiffraction']
-            if stt.attrs['type'] == np.string_(cur_set_vers):
-                return stt
-        else:
-            if not grp == grp.file:
-                return proc_group(grp.parent)
-
-    grp_set = proc_group(group)
+    grp_set = _find_settings(group)
     
     if grp_set is None:
         raise RuntimeError('Could not find settings in evaluation group or its parents.')
@@ -292,78 +332,425 @@ def run_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False
             print('.. loading settings from {}.'.format(grp_set.name))
         settings = get_settings(grp_set)
     
-    # what data to collect
-    profiles = None
-    centers = None
-    distss = None
-    fits = None
-    rawprofiles = None
-    fits_back = None
+    return filename, internal_path, shape, dims, settings
+
+
+result_labels = ('radial_profile', 'fit_results', 'centers', 'distortions', 'radial_profile_noback', 'back_results')
+'''(tuple):    Labels of the emdtype groups holding the results of an evaluation.'''
+
+status_label = 'frame_status'
+'''(str):    Label of the dataset recording the state of each frame of a stack (0: to do, 1: done, -1: failed).'''
+
+
+def _eval_frames(filename, internal_path, dims, settings, frames=None, showplots=False, callback=None, profile=False):
+    '''Evaluate frames of an emdgroup.
+    
+    Module level function to be usable in worker processes, the data file is opened read-only. Frames failing to evaluate are reported by their error message instead of results.
+    
+    Parameters:
+        filename (str):    File holding the data.
+        internal_path (str):    Path to the emdgroup inside the file.
+        dims (tuple):    Dims of the emdgroup.
+        settings (dict):    Settings for the evaluation.
+        frames (np.ndarray):    Ascending indices of the frames of a stack to evaluate, defaults to all.
+        showplots (bool):    Set to directly show plots interactively.
+        callback (function):    Called as callback(frame, result) after every frame.
+        profile (bool):    Set to append the profile record of RingDiffPipeline to the results.
+    
+    Returns:
+        (list):    Results per frame (profile, fit results, center, distortions, raw profile, background results, profile record or None) or error message.
+        
+    '''
+    
+    readfile = ncempy.io.emd.fileEMD( filename, readonly=True )
+    dset = readfile.file_hdl[internal_path]['data']
     
-    # run evaluation with settings
-    if len(data.shape) == 3:
+    def run_frame(pipeline, *args, **kwargs):
+        try:
+            result = pipeline(*args, **kwargs)[0:6]
+        except Exception as e:
+            # do not warm start from a broken frame
+            pipeline.reset()
+            return '{}: {}'.format(type(e).__name__, e)
+        
+        return result + (pipeline.records[-1] if profile else None,)
+    
+    results = []
+    if len(dset.shape) == 3:
+        if frames is None:
+            frames = np.arange(dset.shape[0])
+        frames = np.asarray(frames, dtype=int)
+        data = dset[list(frames)] if len(frames) < dset.shape[0] else dset[:]
+        del readfile
+        
+        # detect the local maxima of all frames at once
+        points_all = ncempy.algo.local_max.local_max_stack(data, settings['lmax_r'], settings['lmax_thresh'])
+        if points_all is None:
+            points_all = np.zeros((0,3), dtype=int)
+        points_ix = np.searchsorted(points_all[:,0], np.arange(data.shape[0]+1))
+        
+        # set up once for all frames, warm starts according to settings
+        pipeline = ncempy.algo.radial_profile.RingDiffPipeline( settings, dims[1:3], profile=profile )
+        
         for i in range(data.shape[0]):
-            profile, res, center, dists, rawprofile, res_back, myset = ncempy.algo.radial_profile.run_singleImage( data[i,:,:], dims[1:3], settings,  show=showplots)
-    
-            # after first run I know the size
-            if profiles is None:
-                profiles = np.zeros( (profile.shape[0], data.shape[0]) )
-                fits = np.zeros( (res.shape[0], data.shape[0]) )
-                centers = np.zeros( (2, data.shape[0]) )
-                distss = np.zeros( (dists.shape[0], data.shape[0]) )
-                rawprofiles = np.zeros( (rawprofile.shape[0], data.shape[0]) )
-                fits_back = np.zeros( (res_back.shape[0], data.shape[0]) )
-                
-            # assign data    
-            profiles[:,i] = profile[:,1]
-            fits[:,i] = res[:]
-            centers[:,i] = center[:]
-            distss[:,i] = dists[:]
-            rawprofiles[:,i] = rawprofile[:,1]
-            fits_back[:,i] = res_back[:]
-
-        # save results in this group
-        outfile.put_emdgroup('radial_profile', profiles, ( (profile[:,0], 'radial distance', dims[2][2]) , dims[0]), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('fit_results', fits, ( ( np.array(range(fits.shape[0])), 'parameters', '[]') , dims[0]), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('centers', centers, ( ( np.array(range(2)), 'dimension', dims[2][2]) , dims[0]), parent=group, overwrite=overwrite)    
-        outfile.put_emdgroup('distortions', distss, ( ( np.array(range(distss.shape[0])), 'parameters', '[]') , dims[0]), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('radial_profile_noback', rawprofiles, ( (rawprofile[:,0], 'radial distance', dims[2][2]) , dims[0]), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('back_results', fits_back, ( ( np.array(range(fits_back.shape[0])), 'background parameters', '[]') , dims[0]), parent=group, overwrite=overwrite)
-    
-
-    elif len(data.shape) == 2:
-        profile, res, center, dists, rawprofile, res_back, myset = ncempy.algo.radial_profile.run_singleImage( data[:,:], dims, settings,  show=showplots)
-        
-        # save results in this group
-        outfile.put_emdgroup('radial_profile', profile[:,1], ( (profile[:,0], 'radial distance', dims[0][2]), ), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('fit_results', res, ( ( np.array(range(res.shape[0])), 'parameters', '[]'), ), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('centers', center, ( ( np.array(range(2)), 'dimension', dims[0][2]), ), parent=group, overwrite=overwrite)    
-        outfile.put_emdgroup('distortions', dists, ( ( np.array(range(dists.shape[0])), 'parameters', '[]'), ), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('radial_profile_noback', rawprofile[:,1], ( (rawprofile[:,0], 'radial distance', dims[0][2]), ), parent=group, overwrite=overwrite)
-        outfile.put_emdgroup('back_results', res_back, ( ( np.array(range(res_back.shape[0])), 'background parameters', '[]'), ), parent=group, overwrite=overwrite)
-
+            points = points_all[points_ix[i]:points_ix[i+1],1:3]
+            result = run_frame( pipeline, data[i,:,:], show=showplots, points=points )
+            results.append( result )
+            if not callback is None:
+                callback(frames[i], result)
+    
+    elif len(dset.shape) == 2:
+        data = dset[:]
+        del readfile
+        
+        # same as run_singleImage
+        pipeline = ncempy.algo.radial_profile.RingDiffPipeline( settings, dims, warm_start=False, profile=profile )
+        results.append( run_frame( pipeline, data, show=showplots ) )
+        if not callback is None:
+            callback(0, results[0])
+    
     else:
         raise RuntimeError('Cannot handle that data.')
+    
+    return results
+
+
+def _open_results(group, outfile, dims, settings, overwrite=False):
+    '''Create or reopen the result datasets of a stack to write frame by frame.
+    
+    The result emdtype groups are preallocated with NaNs for all frames, next to a dataset recording the state of each frame. Existing results with such a record are reopened to resume the evaluation.
+    
+    Parameters:
+        group (h5py._hl.group.Group):    Handle to evaluation group.
+        outfile (ncempy.io.emd.fileEMD):    Emdfile for output.
+        dims (tuple):    Dims of the evaluated stack.
+        settings (dict):    Settings for the evaluation.
+        overwrite (bool):    Set to discard existing results.
+    
+    Returns:
+        (tuple):    List of result datasets and the frame state dataset, or None if results exist which cannot be resumed.
+        
+    '''
+    
+    nframes = dims[0][0].shape[0]
+    
+    # sizes of the results from the settings
+    pipeline = ncempy.algo.radial_profile.RingDiffPipeline( settings, dims[1:3] )
+    sizes = ( pipeline.r.shape[0], pipeline.model_fit.nparams, 2, 2*len(settings['ns'])+1, pipeline.r.shape[0], pipeline.model_back.nparams )
+    
+    # try to resume
+    if not overwrite and status_label in group:
+        try:
+            dsets = [ group[label]['data'] for label in result_labels ]
+            for (dset, size) in zip(dsets, sizes):
+                assert(dset.shape == (size, nframes))
+            assert(group[status_label].shape == (nframes,))
+            return dsets, group[status_label]
+        except:
+            print('Cannot resume evaluation of "{}", results do not match.'.format(group.name))
+            return None
+    
+    if not overwrite:
+        for label in result_labels:
+            if label in group:
+                print('"{}" already exists in "{}"'.format(label, group.name))
+                return None
+    
+    # preallocate, chunked by frame
+    rdims = ( (pipeline.r, 'radial distance', dims[2][2]), 
+              (np.array(range(sizes[1])), 'parameters', '[]'), 
+              (np.array(range(2)), 'dimension', dims[2][2]), 
+              (np.array(range(sizes[3])), 'parameters', '[]'), 
+              (pipeline.r, 'radial distance', dims[2][2]), 
+              (np.array(range(sizes[5])), 'background parameters', '[]') )
+    
+    dsets = []
+    for (label, size, rdim) in zip(result_labels, sizes, rdims):
+        grp = outfile.put_emdgroup(label, np.full((size, nframes), np.nan), (rdim, dims[0]), parent=group, overwrite=overwrite, chunks=(size, 1))
+        dsets.append(grp['data'])
+    
+    if status_label in group:
+        del group[status_label]
+    status = group.create_dataset(status_label, data=np.zeros(nframes, dtype='int8'))
+    
+    return dsets, status
+
+
+def _put_frame(group, outfile, results, frame, result):
+    '''Write the results of a single frame of a stack and mark it as done or failed.
+    
+    Parameters:
+        group (h5py._hl.group.Group):    Handle to evaluation group.
+        outfile (ncempy.io.emd.fileEMD):    Emdfile for output.
+        results (tuple):    Result datasets and frame state dataset as returned by _open_results.
+        frame (int):    Index of the frame.
+        result (tuple/str):    Results of the frame or error message.
+        
+    '''
+    
+    dsets, status = results
+    
+    if isinstance(result, str):
+        print('WARNING: evaluation of frame {} in "{}" failed: {}'.format(frame, group.name, result))
+        outfile.put_comment('Evaluation of frame {} in "{}" failed: {}'.format(frame, group.name, result))
+        status[frame] = -1
+    
+    else:
+        profile, res, center, dists, rawprofile, res_back = result[0:6]
+        values = (profile[:,1], res, center, dists, rawprofile[:,1], res_back)
+        for (dset, value) in zip(dsets, values):
+            dset[:,frame] = value
+        status[frame] = 1
+    
+    # make it persistent before continuing
+    outfile.file_hdl.flush()
+
+
+def _put_results(group, outfile, dims, results, overwrite=False):
+    '''Write the results of a single image.
+    
+    Parameters:
+        group (h5py._hl.group.Group):    Handle to evaluation group.
+        outfile (ncempy.io.emd.fileEMD):    Emdfile for output.
+        dims (tuple):    Dims of the evaluated emdgroup.
+        results (list):    Results as returned by _eval_frames.
+        overwrite (bool):    Set to overwrite existing results in outfile.
+        
+    '''
+    
+    if isinstance(results[0], str):
+        print('WARNING: evaluation of "{}" failed: {}'.format(group.name, results[0]))
+        outfile.put_comment('Evaluation of "{}" failed: {}'.format(group.name, results[0]))
+        return
+    
+    profile, res, center, dists, rawprofile, res_back = results[0][0:6]
+    
+    # save results in this group
+    outfile.put_emdgroup('radial_profile', profile[:,1], ( (profile[:,0], 'radial distance', dims[0][2]), ), parent=group, overwrite=overwrite)
+    outfile.put_emdgroup('fit_results', res, ( ( np.array(range(res.shape[0])), 'parameters', '[]'), ), parent=group, overwrite=overwrite)
+    outfile.put_emdgroup('centers', center, ( ( np.array(range(2)), 'dimension', dims[0][2]), ), parent=group, overwrite=overwrite)    
+    outfile.put_emdgroup('distortions', dists, ( ( np.array(range(dists.shape[0])), 'parameters', '[]'), ), parent=group, overwrite=overwrite)
+    outfile.put_emdgroup('radial_profile_noback', rawprofile[:,1], ( (rawprofile[:,0], 'radial distance', dims[0][2]), ), parent=group, overwrite=overwrite)
+    outfile.put_emdgroup('back_results', res_back, ( ( np.array(range(res_back.shape[0])), 'background parameters', '[]'), ), parent=group, overwrite=overwrite)
 
     # save a log comment
     outfile.put_comment('Evaluated "{}" using ring diffraction analysis.'.format(group.name))
+
+
+def _finish_stack(group, outfile, results):
+    '''Log the state of a stack after an evaluation run.
+    
+    Parameters:
+        group (h5py._hl.group.Group):    Handle to evaluation group.
+        outfile (ncempy.io.emd.fileEMD):    Emdfile for output.
+        results (tuple):    Result datasets and frame state dataset as returned by _open_results.
+        
+    '''
+    
+    status = results[1][:]
+    nfailed = np.count_nonzero(status == -1)
+    
+    # save a log comment
+    if nfailed > 0:
+        outfile.put_comment('Evaluated "{}" using ring diffraction analysis, {} of {} frames failed.'.format(group.name, nfailed, status.shape[0]))
+    else:
+        outfile.put_comment('Evaluated "{}" using ring diffraction analysis.'.format(group.name))
+
+
+def _put_profile(group, outfile, frames, records):
+    '''Write the profile records of an evaluation run and summarize them.
+    
+    The wall times, function evaluations and sizes per frame are written as emdtype groups profiling_times, profiling_nfev and profiling_sizes, replacing those of earlier runs. The labels of their first dimension are listed in the attribute labels.
+    
+    Parameters:
+        group (h5py._hl.group.Group):    Handle to evaluation group.
+        outfile (ncempy.io.emd.fileEMD):    Emdfile for output.
+        frames (list):    Indices of the evaluated frames.
+        records (list):    Profile records of these frames.
     
+    Returns:
+        (dict):    Aggregated profile as by ncempy.algo.radial_profile.profile_summary.
+        
+    '''
+    
+    pipeline = ncempy.algo.radial_profile.RingDiffPipeline
+    
+    if len(records) > 0:
+        frame_dim = (np.array(frames), 'frame', '[]')
+        for (i, (label, labels)) in enumerate( (('profiling_times', pipeline.stages), ('profiling_nfev', pipeline.fit_stages), ('profiling_sizes', pipeline.size_labels)) ):
+            data = np.stack([record[i] for record in records], axis=1)
+            grp = outfile.put_emdgroup(label, data, ( (np.array(range(len(labels))), 'labels', '[]'), frame_dim ), parent=group, overwrite=True)
+            grp.attrs['labels'] = np.string_(', '.join(labels))
+    
+    return ncempy.algo.radial_profile.profile_summary(records)
 
-def run_all(parent, outfile, overwrite=False, verbose=False, showplots=False):
+
+class _Task:
+    '''Evaluation of a single group, directly or submitted to a process pool.
+    
+    Parameters:
+        group (h5py._hl.group.Group):    Handle to evaluation group to execute.
+        outfile (ncempy.io.emd.fileEMD):    Emdfile for output.
+        executor (concurrent.futures.Executor):    Pool to submit to, None to evaluate in write().
+        jobs (int):    Number of workers of the pool.
+        overwrite (bool):    Set to discard existing results in outfile.
+        verbose (bool):    Set to get verbose output.
+        showplots (bool):    Set to directly show plots interactively.
+        profile (bool):    Set to record and write profiling information.
+    
+    '''
+    
+    def __init__(self, group, outfile, executor=None, jobs=1, overwrite=False, verbose=False, showplots=False, profile=False):
+        '''Prepare the group and submit its frames.
+        
+        Stacks are split into contiguous chunks of frames still to do, four per job. With settings['fit_warmstart'] set a stack is submitted as a single chunk, so every frame is warm started from its predecessor like in a serial run.
+        
+        '''
+        
+        self.group = group
+        self.outfile = outfile
+        self.overwrite = overwrite
+        self.showplots = showplots
+        self.profile = profile
+        self.futures = None
+        self.results = None
+        self.frames = None
+        self.records = []
+        
+        self.filename, self.internal_path, shape, self.dims, self.settings = _prepare_sglgroup(group, verbose=verbose)
+        
+        if len(shape) == 3:
+            self.results = _open_results(group, outfile, self.dims, self.settings, overwrite=overwrite)
+            if self.results is None:
+                return
+            
+            # skip finished frames
+            self.frames = np.flatnonzero(self.results[1][:] != 1)
+            if verbose:
+                print('.. {} of {} frames to evaluate.'.format(self.frames.shape[0], shape[0]))
+        
+        if not executor is None:
+            if self.frames is None:
+                self.futures = [ ([0], executor.submit(_eval_frames, self.filename, self.internal_path, self.dims, self.settings, profile=profile)) ]
+            else:
+                if self.settings.get('fit_warmstart'):
+                    # a chunk starts its fits from the initial guesses, keep the chain of warm starts
+                    chunksize = max(self.frames.shape[0], 1)
+                else:
+                    chunksize = max(int(np.ceil(self.frames.shape[0]/(4*jobs))), 1)
+                self.futures = [ (self.frames[start:start+chunksize], executor.submit(_eval_frames, self.filename, self.internal_path, self.dims, self.settings, self.frames[start:start+chunksize], profile=profile)) for start in range(0, self.frames.shape[0], chunksize) ]
+    
+    def _put(self, frame, result):
+        '''Write the results of a frame of a stack and keep its profile record.
+        
+        '''
+        
+        _put_frame(self.group, self.outfile, self.results, frame, result)
+        if self.profile and not isinstance(result, str):
+            self.records.append( (frame, result[6]) )
+    
+    def write(self):
+        '''Evaluate or wait for the results and write them in frame order.
+        
+        Returns:
+            (dict):    Aggregated profile if profiling, else None.
+        
+        '''
+        
+        if len(self.dims) == 3:
+            if self.results is None:
+                return None
+            
+            if not self.futures is None:
+                for (frames, future) in self.futures:
+                    for (frame, result) in zip(frames, future.result()):
+                        self._put(frame, result)
+            elif self.frames.shape[0] > 0:
+                _eval_frames(self.filename, self.internal_path, self.dims, self.settings, frames=self.frames, showplots=self.showplots, callback=self._put, profile=self.profile)
+            
+            _finish_stack(self.group, self.outfile, self.results)
+        
+        else:
+            if not self.futures is None:
+                results = self.futures[0][1].result()
+            else:
+                results = _eval_frames(self.filename, self.internal_path, self.dims, self.settings, showplots=self.showplots, profile=self.profile)
+            
+            _put_results(self.group, self.outfile, self.dims, results, overwrite=self.overwrite)
+            if self.profile and not isinstance(results[0], str):
+                self.records.append( (0, results[0][6]) )
+        
+        if self.profile:
+            return _put_profile(self.group, self.outfile, [record[0] for record in self.records], [record[1] for record in self.records])
+        
+        return None
+
+
+def run_sglgroup(group, outfile, overwrite=False, verbose=False, showplots=False, jobs=1, profile=False):
+    '''Run evaluation on a single group.
+    
+    The results of stacks are written frame by frame, together with the state of every frame in the dataset frame_status. Frames failing to evaluate are recorded and skipped. Running again on existing results resumes the evaluation, evaluating only frames not done yet.
+    
+    With profile set, the wall times of the stages of every frame, the function evaluations of the fits and the array sizes are recorded, see ncempy.algo.radial_profile.RingDiffPipeline. They are written to the emdtype groups profiling_times, profiling_nfev and profiling_sizes and returned aggregated.
+    
+    Parameters:
+        group (h5py._hl.group.Group):    Handle to evaluation group to execute.
+        outfile (ncempy.io.emd.fileEMD):    Emdfile for output.
+        overwrite (bool):    Set to discard existing results in outfile and evaluate all frames.
+        verbose (bool):    Set to get verbose output during run.
+        showplots (bool):    Set to directly show plots interactively.
+        jobs (int):    Number of worker processes to split the frames of a stack on, plots are only shown for 1. With settings['fit_warmstart'] set the stack is evaluated in a single worker to give the same results as a serial run.
+        profile (bool):    Set to record profiling information.
+    
+    Returns:
+        (dict):    Aggregated profile as by ncempy.algo.radial_profile.profile_summary if profile is set, else None.
+        
+    '''
+
+    try:
+        assert(isinstance(group, h5py._hl.group.Group))
+        assert( group.attrs['type'] == np.string_(cur_eva_vers) )
+        
+        assert(isinstance(outfile, ncempy.io.emd.fileEMD))
+        
+        jobs = int(jobs)
+        assert(jobs >= 1)
+    except:
+        raise TypeError('Something wrong with the input.')
+    
+    if jobs == 1 or showplots:
+        return _Task(group, outfile, overwrite=overwrite, verbose=verbose, showplots=showplots, profile=profile).write()
+    
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        return _Task(group, outfile, executor, jobs, overwrite=overwrite, verbose=verbose, profile=profile).write()
+    
+
+def run_all(parent, outfile, overwrite=False, verbose=False, showplots=False, jobs=1, profile=False):
     '''
     Run on a set-up emd file to do evaluations and save results.
     
-    All evaluations within parent are run.
+    All evaluations within parent are run. With several jobs the frames of all groups are evaluated in a pool of worker processes, reading the data read-only, while results are written group by group in order in this process. Stacks with settings['fit_warmstart'] set are not split, they are evaluated as a whole by one worker each, so the results do not depend on jobs and only the groups run in parallel.
     
     Parameters:
         parent (h5py._hl.group.Group):    Handle to parent.
         outfile (ncempy.io.emd.fileEMD):    Emdfile for output.
         overwrite (bool):    Set to overwrite existing results in outfile.
         verbose (bool):    Set to get verbose output during run.
-        showplots (bool):    Set to directly show plots interactively.
+        showplots (bool):    Set to directly show plots interactively, enforces serial execution.
+        jobs (int):    Number of worker processes.
+        profile (bool):    Set to record profiling information, see run_sglgroup.
+    
+    Returns:
+        (dict):    Aggregated profiles by name of the evaluation groups if profile is set, else None.
         
     '''
     
+    try:
+        jobs = int(jobs)
+        assert(jobs >= 1)
+    except:
+        raise TypeError('Something wrong with the input.')
+    
     # get all groups with evaluations to do
     todo = []
     
@@ -382,7 +769,17 @@ def run_all(parent, outfile, overwrite=False, verbose=False, showplots=False):
     proc_group(parent, todo)
     
     # run through all evaluations
-    for i in range(len(todo)):
-        run_sglgroup(todo[i], outfile, overwrite=overwrite, verbose=verbose, showplots=showplots)
+    if jobs == 1 or showplots:
+        summaries = [ run_sglgroup(todo[i], outfile, overwrite=overwrite, verbose=verbose, showplots=showplots, profile=profile) for i in range(len(todo)) ]
     
-
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            # submit everything first to keep the workers busy while writing
+            tasks = [ _Task(todo[i], outfile, executor, jobs, overwrite=overwrite, verbose=verbose, profile=profile) for i in range(len(todo)) ]
+            
+            summaries = [ task.write() for task in tasks ]
+    
+    if profile:
+        return dict( (todo[i].name, summaries[i]) for i in range(len(todo)) )
+    
+    return None
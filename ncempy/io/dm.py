@@ -866,7 +866,7 @@ class fileDM:
             raise
         return Type
         
-    def getDataset(self, index):
+    def getDataset(self, index, binning=None, method='sum'):
         '''Retrieve a dataset from the DM file.
         
         Note
@@ -883,6 +883,14 @@ class fileDM:
                 The number of the data set to retrieve ignoring the thumbnail.
                 If a thumbnail exists then inedx = 0 corresponds to second data
                 set in a DM file. 
+            binning: int/tuple, optional
+                Bin the data on load by this factor for all axes or one factor per axis,
+                see ncempy.algo.binning.bin_array. The data is read in chunks from a memmap
+                (unless on_memory is set) and pixelSize is scaled by the factors. pixelOrigin is converted
+                to binned pixels as (origin + 0.5)/f - 0.5, so the calibrated coordinates of the bin centers
+                stay the same. Default = None
+            method: str, optional
+                'sum', 'mean' or 'max' of the elements in a bin. Default = 'sum'
             
         Returns
         -------
@@ -918,20 +926,31 @@ class fileDM:
             #if self.dataType == 23: #RGB image(s)
             #    temp = self.fromfile(self.fid,count=pixelCount,dtype=np.uint8).reshape(self.ysize[ii],self.xsize[ii])
             if self.zSize[ii] == 1: #2D data
-                outputDict['data'] = self.fromfile(self.fid,count=pixelCount,dtype=self._DM2NPDataType(self.dataType[ii])).reshape((self.ySize[ii],self.xSize[ii]))
-                outputDict['pixelUnit'] = self.scaleUnit[jj:jj+self.dataShape[ii]][::-1] #need to reverse the order to match the C-ordering of the data
-                outputDict['pixelSize'] = self.scale[jj:jj+self.dataShape[ii]][::-1]
-                outputDict['pixelOrigin'] = self.origin[jj:jj+self.dataShape[ii]][::-1]
+                shape = (self.ySize[ii],self.xSize[ii])
             elif self.zSize2[ii] > 1: #4D data
-                outputDict['data'] = self.fromfile(self.fid,count=pixelCount,dtype=self._DM2NPDataType(self.dataType[ii])).reshape((self.zSize2[ii],self.zSize[ii],self.ySize[ii],self.xSize[ii]))
-                outputDict['pixelUnit'] = self.scaleUnit[jj:jj+self.dataShape[ii]][::-1] #need to reverse the order to match the C-ordering of the data
-                outputDict['pixelSize'] = self.scale[jj:jj+self.dataShape[ii]][::-1]
-                outputDict['pixelOrigin'] = self.origin[jj:jj+self.dataShape[ii]][::-1]
+                shape = (self.zSize2[ii],self.zSize[ii],self.ySize[ii],self.xSize[ii])
             else: #3D array
-                outputDict['data'] = self.fromfile(self.fid,count=pixelCount,dtype=self._DM2NPDataType(self.dataType[ii])).reshape((self.zSize[ii],self.ySize[ii],self.xSize[ii]))
-                outputDict['pixelUnit'] = self.scaleUnit[jj:jj+self.dataShape[ii]][::-1] #need to reverse the order to match the C-ordering of the data
-                outputDict['pixelSize'] = self.scale[jj:jj+self.dataShape[ii]][::-1]
-                outputDict['pixelOrigin'] = self.origin[jj:jj+self.dataShape[ii]][::-1]
+                shape = (self.zSize[ii],self.ySize[ii],self.xSize[ii])
+            shape = tuple(int(n) for n in shape)
+            
+            if binning is None:
+                outputDict['data'] = self.fromfile(self.fid,count=pixelCount,dtype=self._DM2NPDataType(self.dataType[ii])).reshape(shape)
+            else:
+                import ncempy.algo.binning
+                if self._on_memory:
+                    data = self.fromfile(self.fid,count=pixelCount,dtype=self._DM2NPDataType(self.dataType[ii])).reshape(shape)
+                else:
+                    data = self.getMemmap(index).reshape(shape) #read chunk-wise from the file
+                outputDict['data'] = ncempy.algo.binning.bin_array(data, binning, method)
+            outputDict['pixelUnit'] = self.scaleUnit[jj:jj+self.dataShape[ii]][::-1] #need to reverse the order to match the C-ordering of the data
+            outputDict['pixelSize'] = self.scale[jj:jj+self.dataShape[ii]][::-1]
+            outputDict['pixelOrigin'] = self.origin[jj:jj+self.dataShape[ii]][::-1]
+            
+            if binning is not None:
+                factors = [int(f) for f in np.broadcast_to(binning, (len(shape),))]
+                outputDict['pixelSize'] = [size*f for size, f in zip(outputDict['pixelSize'], factors)]
+                # the origin is in pixels, a binned pixel is centered on the center of its f original pixels
+                outputDict['pixelOrigin'] = [(origin + 0.5)/f - 0.5 for origin, f in zip(outputDict['pixelOrigin'], factors)]
 
         return outputDict
     
@@ -1060,7 +1079,7 @@ class fileDM:
         
         return data
     
-def dmReader(filename, dSetNum=0, verbose=False):
+def dmReader(filename, dSetNum=0, verbose=False, binning=None, method='sum'):
     '''A simple function to parse the file and read the requested dataset.
     Most users will want to use this function to simplify reading data
     directly into memory.
@@ -1073,6 +1092,10 @@ def dmReader(filename, dSetNum=0, verbose=False):
             The number of the data set to read. Almost always should be = 0. Default = 0
         verbose: bool
             Allow extra printing to see file internals. Default = False
+        binning: int/tuple
+            Bin the data on load by this factor for all axes or one factor per axis, see fileDM.getDataset. Default = None
+        method: str
+            'sum', 'mean' or 'max' of the elements in a bin. Default = 'sum'
 
     Returns
     -------
@@ -1088,6 +1111,6 @@ def dmReader(filename, dSetNum=0, verbose=False):
             >>> plt.imshow(im0['data']) #show the single image from the data file
     '''
     with fileDM(filename,verbose) as f1: #open the file and init the class
-        im1 = f1.getDataset(dSetNum) #get the requested dataset (first by default)
+        im1 = f1.getDataset(dSetNum, binning, method) #get the requested dataset (first by default)
     
     return im1 #return the dataset and metadata as a dictionary
@@ -228,13 +228,18 @@ class fileEMD:
         dims = tuple(dims)
         return(dims)
 
-    def get_emdgroup(self, group):
+    def get_emdgroup(self, group, binning=None, method='sum'):
         '''Get the emdtype data saved in in group.
         
         Parameters
         ----------
             group: h5py._hl.group.Group
                 Reference to the emdtype HDF5 group.
+            binning: int/tuple, optional
+                Bin the data on load by this factor for all axes or one factor per axis, see ncempy.algo.binning.bin_array.
+                The dataset is read in chunks, so it is never loaded completely. The dimension vectors are binned to the bin centers.
+            method: str, optional
+                'sum', 'mean' or 'max' of the elements in a bin. Default = 'sum'
         
         Returns
         -------
@@ -260,19 +265,30 @@ class fileEMD:
 
         # retrieve data
         try:
-            # get the data
-            data = group['data'][:]
+            # get the data, it is read chunk-wise when binning below
+            if binning is None:
+                data = group['data'][:]
+            else:
+                data = group['data']
             
             # get the dimensions.
             dims = self.get_emddims(group)
-
-            return data, dims
             
         except:
             # if something goes wrong, return None
             print('Content of "{}" does not seem to be in emd specified shape'.format(group.name))
             
             return None
+        
+        if binning is not None:
+            import ncempy.algo.binning
+            data = ncempy.algo.binning.bin_array(data, binning, method)
+            
+            # dimension vectors at the bin centers
+            factors = np.broadcast_to(binning, (len(dims),))
+            dims = tuple( (ncempy.algo.binning.bin_array(np.asarray(dim[0], dtype='float64'), int(f), 'mean'), dim[1], dim[2]) for dim, f in zip(dims, factors) )
+        
+        return data, dims
  
     def write_dim(self, label, dim, parent):
         '''Auxiliary function to write a dim dataset to parent.
@@ -421,8 +437,11 @@ class fileEMD:
         
         # write comment
         if timestamp in self.comments.attrs:
-            # append to existing
-            self.comments.attrs[timestamp] += np.string_('\n'+msg)
+            # append to existing, read back as str or bytes depending on h5py version
+            comment = self.comments.attrs[timestamp]
+            if isinstance(comment, bytes):
+                comment = comment.decode('utf-8')
+            self.comments.attrs[timestamp] = np.string_(comment+'\n'+msg)
         
         else:
             # create new entry
@@ -347,7 +347,7 @@ class fileMRC:
         return Type
 #end class fileMRC
 
-def mrcReader(fname,verbose=False):
+def mrcReader(fname,verbose=False,binning=None,method='sum'):
     '''A simple function to read open a MRC, parse the header, and read the full
     data set.
     
@@ -357,6 +357,11 @@ def mrcReader(fname,verbose=False):
             The name of the file to load
         verbose : bool, optional
             Enable printing debug messages as the header is parsed.
+        binning : int/tuple, optional
+            Bin the data on load by this factor for all axes or one factor per axis, see ncempy.algo.binning.bin_array.
+            The data is read in chunks from a memmap and voxelSize is scaled by the factors.
+        method : str, optional
+            'sum', 'mean' or 'max' of the elements in a bin. Default = 'sum'
         
     Returns
     -------
@@ -373,7 +378,13 @@ def mrcReader(fname,verbose=False):
             >>> plt.imshow(mrc1['data'][0,:,:]) #show the first image in the data set
     '''
     with fileMRC(fname,verbose) as f1: #open the file and init the class
-        im1 = f1.getDataset() #read in the dataset
+        if binning is None:
+            im1 = f1.getDataset() #read in the dataset
+        else:
+            import ncempy.algo.binning
+            im1 = f1.dataOut
+            im1['data'] = ncempy.algo.binning.bin_array(f1.getMemmap(), binning, method) #read chunk-wise from the file
+            im1['voxelSize'] = im1['voxelSize']*np.broadcast_to(binning, (len(im1['voxelSize']),))
     return im1 #return the data and metadata as a dictionary
 
 def mrc2raw(fname):
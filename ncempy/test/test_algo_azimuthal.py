@@ -0,0 +1,92 @@
+'''
+Tests for the algo.azimuthal module.
+'''
+
+import unittest
+import numpy as np
+
+import ncempy.algo.radial_profile
+import ncempy.algo.azimuthal
+
+
+class test_azimuthal(unittest.TestCase):
+    '''
+    Test the azimuthal integration on synthetic ring patterns.
+    '''
+    
+    def test_cake(self):
+        '''
+        Test the (r, theta) integration of distorted rings.
+        '''
+        
+        dims = ( (np.arange(120)*0.1, 'x', '[m]'), (np.arange(110)*0.1, 'y', '[m]') )
+        center = (6.03, 5.48)
+        ns = (2,)
+        dists = np.array([1.0, 0.4, 0.08])
+        
+        # ring at r=3.5 in the corrected coordinates
+        rs, thes = ncempy.algo.radial_profile.calc_polarcoords( center, dims, ns, dists )
+        img = np.exp(-np.square(rs - 3.5)/(2*0.15**2))
+        
+        # wrong input
+        with self.assertRaises(TypeError):
+            ncempy.algo.azimuthal.AzimuthalIntegrator( dims[0], center, 5.0, 0.1, 36 )
+        with self.assertRaises(TypeError):
+            ncempy.algo.azimuthal.AzimuthalIntegrator( dims, center, 5.0, 0.1, 0 )
+        with self.assertRaises(TypeError):
+            ncempy.algo.azimuthal.AzimuthalIntegrator( dims, center, 5.0, 0.1, 36, ns=ns, dists=dists[0:2] )
+        with self.assertRaises(TypeError):
+            ncempy.algo.azimuthal.AzimuthalIntegrator( dims, center, 5.0, 0.1, 36, mask=np.ones((5,5)) )
+        
+        integ = ncempy.algo.azimuthal.AzimuthalIntegrator( dims, center, 5.0, 0.1, 36, ns=ns, dists=dists )
+        with self.assertRaises(TypeError):
+            integ( np.ones((5,5)) )
+        
+        cake = integ( img )
+        self.assertEqual(cake.shape, (integ.r.shape[0], 36))
+        
+        # ring is found at the same r for all theta
+        peak_r = integ.r[np.nanargmax(cake, axis=0)]
+        np.testing.assert_allclose(peak_r, 3.5, atol=0.1)
+        
+        # every pixel within rMax is counted once
+        self.assertAlmostEqual(np.sum(integ.count), np.sum((rs >= integ.r_edges[0])*(rs < integ.r_edges[-1])))
+        
+        # pixel splitting keeps the total count
+        integ_sp = ncempy.algo.azimuthal.AzimuthalIntegrator( dims, center, 5.0, 0.1, 36, ns=ns, dists=dists, split=3 )
+        self.assertAlmostEqual(np.sum(integ_sp.count), np.sum(integ.count), delta=0.02*np.sum(integ.count))
+        np.testing.assert_allclose(integ_sp.r[np.nanargmax(integ_sp( img ), axis=0)], 3.5, atol=0.1)
+        
+        # dimension vectors given as lists
+        dims_list = tuple( (list(dim[0]), dim[1], dim[2]) for dim in dims )
+        integ_l = ncempy.algo.azimuthal.AzimuthalIntegrator( dims_list, center, 5.0, 0.1, 36, ns=ns, dists=dists, split=2 )
+        integ_2 = ncempy.algo.azimuthal.AzimuthalIntegrator( dims, center, 5.0, 0.1, 36, ns=ns, dists=dists, split=2 )
+        np.testing.assert_allclose(integ_l( img ), integ_2( img ))
+        np.testing.assert_allclose(integ_l.count, integ_2.count)
+        
+        # stacks in one go
+        stack = np.array([img, 2*img, img + 1.])
+        cakes = integ( stack )
+        np.testing.assert_allclose(cakes[1], 2*cake)
+        np.testing.assert_allclose(cakes[2], cake + 1.)
+        
+        # summed intensities
+        np.testing.assert_allclose(integ( img, normalize=False ), np.nan_to_num(cake*integ.count), rtol=1e-10)
+        
+        # masked half of the image is missing
+        mask = np.ones(img.shape)
+        mask[:60,:] = 0
+        integ_m = ncempy.algo.azimuthal.AzimuthalIntegrator( dims, center, 5.0, 0.1, 36, ns=ns, dists=dists, mask=mask )
+        cake_m = integ_m( img )
+        self.assertTrue(np.all(np.isnan(cake_m[5:, np.abs(integ.theta) > 2.0])))
+        np.testing.assert_allclose(cake_m[5:, np.abs(integ.theta) < 1.0], cake[5:, np.abs(integ.theta) < 1.0])
+        self.assertLess(np.sum(integ_m.count), np.sum(integ.count))
+        
+        # convenience function
+        r, theta, cake_f = ncempy.algo.azimuthal.calc_cake( img, dims, center, 5.0, 0.1, 36, ns=ns, dists=dists )
+        np.testing.assert_allclose(cake_f, cake)
+
+
+# to test with unittest runner
+if __name__ == '__main__':
+    unittest.main()
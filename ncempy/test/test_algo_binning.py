@@ -0,0 +1,99 @@
+'''
+Tests for the algo.binning module.
+'''
+
+import unittest
+import itertools
+import tempfile
+import os
+import numpy as np
+
+import ncempy.algo.binning
+
+
+class test_binning(unittest.TestCase):
+    '''
+    Test the N-D binning against a direct loop over all bins.
+    '''
+    
+    def reference(self, data, factors, method, remainder):
+        '''
+        Bin by looping over all bins.
+        '''
+        
+        factors = np.broadcast_to(factors, (data.ndim,))
+        shape = ncempy.algo.binning.binned_shape(data.shape, tuple(factors), remainder)
+        func = {'sum': np.sum, 'mean': np.mean, 'max': np.max}[method]
+        
+        out = np.zeros(shape)
+        for idx in itertools.product(*[range(n) for n in shape]):
+            out[idx] = func(data[tuple(slice(i*f, (i+1)*f) for i, f in zip(idx, factors))])
+        
+        return out
+    
+    def test_bin_array(self):
+        '''
+        Test all methods and remainder modes for several dimensions and chunk sizes.
+        '''
+        
+        rng = np.random.RandomState(7)
+        
+        for shape, factors in (((7,), 2), ((6,9), (2,3)), ((5,7,8), (1,3,2)), ((4,6,6,5), 2)):
+            data = rng.randint(0, 100, shape).astype('uint16')
+            
+            for method in ('sum', 'mean', 'max'):
+                for remainder in ('crop', 'pad'):
+                    ref = self.reference(data.astype('float64'), factors, method, remainder)
+                    for chunksize in (None, 1, 2):
+                        with self.subTest(shape=shape, method=method, remainder=remainder, chunksize=chunksize):
+                            out = ncempy.algo.binning.bin_array(data, factors, method, remainder, chunksize=chunksize)
+                            self.assertEqual(out.shape, ref.shape)
+                            self.assertTrue(np.allclose(out, ref))
+        
+        # wrong input
+        with self.assertRaises(TypeError):
+            ncempy.algo.binning.bin_array(data, (2,2))
+        with self.assertRaises(TypeError):
+            ncempy.algo.binning.bin_array(data, 0)
+        with self.assertRaises(TypeError):
+            ncempy.algo.binning.bin_array(data, 2, method='median')
+        with self.assertRaises(TypeError):
+            ncempy.algo.binning.bin_array(data, 2, remainder='wrap')
+    
+    def test_dtype(self):
+        '''
+        Test the accumulation dtypes.
+        '''
+        
+        data = np.full((4,4), 255, dtype='uint8')
+        
+        out = ncempy.algo.binning.bin_array(data, 2)
+        self.assertEqual(out.dtype, np.uint64)
+        self.assertTrue(np.all(out == 4*255))
+        
+        self.assertEqual(ncempy.algo.binning.bin_array(data, 2, 'max').dtype, np.uint8)
+        self.assertEqual(ncempy.algo.binning.bin_array(data, 2, 'mean').dtype, np.float64)
+        self.assertEqual(ncempy.algo.binning.bin_array(data.astype('float32'), 2, 'mean').dtype, np.float32)
+        self.assertEqual(ncempy.algo.binning.bin_array(data, 2, dtype='float32').dtype, np.float32)
+    
+    def test_memmap(self):
+        '''
+        Test binning of a memmap.
+        '''
+        
+        data = np.random.RandomState(8).randint(0, 1000, (9,12,10)).astype('int16')
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'data.raw')
+            data.tofile(fname)
+            mm = np.memmap(fname, dtype='int16', mode='r', shape=data.shape)
+            
+            out = ncempy.algo.binning.bin_array(mm, (2,4,3), chunksize=1)
+            del mm
+        
+        self.assertTrue(np.array_equal(out, ncempy.algo.binning.bin_array(data, (2,4,3))))
+        self.assertEqual(type(out), np.ndarray)
+
+
+if __name__ == '__main__':
+    unittest.main()
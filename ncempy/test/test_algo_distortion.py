@@ -10,6 +10,7 @@ import os
 import ncempy.io.emd
 import ncempy.algo.local_max
 import ncempy.algo.distortion
+import ncempy.algo.math
 
 class test_ringdiff(unittest.TestCase):
     '''
@@ -17,6 +18,33 @@ class test_ringdiff(unittest.TestCase):
     '''
    
     
+    def test_jacobian(self):
+        '''
+        Test the analytic Jacobians against finite differences and synthetic rings.
+        '''
+        
+        ns = (2,3)
+        dists = (0.3, 0.05, -0.4, 0.02)
+        
+        # points on a distorted ring in polar coordinates
+        thetas = np.linspace(-np.pi, np.pi, 180, endpoint=False)
+        rs = 50.*ncempy.algo.distortion.rad_dis(thetas, dists[0], dists[1], ns[0])*ncempy.algo.distortion.rad_dis(thetas, dists[2], dists[3], ns[1])
+        points = np.stack((rs, thetas), axis=1)
+        
+        param = np.array((48., 0.2, 0.1, -0.3, 0.1))
+        self.assertLess(ncempy.algo.math.check_jac( ncempy.algo.distortion.residuals_dis, ncempy.algo.distortion.jacobian_dis, param, args=(points, ns) ), 1e-4)
+        
+        popt = ncempy.algo.distortion.optimize_distortion(points, ns, check_jac=True)
+        np.testing.assert_allclose(ncempy.algo.distortion.residuals_dis(popt, points, ns), 0, atol=1e-6)
+        
+        # center of a circle
+        xy = np.stack((10.+30.*np.cos(thetas), -5.+30.*np.sin(thetas)), axis=1)
+        self.assertLess(ncempy.algo.math.check_jac( ncempy.algo.distortion.residuals_center, ncempy.algo.distortion.jacobian_center, (8.,-3.), args=(xy,) ), 1e-4)
+        
+        center = ncempy.algo.distortion.optimize_center(xy, (8.,-3.))
+        np.testing.assert_allclose(center, (10.,-5.), atol=1e-6)
+    
+    
     def test_distortion(self):
         '''
         Test the distortion fitting algorithms to be used on ring diffraction patterns.
@@ -0,0 +1,143 @@
+'''
+Tests for the algo.drift module.
+'''
+
+import unittest
+import numpy as np
+
+import ncempy.algo.multicorr
+import ncempy.algo.drift
+
+
+class test_drift(unittest.TestCase):
+    '''
+    Test the pairwise drift estimation on synthetic series.
+    '''
+    
+    def make_series(self, num, dose, seed=0):
+        '''
+        Noisy series of a random blob image with a random walk drift.
+        '''
+        
+        rng = np.random.default_rng(seed)
+        n = 64
+        y, x = np.mgrid[0:n,0:n]
+        
+        img = np.zeros((n,n))
+        for ii in range(20):
+            cy, cx = rng.uniform(0, n, 2)
+            img += np.exp(-(np.square(y-cy) + np.square(x-cx))/(2*2.5**2))
+        
+        shifts = np.cumsum(rng.normal(0, 0.5, (num,2)), axis=0)
+        shifts -= shifts[0]
+        
+        G = np.fft.fft2(np.repeat(img[np.newaxis], num, axis=0), axes=(-2,-1))
+        stack = np.real(np.fft.ifft2(ncempy.algo.multicorr.imageShifter(G, shifts), axes=(-2,-1)))
+        stack = rng.poisson(np.clip(stack, 0, None)*dose).astype('float64')
+        
+        return stack, shifts
+    
+    def test_pair_list(self):
+        '''
+        Test the windowed pair set.
+        '''
+        
+        pairs = ncempy.algo.drift.pair_list(5, 2)
+        self.assertTrue(np.array_equal(pairs, [[0,1],[0,2],[1,2],[1,3],[2,3],[2,4],[3,4]]))
+        
+        # all pairs
+        self.assertEqual(ncempy.algo.drift.pair_list(6).shape, (15,2))
+        self.assertEqual(ncempy.algo.drift.pair_list(1).shape, (0,2))
+        
+        with self.assertRaises(TypeError):
+            ncempy.algo.drift.pair_list(5, 0)
+    
+    def test_solve(self):
+        '''
+        Test the least-squares solution for consistent and disconnected pairs.
+        '''
+        
+        rng = np.random.default_rng(1)
+        shifts = rng.normal(0, 3, (8,2))
+        shifts -= shifts[0]
+        
+        pairs = ncempy.algo.drift.pair_list(8, 3)
+        pair_shifts = shifts[pairs[:,1]] - shifts[pairs[:,0]]
+        
+        self.assertTrue(np.allclose(ncempy.algo.drift.solve_shifts(8, pairs, pair_shifts), shifts))
+        
+        # zero weight on all pairs linking the first half to the second
+        weights = np.ones(pairs.shape[0])
+        weights[(pairs[:,0] < 4)*(pairs[:,1] >= 4)] = 0
+        with self.assertRaises(RuntimeError):
+            ncempy.algo.drift.solve_shifts(8, pairs, pair_shifts, weights)
+        
+        with self.assertRaises(TypeError):
+            ncempy.algo.drift.solve_shifts(8, pairs, pair_shifts[:-1])
+    
+    def test_correlate_pairs(self):
+        '''
+        Test the batched pair correlations against multicorr.
+        '''
+        
+        stack, shifts = self.make_series(6, 5.)
+        pairs = ncempy.algo.drift.pair_list(6, 2)
+        
+        for batchsize in (1, 4, None):
+            pair_shifts = ncempy.algo.drift.correlate_pairs(stack, pairs, 'hybrid', 10, batchsize=batchsize)
+            
+            for (i, j), s in zip(pairs, pair_shifts):
+                ref = ncempy.algo.multicorr.multicorr(np.fft.fft2(stack[i]), np.fft.fft2(stack[j]), 'hybrid', 10)
+                self.assertTrue(np.allclose(s, ref))
+        
+        with self.assertRaises(TypeError):
+            ncempy.algo.drift.correlate_pairs(stack, [[0,6]])
+    
+    def test_estimate(self):
+        '''
+        Test the drift estimation of a low dose series including a rejected outlier pair.
+        '''
+        
+        stack, shifts = self.make_series(30, 1.)
+        
+        drift, pairs, pair_shifts, used = ncempy.algo.drift.estimate_drift(stack, window=8)
+        seq = ncempy.algo.multicorr.register_stack(stack, mode='sequential', upsampleFactor=10)
+        
+        rms = np.sqrt(np.mean(np.sum(np.square(drift - shifts), axis=1)))
+        rms_seq = np.sqrt(np.mean(np.sum(np.square(seq - shifts), axis=1)))
+        self.assertLess(rms, 0.5)
+        self.assertLess(rms, rms_seq)
+    
+    def test_reject(self):
+        '''
+        Test the rejection of corrupted pairs.
+        '''
+        
+        rng = np.random.default_rng(3)
+        shifts = np.cumsum(rng.normal(0, 1, (20,2)), axis=0)
+        shifts -= shifts[0]
+        
+        pairs = ncempy.algo.drift.pair_list(20, 4)
+        pair_shifts = shifts[pairs[:,1]] - shifts[pairs[:,0]] + rng.normal(0, 0.05, pairs.shape)
+        
+        bad = [5, 23, 40]
+        pair_shifts[bad] += [[7., -3.], [0., 4.], [-2., -2.]]
+        
+        drift, used = ncempy.algo.drift.solve_shifts_robust(20, pairs, pair_shifts)
+        
+        self.assertTrue(np.array_equal(np.nonzero(np.logical_not(used))[0], bad))
+        self.assertLess(np.abs(drift - shifts).max(), 0.1)
+        
+        # without rejection the corrupted pairs spoil the result
+        drift, used = ncempy.algo.drift.solve_shifts_robust(20, pairs, pair_shifts, iterations=0)
+        self.assertTrue(np.all(used))
+        self.assertGreater(np.abs(drift - shifts).max(), 0.5)
+        
+        # a single chain of pairs can not be reduced
+        pairs = ncempy.algo.drift.pair_list(5, 1)
+        drift, used = ncempy.algo.drift.solve_shifts_robust(5, pairs, np.array([[0.,0.],[0.,0.],[9.,9.],[0.,0.]]))
+        self.assertTrue(np.all(used))
+
+
+if __name__ == '__main__':
+    unittest.main()
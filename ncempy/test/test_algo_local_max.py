@@ -79,7 +79,125 @@ class test_localmax(unittest.TestCase):
         if show:
             plt.show()
     
-    
+    def test_local_max_stack(self):
+        '''
+        Test the batched local maxima detection on a synthetic stack.
+        '''
+        
+        # stack of gaussian spots on noise
+        rng = np.random.RandomState(42)
+        yy, xx = np.mgrid[0:64, 0:80]
+        stack = rng.rand(5, 64, 80)
+        for i in range(stack.shape[0]):
+            for (y, x) in ((10+i, 20), (40, 50+2*i)):
+                stack[i] += 10.0*np.exp(-((yy-y)**2 + (xx-x)**2)/8.0)
+        
+        # not working
+        with self.assertRaises(TypeError):
+            points = ncempy.algo.local_max.local_max_stack(stack[0], 5, 2.5)
+        with self.assertRaises(TypeError):
+            points = ncempy.algo.local_max.local_max_stack(stack, 'five', 2.5)
+        with self.assertRaises(TypeError):
+            points = ncempy.algo.local_max.local_max_stack(stack, 5, 2.5, workers=0)
+        
+        # no points detected
+        self.assertIsNone(ncempy.algo.local_max.local_max_stack(stack, 5, 1000.))
+        
+        # same result as frame by frame, also for a float threshold below 1
+        for thresh in (0.5, 2.5):
+            for workers in (1, 3):
+                points = ncempy.algo.local_max.local_max_stack(stack, 5, thresh, workers=workers, chunksize=2)
+                self.assertEqual(points.shape[1], 3)
+                
+                for i in range(stack.shape[0]):
+                    ref = ncempy.algo.local_max.local_max(stack[i], 5, thresh)
+                    np.testing.assert_array_equal(points[points[:,0]==i,1:3], ref)
+        
+        
+    def test_max_min_filter(self):
+        '''
+        Test the filter engines against the circular footprint filter.
+        '''
+        
+        rng = np.random.RandomState(42)
+        
+        # not working
+        with self.assertRaises(TypeError):
+            ncempy.algo.local_max.max_min_filter(rng.rand(20, 20), 3, mode='fancy')
+        with self.assertRaises(TypeError):
+            ncempy.algo.local_max.max_min_filter(rng.rand(20), 3)
+        
+        for img in (rng.rand(37, 53), rng.rand(3, 40, 29)):
+            for r in (0, 1, 4, 9, 25):
+                img_dil, img_ero = ncempy.algo.local_max.max_min_filter(img, r)
+                
+                # exact line decomposition
+                lin_dil, lin_ero = ncempy.algo.local_max.max_min_filter(img, r, mode='lines')
+                np.testing.assert_array_equal(lin_dil, img_dil)
+                np.testing.assert_array_equal(lin_ero, img_ero)
+                
+                # approximated footprint lies within the circle
+                rec_dil, rec_ero = ncempy.algo.local_max.max_min_filter(img, r, mode='rects')
+                self.assertTrue(np.all(rec_dil <= img_dil))
+                self.assertTrue(np.all(rec_ero >= img_ero))
+                
+                footprint = ncempy.algo.local_max.filter_footprint(r, mode='rects')
+                circle = ncempy.algo.local_max.filter_footprint(r)
+                self.assertFalse(np.any(footprint*np.logical_not(circle)))
+        
+        # same points with the exact engine
+        img = rng.rand(64, 64)
+        np.testing.assert_array_equal(ncempy.algo.local_max.local_max(img, 6, 0.5, mode='lines'), ncempy.algo.local_max.local_max(img, 6, 0.5))
+        
+        # benchmark runs
+        results = ncempy.algo.local_max.benchmark_max_min(radii=(3,), sizes=(32,), verbose=False)
+        self.assertEqual(len(results), 3)
+        
+        
+    def test_refine_points(self):
+        '''
+        Test the subpixel refinement on synthetic Gaussian peaks.
+        '''
+        
+        # peaks at known subpixel positions
+        truth = np.array([[10.3, 12.8], [30.6, 40.1], [45.45, 20.7], [20.0, 55.25]])
+        yy, xx = np.mgrid[0:64, 0:70]
+        img = np.zeros((64, 70))
+        for (y, x) in truth:
+            img += 100.*np.exp(-((yy-y)**2 + (xx-x)**2)/(2*1.5**2))
+        
+        points = ncempy.algo.local_max.local_max(img, 4, 10)
+        self.assertEqual(points.shape[0], truth.shape[0])
+        order = np.argsort(points[:,0])
+        points = points[order]
+        truth = truth[np.argsort(truth[:,0])]
+        
+        # not working
+        with self.assertRaises(TypeError):
+            ncempy.algo.local_max.refine_points(42, points)
+        with self.assertRaises(TypeError):
+            ncempy.algo.local_max.refine_points(img, points, method='magic')
+        
+        err_int = np.max(np.abs(points - truth))
+        
+        # exact for Gaussian peaks
+        refined = ncempy.algo.local_max.refine_points(img, points, method='gaussian')
+        np.testing.assert_allclose(refined, truth, atol=1e-6)
+        
+        # approximate methods still improve
+        for method in ('quadratic', 'centroid'):
+            refined = ncempy.algo.local_max.refine_points(img, points, method=method, r=3)
+            self.assertLess(np.max(np.abs(refined - truth)), err_int/2)
+        
+        # points at the border are left untouched
+        refined = ncempy.algo.local_max.refine_points(img, [[0, 5], [63, 69]])
+        np.testing.assert_array_equal(refined, [[0, 5], [63, 69]])
+        
+        # subpixel points are interpolated in dims
+        dims = ( (np.arange(64)*0.5 + 1.0, 'y', '[m]'), (np.arange(70)*0.25, 'x', '[m]') )
+        np.testing.assert_allclose(ncempy.algo.local_max.points_todim(truth, dims), np.array([truth[:,0]*0.5 + 1.0, truth[:,1]*0.25]).transpose())
+        
+        
 # to test with unittest runner
 if __name__ == '__main__':
     unittest.main()
@@ -150,5 +150,249 @@ class test_shiftedimages(unittest.TestCase):
                 out_cross = list(out_cross)
                 np.testing.assert_almost_equal(out_cross, i, decimal = 2)
 
+    def test_correlator(self):
+        '''
+        Tests the Correlator against multicorr
+        '''
+        G1 = np.zeros((101,101))
+        G1[55,55] = 12
+        G1fft = np.fft.fft2(G1)
+        shifts = [[3., 1.], [-10.3, 14.1], [10.3,-14.1]]
+        for method in ('phase', 'cross', 'hybrid'):
+            for up in (1, 2, 10):
+                corr = mc.Correlator(G1fft, method, up)
+                corr_scipy = mc.Correlator(G1fft, method, up, workers=1)
+                for i in shifts:
+                    G2 = np.fft.fft2(np.real(np.fft.ifft2(corr.shift(G1fft, i))))
+                    with self.subTest(method = method, up = up, i = i):
+                        ref = mc.multicorr(G1fft, G2, method, up)
+                        np.testing.assert_array_equal(corr(G2), ref)
+                        np.testing.assert_allclose(corr_scipy(G2), ref, atol=1e-10)
+
+        # same results after changing the reference
+        G1b = np.roll(G1, 5, axis=0)
+        corr = mc.Correlator(G1fft, 'hybrid', 10)
+        corr.set_reference(np.fft.fft2(G1b))
+        G2 = np.fft.fft2(np.roll(G1, -3, axis=1))
+        np.testing.assert_array_equal(corr(G2), mc.multicorr(np.fft.fft2(G1b), G2, 'hybrid', 10))
+
+        with self.assertRaises(TypeError):
+            corr(np.zeros((101,101)))
+        with self.assertRaises(TypeError):
+            corr(np.zeros((100,101), dtype='complex128'))
+        with self.assertRaises(TypeError):
+            corr.set_reference(np.zeros((100,101), dtype='complex128'))
+
+    def test_register_stack(self):
+        '''
+        Tests registering a stack in all modes
+        '''
+        yy, xx = np.mgrid[0:64, 0:64]
+        ref = np.exp(-((yy-30)**2 + (xx-35)**2)/20.) + 0.5*np.exp(-((yy-15)**2 + (xx-12)**2)/8.)
+        rng = np.random.RandomState(5)
+        shifts = rng.uniform(-6, 6, (11, 2))
+        stack = np.real(np.fft.ifft2(mc.imageShifter(np.fft.fft2(ref), shifts)))
+
+        # 2x upsampling of even sized images (needs the centered spectrum)
+        np.testing.assert_allclose(mc.multicorr(np.fft.fft2(ref), np.fft.fft2(stack[0]), 'cross', 10), shifts[0], atol=0.05)
+
+        # same as multicorr frame by frame
+        for up in (1, 2, 10):
+            ref_shifts = np.array([mc.multicorr(np.fft.fft2(ref), np.fft.fft2(im), 'hybrid', up) for im in stack])
+            for bs in (None, 1, 4):
+                with self.subTest(up = up, batchsize = bs):
+                    out = mc.register_stack(stack, ref, 'reference', 'hybrid', up, batchsize=bs)
+                    self.assertEqual(out.shape, (11, 2))
+                    np.testing.assert_allclose(out, ref_shifts, atol=1e-10)
+
+        for mode in ('reference', 'sequential', 'running_mean'):
+            with self.subTest(mode = mode):
+                out, aligned = mc.register_stack(stack, ref, mode, 'cross', 20, align=True, batchsize=3)
+                np.testing.assert_allclose(out, shifts, atol=0.05)
+                np.testing.assert_allclose(aligned, np.broadcast_to(ref, stack.shape), atol=0.05)
+
+                # first frame as reference
+                out = mc.register_stack(stack, mode=mode, upsampleFactor=20)
+                np.testing.assert_allclose(out, shifts - shifts[0], atol=0.05)
+
+        with self.assertRaises(TypeError):
+            mc.register_stack(stack, mode='dummy')
+        with self.assertRaises(TypeError):
+            mc.register_stack(ref)
+
+    def test_real(self):
+        '''
+        Tests the half spectrum path against the complex path
+        '''
+        rng = np.random.RandomState(7)
+        for shape in ((64,64), (64,65), (65,64), (63,63), (40,50)):
+            a = rng.rand(*shape)
+            b = np.real(np.fft.ifft2(mc.imageShifter(np.fft.fft2(a), [3.3, -5.6])))
+            F = mc.initial_correlation_image(np.fft.fft2(a), np.fft.fft2(b), 'hybrid')
+            H = mc.initial_correlation_image(np.fft.rfft2(a), np.fft.rfft2(b), 'hybrid')
+            with self.subTest(shape = shape):
+                np.testing.assert_allclose(mc.upsampleFFT(H, 2, real=True, shape=shape), mc.upsampleFFT(F, 2), atol=1e-12)
+                np.testing.assert_allclose(mc.dftUpsample(H, 10, [2.1, -3.4], real=True, shape=shape), mc.dftUpsample(F, 10, [2.1, -3.4]), atol=1e-10)
+                shifted = np.fft.irfft2(mc.imageShifter(np.fft.rfft2(a), [1.7, 2.2], real=True, shape=shape), s=shape)
+                np.testing.assert_allclose(shifted, np.real(np.fft.ifft2(mc.imageShifter(np.fft.fft2(a), [1.7, 2.2]))), atol=1e-12)
+
+                for method in ('phase', 'cross', 'hybrid'):
+                    for up in (1, 2, 10):
+                        ref = mc.multicorr(np.fft.fft2(a), np.fft.fft2(b), method, up)
+                        out = mc.multicorr(np.fft.rfft2(a), np.fft.rfft2(b), method, up, real=True, shape=shape)
+                        np.testing.assert_allclose(out, ref, atol=1e-10)
+
+                corr = mc.Correlator(np.fft.rfft2(a), 'hybrid', 10, real=True, imageShape=shape)
+                np.testing.assert_allclose(corr(corr.fft2(b)), mc.multicorr(np.fft.fft2(a), np.fft.fft2(b), 'hybrid', 10), atol=1e-10)
+
+        with self.assertRaises(TypeError):
+            mc.multicorr(np.fft.rfft2(a), np.fft.rfft2(b), real=True, shape=(40,52))
+
+    def test_precision(self):
+        '''
+        Tests single precision against double precision
+        '''
+        yy, xx = np.mgrid[0:96, 0:96]
+        ref = np.exp(-((yy-40)**2 + (xx-50)**2)/30.) + 0.5*np.exp(-((yy-70)**2 + (xx-20)**2)/12.)
+        G1 = np.fft.fft2(ref)
+        G2 = mc.imageShifter(G1, [4.37, -7.81])
+        G1s = G1.astype('complex64')
+        G2s = mc.imageShifter(G1s, [4.37, -7.81], precision='single')
+        self.assertEqual(G2s.dtype, np.complex64)
+        np.testing.assert_allclose(G2s, G2, atol=1e-3*np.abs(G1).max())
+
+        imageCorr = mc.initial_correlation_image(G1, G2, 'hybrid', precision='single')
+        self.assertEqual(imageCorr.dtype, np.complex64)
+        self.assertEqual(mc.upsampleFFT(imageCorr, 2, precision='single').dtype, np.float32)
+        self.assertEqual(mc.dftUpsample(imageCorr, 10, [3., 4.], precision='single').dtype, np.float32)
+        self.assertEqual(mc.Correlator(G1s, precision='single').fft2(ref).dtype, np.complex64)
+        self.assertEqual(mc.Correlator(np.fft.rfft2(ref), real=True, precision='single').fft2(ref).dtype, np.complex64)
+
+        for method in ('phase', 'cross', 'hybrid'):
+            for up in (1, 2, 20):
+                with self.subTest(method = method, up = up):
+                    out = mc.multicorr(G1s, G2s, method, up, precision='single')
+                    np.testing.assert_allclose(out, mc.multicorr(G1, G2, method, up), atol=1e-3)
+                    corr = mc.Correlator(G1s, method, up, precision='single')
+                    np.testing.assert_allclose(corr(G2s), out, atol=1e-3)
+
+        out = mc.multicorr(np.fft.rfft2(ref.astype('float32')), np.fft.rfft2(np.fft.irfft2(G2s[:, :49], s=ref.shape)), 'hybrid', 20, real=True, precision='single')
+        np.testing.assert_allclose(out, [4.37, -7.81], atol=0.01)
+
+        with self.assertRaises(TypeError):
+            mc.multicorr(G1, G2, precision='half')
+
+        # benchmark runs
+        results = mc.benchmark_precision(sizes = (64,), num = 2, verbose = False)
+        self.assertEqual(len(results), 4)
+        self.assertLess(max(result['error'] for result in results), 0.05)
+
+    def test_direct(self):
+        '''
+        Tests the half pixel peak search by matrix multiply DFT against the padded FFT
+        '''
+        rng = np.random.RandomState(11)
+        for shape in ((64,64), (65,80)):
+            yy, xx = np.mgrid[0:shape[0], 0:shape[1]]
+            ref = np.exp(-((yy-30)**2 + (xx-35)**2)/20.) + 0.5*np.exp(-((yy-15)**2 + (xx-52)**2)/8.)
+            shifts = rng.uniform(-10, 10, (5, 2))
+            stack = np.real(np.fft.ifft2(mc.imageShifter(np.fft.fft2(ref), shifts)))
+            for method in ('phase', 'cross', 'hybrid'):
+                for up in (2, 3, 10):
+                    with self.subTest(shape = shape, method = method, up = up):
+                        for ii in range(stack.shape[0]):
+                            out = mc.multicorr(np.fft.fft2(ref), np.fft.fft2(stack[ii]), method, up, direct=True)
+                            np.testing.assert_allclose(out, mc.multicorr(np.fft.fft2(ref), np.fft.fft2(stack[ii]), method, up), atol=1e-10)
+                            out_real = mc.multicorr(np.fft.rfft2(ref), np.fft.rfft2(stack[ii]), method, up, real=True, shape=shape, direct=True)
+                            np.testing.assert_allclose(out_real, mc.multicorr(np.fft.rfft2(ref), np.fft.rfft2(stack[ii]), method, up, real=True, shape=shape), atol=1e-10)
+                        out = mc.register_stack(stack, ref, 'reference', method, up, direct=True)
+                        np.testing.assert_allclose(out, mc.register_stack(stack, ref, 'reference', method, up), atol=1e-10)
+                        # kernels cached over calls and batches
+                        corr = mc.Correlator(np.fft.rfft2(ref), method, up, real=True, imageShape=shape, direct=True)
+                        np.testing.assert_allclose([corr(np.fft.rfft2(im)) for im in stack], [mc.multicorr(np.fft.rfft2(ref), np.fft.rfft2(im), method, up, real=True, shape=shape, direct=True) for im in stack], atol=1e-10)
+                        np.testing.assert_allclose(mc.register_stack(stack, ref, 'reference', method, up, batchsize=2, direct=True), out, atol=1e-10)
+
+    def test_shift_stack(self):
+        '''
+        Tests the batched shifting of stacks against imageShifter
+        '''
+        rng = np.random.RandomState(12)
+        for shape in ((32,32), (31,32), (32,33), (31,29)):
+            stack = rng.normal(size = (7,) + shape)
+            shifts = rng.uniform(-5, 5, (7, 2))
+            shifts[2] = [3, -4]
+            shifts[5] = [0, 0]
+            ref = np.stack([np.real(np.fft.ifft2(mc.imageShifter(np.fft.fft2(stack[ii]), shifts[ii]))) for ii in range(7)])
+            for batchsize in (1, 3, None):
+                with self.subTest(shape = shape, batchsize = batchsize):
+                    np.testing.assert_allclose(mc.shift_stack(stack, shifts, batchsize), ref, atol=1e-12)
+                    out = mc.shift_stack(stack, shifts, batchsize, precision='single')
+                    self.assertEqual(out.dtype, np.float32)
+                    np.testing.assert_allclose(out, ref, atol=1e-5)
+            
+            # integer shifts are rolls, one shift for all frames
+            np.testing.assert_array_equal(mc.shift_stack(stack, [2, -1]), np.roll(stack, (2, -1), axis=(1, 2)))
+        
+        with self.assertRaises(TypeError):
+            mc.shift_stack(stack, shifts[:-1])
+        with self.assertRaises(TypeError):
+            mc.shift_stack(stack[0], [1, 1])
+
+    def test_template_matcher(self):
+        '''
+        Tests finding the best template and its shift in noisy images
+        '''
+        rng = np.random.RandomState(13)
+        shape = (64, 80)
+        templates = []
+        for size in ((20, 20), (24, 16), (31, 27)):
+            yy, xx = np.mgrid[0:size[0], 0:size[1]]
+            t = np.zeros(size)
+            for ii in range(4):
+                t += np.exp(-((yy - rng.uniform(3, size[0]-3))**2 + (xx - rng.uniform(3, size[1]-3))**2)/4.)
+            templates.append(t)
+        
+        # templates centered in the image shifted by known amounts
+        stack = np.zeros((6,) + shape)
+        truth = np.zeros((6, 2))
+        for ii in range(6):
+            t = templates[ii % 3]
+            padded = np.zeros(shape)
+            padded[shape[0]//2 - t.shape[0]//2:shape[0]//2 - t.shape[0]//2 + t.shape[0], shape[1]//2 - t.shape[1]//2:shape[1]//2 - t.shape[1]//2 + t.shape[1]] = t
+            truth[ii] = rng.uniform(-15, 15, 2)
+            stack[ii] = np.real(np.fft.ifft2(mc.imageShifter(np.fft.fft2(padded), truth[ii]))) + rng.normal(0, 0.02, shape)
+        
+        for method in ('phase', 'cross', 'hybrid'):
+            for batchsize in (1, 2, None):
+                with self.subTest(method = method, batchsize = batchsize):
+                    matcher = mc.TemplateMatcher(templates, shape, method, 10, batchsize = batchsize)
+                    index, score, xyShift = matcher.match_stack(stack)
+                    np.testing.assert_array_equal(index, [0, 1, 2, 0, 1, 2])
+                    # phase correlation weights the noisy high frequencies of the smooth templates up
+                    np.testing.assert_allclose(xyShift, truth, atol=0.3 if method == 'phase' else 0.15)
+                    
+                    # the score is the peak of the correlation map of the best template
+                    maps = matcher.correlation_maps(matcher.fft2(stack[0]))
+                    self.assertEqual(maps.shape, (3,) + shape)
+                    self.assertAlmostEqual(score[0], maps[0].max())
+                    
+                    # single precision
+                    matcher = mc.TemplateMatcher(templates, shape, method, 10, batchsize = batchsize, precision = 'single')
+                    self.assertEqual(matcher.correlation_maps(matcher.fft2(stack[0])).dtype, np.float32)
+                    index_s, score_s, xyShift_s = matcher.match_stack(stack)
+                    np.testing.assert_array_equal(index_s, index)
+                    # the phase weighting also normalizes the small frequencies, which carry the largest rounding errors
+                    np.testing.assert_allclose(score_s, score, rtol=5e-3 if method == 'phase' else 1e-4)
+                    np.testing.assert_allclose(xyShift_s, xyShift, atol=0.02)
+        
+        with self.assertRaises(TypeError):
+            mc.TemplateMatcher([np.ones((70, 10))], shape)
+        with self.assertRaises(TypeError):
+            mc.TemplateMatcher(templates, shape, precision = 'half')
+        with self.assertRaises(TypeError):
+            matcher.match_stack(stack[:, :-1])
+        with self.assertRaises(TypeError):
+            matcher(stack[0])
+
 if __name__ == "__main__":
     unittest.main()
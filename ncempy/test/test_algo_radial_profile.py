@@ -5,6 +5,7 @@ Tests for the algo.radial_profile module.
 import unittest
 import numpy as np
 import matplotlib.pyplot as plt
+import scipy.ndimage
 import os
 
 import ncempy.io.emd
@@ -203,6 +204,336 @@ class test_ringdiff(unittest.TestCase):
         if show:
             plt.show()            
     
+    
+    def test_polargridcache(self):
+        '''
+        Test the cache for polar coordinate grids against direct calculation.
+        '''
+        
+        dims = ( (np.arange(60)*0.1 - 2.0, 'x', '[m]'), (np.arange(50)*0.2 + 1.0, 'y', '[m]') )
+        ns = (2,3)
+        dists = np.array([1.0, 0.3, 0.02, -0.5, 0.01])
+        
+        # wrong input
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.PolarGridCache(margin=-1)
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.calc_polarcoords( (1.0, 5.0), dims, cache=42 )
+        
+        cache = ncempy.algo.radial_profile.PolarGridCache(margin=4, dtype='float64')
+        
+        center = np.array([0.93, 5.87])
+        for shift in ( (0,0), (1,0), (-3,4), (4,-4), (0,0) ):
+            c = center + np.array(shift)*np.array([0.1, 0.2])
+            for (n, d) in ((None, None), (ns, dists)):
+                rs, thes = ncempy.algo.radial_profile.calc_polarcoords( c, dims, n, d, cache=cache )
+                rs_ref, thes_ref = ncempy.algo.radial_profile.calc_polarcoords( c, dims, n, d )
+                np.testing.assert_allclose(rs, rs_ref, rtol=1e-9)
+                np.testing.assert_allclose(thes, thes_ref, rtol=1e-9, atol=1e-12)
+                self.assertFalse(rs.flags.writeable)
+        
+        # everything but the first computations came from base grids
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(cache.hits, 8)
+        
+        # outside the margin needs a new base grid
+        rs, thes = ncempy.algo.radial_profile.calc_polarcoords( center + np.array([0.5, 0.]), dims, cache=cache )
+        self.assertEqual(cache.misses, 3)
+        
+        # quantized centers reuse grids with an error below the quantum
+        cache = ncempy.algo.radial_profile.PolarGridCache(margin=4, quantum=0.05, dtype='float32')
+        rs_a, thes_a = ncempy.algo.radial_profile.calc_polarcoords( center, dims, cache=cache )
+        rs_b, thes_b = ncempy.algo.radial_profile.calc_polarcoords( center + np.array([0.1001, 0.2001]), dims, cache=cache )
+        rs_ref, thes_ref = ncempy.algo.radial_profile.calc_polarcoords( center + np.array([0.1001, 0.2001]), dims )
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(rs_b.dtype, np.float32)
+        self.assertLess(np.max(np.abs(rs_b - rs_ref)), 0.05*0.2)
+        
+        # memory cap is kept
+        cache = ncempy.algo.radial_profile.PolarGridCache(max_bytes=3*2*68*58*8, margin=4, dtype='float64')
+        for i in range(5):
+            ncempy.algo.radial_profile.calc_polarcoords( center + np.array([0.01*i, 0.]), dims, cache=cache )
+        self.assertLessEqual(cache.nbytes, cache.max_bytes)
+        self.assertEqual(len(cache._entries), 3)
+        
+        # non-equidistant dims are cached by exact key
+        dims_ne = ( (np.cumsum(np.arange(1, 21))*0.1, 'x', '[m]'), dims[1] )
+        cache = ncempy.algo.radial_profile.PolarGridCache(dtype='float64')
+        for i in range(2):
+            rs, thes = ncempy.algo.radial_profile.calc_polarcoords( center, dims_ne, ns, dists, cache=cache )
+        np.testing.assert_allclose(rs, ncempy.algo.radial_profile.calc_polarcoords( center, dims_ne, ns, dists )[0])
+        self.assertEqual(cache.hits, 1)
+        
+        # distortion correction with cache gives the same image
+        img = np.random.RandomState(42).rand(60, 50)
+        np.testing.assert_allclose( ncempy.algo.radial_profile.correct_distortion( img, dims, center, ns, dists, cache=cache ), ncempy.algo.radial_profile.correct_distortion( img, dims, center, ns, dists ) )
+    
+    
+    def test_radialintegrator(self):
+        '''
+        Test the reusable radial integrator against a direct histogram implementation.
+        '''
+        
+        rng = np.random.RandomState(42)
+        dims = ( (np.arange(80)*0.1, 'x', '[m]'), (np.arange(70)*0.1, 'y', '[m]') )
+        rs, thes = ncempy.algo.radial_profile.calc_polarcoords( (4.02, 3.47), dims, (2,), np.array([1.0, 0.3, 0.05]) )
+        rMax, dr, rsigma = 3.4, 0.01, 0.1
+        stack = rng.rand(4, 80, 70)*100.
+        mask = (rng.rand(80, 70) > 0.2).astype('float64')
+        
+        # wrong input
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.RadialIntegrator( 42, rMax, dr, rsigma )
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.RadialIntegrator( rs, rMax, dr, rsigma, mask=np.ones((5,5)) )
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.RadialIntegrator( rs, rMax, dr, rsigma, method='magic' )
+        integ = ncempy.algo.radial_profile.RadialIntegrator( rs, rMax, dr, rsigma, mask=mask )
+        with self.assertRaises(TypeError):
+            integ( np.ones((5,5)) )
+        
+        # reference using weighted histograms
+        rBins = np.arange(0, rMax, dr)
+        sel = mask > 0
+        signal = np.histogram(rs[sel], rBins, weights=stack[1][sel])[0]
+        count = np.histogram(rs[sel], rBins)[0].astype('float64')
+        ref = scipy.ndimage.gaussian_filter1d(signal, rsigma/dr) / scipy.ndimage.gaussian_filter1d(count, rsigma/dr)
+        
+        R, I = integ( stack[1] )
+        np.testing.assert_array_equal(R, rBins[:-1])
+        np.testing.assert_allclose(I, ref, rtol=1e-10)
+        
+        # sparse matrix gives the same
+        R, I_sp = ncempy.algo.radial_profile.RadialIntegrator( rs, rMax, dr, rsigma, mask=mask, method='sparse' )( stack[1] )
+        np.testing.assert_allclose(I_sp, ref, rtol=1e-10)
+        
+        # whole stack at once
+        R, Is = integ( stack )
+        self.assertEqual(Is.shape, (stack.shape[0], R.shape[0]))
+        for i in range(stack.shape[0]):
+            np.testing.assert_allclose(Is[i], integ( stack[i] )[1], rtol=1e-10)
+        
+        # convenience function
+        R, I_f = ncempy.algo.radial_profile.calc_radialprofile( stack[1], rs, rMax, dr, rsigma, mask=mask )
+        np.testing.assert_allclose(I_f, ref, rtol=1e-10)
+        
+        # everything masked
+        R, I_em = ncempy.algo.radial_profile.RadialIntegrator( rs, rMax, dr, rsigma, mask=np.zeros(rs.shape) )( stack[1] )
+        self.assertTrue(np.all(np.isnan(I_em)))
+    
+    
+    def test_distortioncorrector(self):
+        '''
+        Test the precomputed distortion correction against correct_distortion.
+        '''
+        
+        dims = ( (np.arange(90)*0.1, 'x', '[m]'), (np.arange(80)*0.1, 'y', '[m]') )
+        center = (4.37, 3.91)
+        ns = (2,3)
+        dists = np.array([1.0, 0.3, 0.05, 0.1, 0.02])
+        
+        # smooth rings
+        rs, thes = ncempy.algo.radial_profile.calc_polarcoords( center, dims )
+        img = np.exp(-np.square(rs - 2.0)/0.5) + 0.5*np.exp(-np.square(rs - 3.0)/0.2)
+        ref = ncempy.algo.radial_profile.correct_distortion( img, dims, center, ns, dists )
+        
+        # wrong input
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.DistortionCorrector( dims, center, ns, dists[0:3] )
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.DistortionCorrector( dims, center, ns, dists, method='magic' )
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.DistortionCorrector( dims, center, ns, dists, method='sparse', order=2 )
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.DistortionCorrector( dims, center, ns, dists, dtype='int32' )
+        
+        corr = ncempy.algo.radial_profile.DistortionCorrector( dims, center, ns, dists )
+        with self.assertRaises(TypeError):
+            corr( np.ones((5,5)) )
+        
+        # cubic spline matches
+        np.testing.assert_allclose(corr( img ), ref, rtol=0, atol=1e-3)
+        
+        # sparse interpolation matrices are close
+        for (order, atol) in ((1, 1e-2), (3, 1e-3)):
+            corr_sp = ncempy.algo.radial_profile.DistortionCorrector( dims, center, ns, dists, method='sparse', order=order )
+            np.testing.assert_allclose(corr_sp( img ), ref, rtol=0, atol=atol)
+        
+        # stacks in chunks, single precision
+        stack = np.array([img, 2*img, 3*img])
+        for method in ('map', 'sparse'):
+            corr32 = ncempy.algo.radial_profile.DistortionCorrector( dims, center, ns, dists, method=method, dtype='float32' )
+            out = corr32( stack, workers=2, chunksize=2 )
+            self.assertEqual(out.dtype, np.float32)
+            self.assertEqual(out.shape, stack.shape)
+            for i in range(stack.shape[0]):
+                np.testing.assert_allclose(out[i], (i+1)*ref, rtol=0, atol=(i+1)*1e-2)
+    
+    def test_jacobian(self):
+        '''
+        Test the analytic Jacobians of the fit functions.
+        '''
+        
+        r = np.linspace(0.01, 10., 200)
+        funcs = ('const', 'linear', 'powlaw', 'voigt')
+        param = np.array((0.5, -0.2, 3., 2., -1.5, 10., 4., 0.7, 0.3))
+        
+        jac = ncempy.algo.math.sum_functions_jac( r, funcs, param )
+        self.assertEqual(jac.shape, (r.shape[0], param.shape[0]))
+        
+        num = ncempy.algo.math.num_jac( lambda p: ncempy.algo.math.sum_functions(r, funcs, p), param )
+        np.testing.assert_allclose(jac, num, rtol=0, atol=1e-4*np.max(np.abs(num)))
+        
+        self.assertLess(ncempy.algo.math.check_jac( ncempy.algo.radial_profile.residuals_fit, ncempy.algo.radial_profile.jacobian_fit, param, args=(r, np.zeros(r.shape), funcs) ), 1e-4)
+        
+        # fit with and without analytic Jacobian
+        intens = ncempy.algo.math.sum_functions(r, ('const', 'voigt'), (0.5, 10., 4., 0.7, 0.3))
+        init_guess = (0.3, 8., 4.2, 1., 0.2)
+        
+        popt = ncempy.algo.radial_profile.fit_radialprofile( r, intens, ('const', 'voigt'), init_guess, check_jac=True )
+        popt_num = ncempy.algo.radial_profile.fit_radialprofile( r, intens, ('const', 'voigt'), init_guess, jac=False )
+        
+        np.testing.assert_allclose(popt, (0.5, 10., 4., 0.7, 0.3), atol=1e-6)
+        np.testing.assert_allclose(np.abs(popt), np.abs(popt_num), atol=1e-6)
+    
+    def test_compositemodel(self):
+        '''
+        Test the compiled sum of functions against sum_functions.
+        '''
+        
+        r = np.linspace(0.01, 10., 200)
+        funcs = ('const', 'powlaw', 'voigt')
+        param = np.array((0.5, 3., -1.5, 10., 4., 0.7, 0.3))
+        
+        with self.assertRaises(TypeError):
+            ncempy.algo.math.CompositeModel( ('const', 'nonexisting') )
+        
+        model = ncempy.algo.math.CompositeModel( funcs )
+        self.assertEqual(model.nparams, 7)
+        with self.assertRaises(RuntimeError):
+            model.evaluate(param)
+        
+        model.bind(r)
+        with self.assertRaises(TypeError):
+            model.evaluate(param[:-1])
+        
+        ref = ncempy.algo.math.sum_functions(r, funcs, param)
+        np.testing.assert_allclose(model(param), ref)
+        np.testing.assert_allclose(model.residuals(param, 2*ref), ref)
+        np.testing.assert_allclose(model.jacobian(param), ncempy.algo.math.sum_functions_jac(r, funcs, param))
+        
+        # batch of parameter vectors
+        params = param[np.newaxis,:]*np.linspace(0.8, 1.2, 5)[:,np.newaxis]
+        batch = model.evaluate_batch(params)
+        self.assertEqual(batch.shape, (5, r.shape[0]))
+        for i in range(params.shape[0]):
+            np.testing.assert_allclose(batch[i], ncempy.algo.math.sum_functions(r, funcs, params[i]))
+    
+    def test_fit_stack(self):
+        '''
+        Test fitting a series of radial profiles with warm starts.
+        '''
+        
+        r = np.linspace(0.5, 10., 300)
+        funcs = ('const', 'voigt')
+        
+        # slowly drifting peak
+        N = 12
+        params = np.zeros((N, 5))
+        params[:,0] = 0.5
+        params[:,1] = 10.
+        params[:,2] = np.linspace(4., 4.5, N)
+        params[:,3] = 0.3
+        params[:,4] = 0.2
+        intens = ncempy.algo.math.CompositeModel(funcs, r).evaluate_batch(params)
+        
+        init_guess = (0.3, 8., 4.3, 0.5, 0.3)
+        
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.fit_radialprofile_stack( r, intens[0], funcs, init_guess )
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.fit_radialprofile_stack( r, intens, funcs, init_guess[:-1] )
+        
+        popts, stats = ncempy.algo.radial_profile.fit_radialprofile_stack( r, intens, funcs, init_guess, warm_start=False )
+        popts_ws, stats_ws = ncempy.algo.radial_profile.fit_radialprofile_stack( r, intens, funcs, init_guess )
+        
+        self.assertTrue(np.all(stats['converged']))
+        self.assertTrue(np.all(stats_ws['converged']))
+        np.testing.assert_allclose(np.abs(popts), params, atol=1e-6)
+        np.testing.assert_allclose(np.abs(popts_ws), params, atol=1e-6)
+        
+        # warm starts save evaluations
+        self.assertLess(np.sum(stats_ws['nfev']), np.sum(stats['nfev']))
+        
+        # chunks in worker processes give the same results
+        popts_par, stats_par = ncempy.algo.radial_profile.fit_radialprofile_stack( r, intens, funcs, init_guess, warm_start=False, workers=2 )
+        np.testing.assert_allclose(popts_par, popts)
+        np.testing.assert_array_equal(stats_par['nfev'], stats['nfev'])
+    
+    def test_ringdiffpipeline(self):
+        '''
+        Test the pipeline on synthetic ring diffraction patterns.
+        '''
+        
+        # elliptic ring of spots on a decaying background
+        n = 256
+        x, y = np.mgrid[0:n, 0:n].astype('float64')
+        r = np.hypot(x-130., y-124.)
+        th = np.arctan2(y-124., x-130.)
+        rd = ncempy.algo.distortion.rad_dis(th, 0.4, 0.03, 2)*60.
+        rng = np.random.RandomState(0)
+        imgs = [ 1000.*np.exp(-np.square(r-rd*(1.+0.002*i))/8.)*(1.+0.8*np.cos(36*th)) + 2000./(1.+r) + rng.normal(0, 1, r.shape) for i in range(3) ]
+        dims = ( (np.arange(n), 'x', '[px]'), (np.arange(n), 'y', '[px]') )
+        
+        settings = { 'lmax_r': 3, 'lmax_thresh': 400, 'lmax_cinit': (128, 128), 'lmax_range': (45., 75.),
+                     'plt_imgminmax': None, 'ns': (2,), 'rad_rmax': None, 'rad_dr': None, 'rad_sigma': None, 'mask': None,
+                     'fit_rrange': (20., 110.), 'back_xs': (25., 40., 90., 105.), 'back_xswidth': 2., 'back_init': (1., 2000., -1.),
+                     'fit_funcs': ('voigt',), 'fit_init': (10000., 60., 3., 1.), 'fit_maxfev': None }
+        
+        with self.assertRaises(TypeError):
+            ncempy.algo.radial_profile.RingDiffPipeline( settings, dims[0:1] )
+        
+        stages = []
+        pipeline = ncempy.algo.radial_profile.RingDiffPipeline( settings, dims, hook=lambda stage, elapsed: stages.append(stage) )
+        self.assertFalse(pipeline.warm_start)
+        with self.assertRaises(TypeError):
+            pipeline( np.ones((5,5)) )
+        
+        # same results as the single image evaluation
+        for img in imgs:
+            res_pipe = pipeline( img )
+            res_sgl = ncempy.algo.radial_profile.run_singleImage( img, dims, settings )
+            for i in range(6):
+                np.testing.assert_allclose(res_pipe[i], res_sgl[i])
+        
+        np.testing.assert_allclose(res_pipe[2], (130., 124.), atol=0.05)
+        self.assertEqual(pipeline.nframes, 3)
+        self.assertEqual(tuple(stages[:len(pipeline.stages)]), pipeline.stages)
+        self.assertEqual(len(stages), 3*len(pipeline.stages))
+        self.assertTrue(all(pipeline.timings[stage] > 0 for stage in pipeline.stages))
+        self.assertEqual(len(pipeline.records), 0)
+        
+        # per frame records
+        pipeline_prof = ncempy.algo.radial_profile.RingDiffPipeline( settings, dims, profile=True )
+        for img in imgs:
+            res_prof = pipeline_prof( img )
+        np.testing.assert_allclose(res_prof[1], res_pipe[1])
+        self.assertEqual(len(pipeline_prof.records), 3)
+        
+        summary = ncempy.algo.radial_profile.profile_summary(pipeline_prof.records)
+        self.assertEqual(summary['frames'], 3)
+        self.assertEqual(tuple(summary['time'].keys()), pipeline.stages)
+        self.assertTrue(all(summary['nfev'][stage]['max'] > 0 for stage in pipeline.fit_stages))
+        self.assertEqual(summary['size']['profile']['max'], res_prof[0].shape[0])
+        self.assertLessEqual(summary['size']['ring_points']['max'], summary['size']['points']['max'])
+        
+        # warm starts give the same minima
+        pipeline_ws = ncempy.algo.radial_profile.RingDiffPipeline( dict(settings, fit_warmstart=True), dims )
+        self.assertTrue(pipeline_ws.warm_start)
+        for img in imgs:
+            res_ws = pipeline_ws( img )
+        np.testing.assert_allclose(np.abs(res_ws[1]), np.abs(res_pipe[1]), rtol=1e-4)
+    
 
 # to test with unittest runner
 if __name__ == '__main__':
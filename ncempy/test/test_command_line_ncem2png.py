@@ -0,0 +1,84 @@
+'''
+Tests for the file handling of the ncem2png command line tool.
+'''
+
+import unittest
+import tempfile
+import os
+
+import ncempy.command_line.ncem2png
+
+
+class test_ncem2png(unittest.TestCase):
+    '''
+    Test collecting source files and the manifest of finished conversions.
+    '''
+    
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        root = self.tmp.name
+        os.makedirs(os.path.join(root, 'sub', 'deep'))
+        self.files = {}
+        for name in ('a.dm3', 'b.DM4', 'c.ser', 'notes.txt', os.path.join('sub', 'd.dm3'), os.path.join('sub', 'deep', 'e.ser')):
+            path = os.path.join(root, name)
+            open(path, 'w').close()
+            self.files[name] = path
+    
+    def tearDown(self):
+        self.tmp.cleanup()
+    
+    def test_collect_directory(self):
+        root = self.tmp.name
+        
+        # only supported files at the top level
+        found = ncempy.command_line.ncem2png.collect_source_files([root])
+        self.assertEqual(found, [self.files['a.dm3'], self.files['b.DM4'], self.files['c.ser']])
+        
+        # walk subdirectories
+        found = ncempy.command_line.ncem2png.collect_source_files([root], recursive=True)
+        self.assertEqual(found, [self.files['a.dm3'], self.files['b.DM4'], self.files['c.ser'],
+                                 self.files[os.path.join('sub', 'd.dm3')], self.files[os.path.join('sub', 'deep', 'e.ser')]])
+    
+    def test_collect_glob(self):
+        root = self.tmp.name
+        
+        found = ncempy.command_line.ncem2png.collect_source_files([os.path.join(root, '*.dm3')])
+        self.assertEqual(found, [self.files['a.dm3']])
+        
+        # ** only descends with recursive
+        pattern = os.path.join(root, '**', '*.ser')
+        found = ncempy.command_line.ncem2png.collect_source_files([pattern], recursive=True)
+        self.assertEqual(found, [self.files['c.ser'], self.files[os.path.join('sub', 'deep', 'e.ser')]])
+        
+        # unsupported extensions of explicit files are rejected
+        with self.assertRaises(ValueError):
+            ncempy.command_line.ncem2png.collect_source_files([self.files['notes.txt']])
+    
+    def test_collect_dedup(self):
+        root = self.tmp.name
+        
+        relative = os.path.relpath(self.files['a.dm3'])
+        found = ncempy.command_line.ncem2png.collect_source_files([self.files['a.dm3'], root, relative, os.path.join(root, '*.dm3')])
+        self.assertEqual(found, [self.files['a.dm3'], self.files['b.DM4'], self.files['c.ser']])
+    
+    def test_manifest(self):
+        manifest = os.path.join(self.tmp.name, 'manifest.txt')
+        
+        # no manifest yet
+        self.assertEqual(ncempy.command_line.ncem2png.read_manifest(manifest), {})
+        self.assertEqual(ncempy.command_line.ncem2png.read_manifest(None), {})
+        
+        ncempy.command_line.ncem2png.append_manifest(manifest, self.files['a.dm3'])
+        ncempy.command_line.ncem2png.append_manifest(manifest, self.files['c.ser'])
+        
+        # a partially written line of an interrupted run is ignored
+        with open(manifest, 'a') as f:
+            f.write(os.path.abspath(self.files['b.DM4']))
+        
+        finished = ncempy.command_line.ncem2png.read_manifest(manifest)
+        self.assertEqual(finished, {os.path.abspath(self.files['a.dm3']): os.path.getmtime(self.files['a.dm3']),
+                                    os.path.abspath(self.files['c.ser']): os.path.getmtime(self.files['c.ser'])})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+'''
+Tests for the edstomo.preprocess module.
+'''
+
+import unittest
+import tempfile
+import os
+import numpy as np
+import h5py
+
+import ncempy.edstomo.preprocess
+
+
+class test_preprocess(unittest.TestCase):
+    '''
+    Test the extraction of energy windows from EDS tilt stacks against direct sums.
+    '''
+    
+    def reference(self, EDS, Windows, Binning):
+        '''
+        Sum every window over the full cube and bin afterwards.
+        '''
+        
+        return [ ncempy.edstomo.preprocess.BinEDSSpatialDimensions(np.sum(EDS[..., lo:hi+1], -1), Binning) for lo, hi in Windows ]
+    
+    def test_extract_energy_windows(self):
+        '''
+        Test in-memory arrays and HDF5 datasets for several binnings.
+        '''
+        
+        rng = np.random.RandomState(3)
+        EDS = rng.randint(0, 2**16, (3,8,12,20)).astype('uint16')
+        Windows = [(2,5), (0,0), (7,19), (4,9)]
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with h5py.File(os.path.join(tmpdir, 'eds.h5'), 'w') as f:
+                dset = f.create_dataset('EDS', data=EDS, chunks=(1,8,12,20))
+                
+                for data in (EDS, dset):
+                    for Binning in (1, 2, 4):
+                        with self.subTest(dataset=isinstance(data, h5py.Dataset), Binning=Binning):
+                            Signals = ncempy.edstomo.preprocess.ExtractEnergyWindows(data, Windows, Binning)
+                            ref = self.reference(EDS, Windows, Binning)
+                            
+                            self.assertEqual(len(Signals), len(Windows))
+                            for Signal, r in zip(Signals, ref):
+                                # integer counts are summed without overflow
+                                self.assertEqual(Signal.dtype, np.uint64)
+                                self.assertEqual(Signal.shape, (3, 8//Binning, 12//Binning))
+                                np.testing.assert_array_equal(Signal, r)
+                    
+                    # binning which does not divide the image falls back to no binning
+                    Signals = ncempy.edstomo.preprocess.ExtractEnergyWindows(data, Windows, 3)
+                    for Signal, r in zip(Signals, self.reference(EDS, Windows, 1)):
+                        np.testing.assert_array_equal(Signal, r)
+        
+        # float data keeps its dtype
+        Signals = ncempy.edstomo.preprocess.ExtractEnergyWindows(EDS.astype('float32'), Windows[0:1], 2)
+        self.assertEqual(Signals[0].dtype, np.float32)
+        np.testing.assert_allclose(Signals[0], self.reference(EDS.astype('float64'), Windows[0:1], 2)[0], rtol=1e-6)
+        
+        # wrong input
+        self.assertEqual(ncempy.edstomo.preprocess.ExtractEnergyWindows(EDS[0], Windows), [])
+        self.assertEqual(ncempy.edstomo.preprocess.ExtractEnergyWindows(EDS, []), [])
+    
+    def test_energy_range_window(self):
+        '''
+        Test the parsing of 'eV1-eV2' signal names to energy bins.
+        '''
+        
+        Energies = np.arange(20)*10.
+        
+        # [eV1, eV2) includes the bin at eV1 but not the one at eV2
+        self.assertEqual(ncempy.edstomo.preprocess.GetEnergyRangeWindow('30-80', Energies), (3, 7))
+        self.assertEqual(ncempy.edstomo.preprocess.GetEnergyRangeWindow('25.5-80.5', Energies), (3, 8))
+        self.assertEqual(ncempy.edstomo.preprocess.GetEnergyRangeWindow('100-1000', Energies), (10, 19))
+        
+        # no bins in range or not a range
+        self.assertIsNone(ncempy.edstomo.preprocess.GetEnergyRangeWindow('31-38', Energies))
+        self.assertIsNone(ncempy.edstomo.preprocess.GetEnergyRangeWindow('Fe-Ka', Energies))
+        self.assertIsNone(ncempy.edstomo.preprocess.GetEnergyRangeWindow('10-20-30', Energies))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,13 +6,38 @@ import unittest
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+import tempfile
 
 import ncempy.io.emd
 import ncempy.algo.local_max
 import ncempy.algo.math
+import ncempy.algo.distortion
+import ncempy.algo.radial_profile
 import ncempy.eval.ring_diff
 
 
+def synthetic_stack(nframes):
+    '''
+    Synthetic stack of elliptic rings of spots on a decaying background plus matching settings.
+    '''
+    
+    n = 256
+    x, y = np.mgrid[0:n, 0:n].astype('float64')
+    r = np.hypot(x-130., y-124.)
+    th = np.arctan2(y-124., x-130.)
+    rd = ncempy.algo.distortion.rad_dis(th, 0.4, 0.03, 2)*60.
+    rng = np.random.RandomState(0)
+    stack = np.array([ 1000.*np.exp(-np.square(r-rd*(1.+0.002*i))/8.)*(1.+0.8*np.cos(36*th)) + 2000./(1.+r) + rng.normal(0, 1, r.shape) for i in range(nframes) ])
+    dims = ( (np.arange(nframes), 'frame', '[]'), (np.arange(n), 'x', '[px]'), (np.arange(n), 'y', '[px]') )
+    
+    settings = { 'lmax_r': 3, 'lmax_thresh': 400, 'lmax_cinit': (128, 128), 'lmax_range': (45., 75.),
+                 'plt_imgminmax': None, 'ns': (2,), 'rad_rmax': None, 'rad_dr': None, 'rad_sigma': None, 'mask': None,
+                 'fit_rrange': (20., 110.), 'back_xs': (25., 40., 90., 105.), 'back_xswidth': 2., 'back_init': (1., 2000., -1.),
+                 'fit_funcs': ('voigt',), 'fit_init': (10000., 60., 3., 1.), 'fit_maxfev': None }
+    
+    return stack, dims, settings
+
+
 class test_ringdiff(unittest.TestCase):
     '''
     Test the evaluation of ring diffraction patterns.
@@ -252,6 +277,158 @@ class test_ringdiff(unittest.TestCase):
         if show:
             plt.show()     
         
+    
+    def test_run_all_jobs(self):
+        '''
+        Test the parallel evaluation against the serial one on synthetic patterns.
+        '''
+        
+        stack, dims, settings = synthetic_stack(4)
+        n = stack.shape[1]
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            femd = ncempy.io.emd.fileEMD(os.path.join(tmpdir, 'data.emd'))
+            femd.put_emdgroup('stack', stack, dims)
+            femd.put_emdgroup('single', stack[0], ( (np.arange(n), 'x', '[px]'), (np.arange(n), 'y', '[px]') ))
+            emdgrps = femd.list_emds
+            
+            results = []
+            for jobs in (1, 2):
+                femd_out = ncempy.io.emd.fileEMD(os.path.join(tmpdir, 'evaluation_{}.emd'.format(jobs)))
+                grp_eva = femd_out.file_hdl.create_group('evaluation')
+                for emdgrp in emdgrps:
+                    ncempy.eval.ring_diff.put_sglgroup(grp_eva, emdgrp.name.split('/')[-1], emdgrp)
+                ncempy.eval.ring_diff.put_settings(grp_eva, settings)
+                
+                with self.assertRaises(TypeError):
+                    ncempy.eval.ring_diff.run_all(grp_eva, femd_out, jobs=0)
+                
+                ncempy.eval.ring_diff.run_all(grp_eva, femd_out, jobs=jobs)
+                
+                results.append( { label: np.copy(grp_eva[label]['fit_results']['data']) for label in ('stack', 'single') } )
+                del femd_out
+            
+            del femd
+        
+        # deterministic and ordered
+        self.assertEqual(results[0]['stack'].shape, (4,4))
+        for label in ('stack', 'single'):
+            np.testing.assert_array_equal(results[0][label], results[1][label])
+        
+    
+    def test_run_all_jobs_warmstart(self):
+        '''
+        Test that warm started fits of a stack do not depend on the number of jobs.
+        '''
+        
+        stack, dims, settings = synthetic_stack(4)
+        settings['fit_warmstart'] = True
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            femd = ncempy.io.emd.fileEMD(os.path.join(tmpdir, 'data.emd'))
+            femd.put_emdgroup('stack', stack, dims)
+            emdgrp = femd.list_emds[0]
+            
+            results = []
+            for jobs in (1, 2):
+                femd_out = ncempy.io.emd.fileEMD(os.path.join(tmpdir, 'evaluation_{}.emd'.format(jobs)))
+                grp_eva = femd_out.file_hdl.create_group('evaluation')
+                hdl = ncempy.eval.ring_diff.put_sglgroup(grp_eva, 'stack', emdgrp)
+                ncempy.eval.ring_diff.put_settings(grp_eva, settings)
+                
+                ncempy.eval.ring_diff.run_sglgroup(hdl, femd_out, jobs=jobs)
+                
+                results.append( np.copy(hdl['fit_results']['data']) )
+                del femd_out
+            
+            del femd
+        
+        self.assertFalse(np.any(np.isnan(results[0])))
+        np.testing.assert_array_equal(results[0], results[1])
+    
+    
+    def test_resume(self):
+        '''
+        Test recording failed frames and resuming an evaluation.
+        '''
+        
+        stack, dims, settings = synthetic_stack(5)
+        
+        # no maxima in this frame
+        stack[2] = 0.
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            femd = ncempy.io.emd.fileEMD(os.path.join(tmpdir, 'data.emd'))
+            emdgrp = femd.put_emdgroup('stack', stack, dims)
+            
+            femd_out = ncempy.io.emd.fileEMD(os.path.join(tmpdir, 'evaluation.emd'))
+            grp_eva = ncempy.eval.ring_diff.put_sglgroup(femd_out.file_hdl, 'stack', emdgrp)
+            ncempy.eval.ring_diff.put_settings(grp_eva, settings)
+            
+            # failed frame is recorded, the others are evaluated
+            ncempy.eval.ring_diff.run_sglgroup(grp_eva, femd_out)
+            status = grp_eva[ncempy.eval.ring_diff.status_label]
+            np.testing.assert_array_equal(status[:], (1,1,-1,1,1))
+            
+            fits = grp_eva['fit_results']['data']
+            self.assertEqual(fits.shape, (4,5))
+            self.assertTrue(np.all(np.isnan(fits[:,2])))
+            self.assertFalse(np.any(np.isnan(fits[:,[0,1,3,4]])))
+            ref = np.copy(fits)
+            
+            # simulate an interrupted run
+            status[3:] = 0
+            fits[:,3:] = np.nan
+            
+            # resume evaluates the missing frames only
+            ncempy.eval.ring_diff.run_sglgroup(grp_eva, femd_out, verbose=True)
+            np.testing.assert_array_equal(status[:], (1,1,-1,1,1))
+            np.testing.assert_array_equal(fits[:,3:], ref[:,3:])
+            
+            # overwrite starts from scratch
+            ncempy.eval.ring_diff.run_sglgroup(grp_eva, femd_out, overwrite=True)
+            np.testing.assert_array_equal(grp_eva['fit_results']['data'][:,[0,1,3,4]], ref[:,[0,1,3,4]])
+            
+            del femd_out
+            del femd
+        
+    
+    def test_profile(self):
+        '''
+        Test recording profiling information during the evaluation.
+        '''
+        
+        stack, dims, settings = synthetic_stack(3)
+        
+        with tempfile.TemporaryDirectory() as tmpdir:
+            femd = ncempy.io.emd.fileEMD(os.path.join(tmpdir, 'data.emd'))
+            emdgrp = femd.put_emdgroup('stack', stack, dims)
+            
+            femd_out = ncempy.io.emd.fileEMD(os.path.join(tmpdir, 'evaluation.emd'))
+            grp_eva = femd_out.file_hdl.create_group('evaluation')
+            hdl = ncempy.eval.ring_diff.put_sglgroup(grp_eva, 'stack', emdgrp)
+            ncempy.eval.ring_diff.put_settings(grp_eva, settings)
+            
+            summaries = ncempy.eval.ring_diff.run_all(grp_eva, femd_out, profile=True)
+            
+            self.assertEqual(list(summaries.keys()), [hdl.name])
+            summary = summaries[hdl.name]
+            self.assertEqual(summary['frames'], 3)
+            self.assertEqual(tuple(summary['time'].keys()), ncempy.algo.radial_profile.RingDiffPipeline.stages)
+            
+            times = hdl['profiling_times']['data']
+            self.assertEqual(times.shape, (len(ncempy.algo.radial_profile.RingDiffPipeline.stages), 3))
+            self.assertAlmostEqual(np.sum(times[0]), summary['time']['local_max']['total'])
+            np.testing.assert_array_equal(hdl['profiling_sizes']['data'][-1], 901)
+            self.assertEqual(hdl['profiling_nfev']['data'].shape, (4, 3))
+            
+            # nothing recorded without profiling
+            self.assertIsNone(ncempy.eval.ring_diff.run_all(grp_eva, femd_out, overwrite=True))
+            
+            del femd_out
+            del femd
+        
+        
 
 # to test with unittest runner
 if __name__ == '__main__':
@@ -5,6 +5,7 @@ Tests for the basic functionalities of the dm io module.
 import datetime
 import inspect
 import ncempy.io.dm
+import numpy as np
 import os
 import unittest
 from matplotlib.image import imread
@@ -103,6 +104,19 @@ class test_dm3(unittest.TestCase):
 
         
     
+    def test_read_dm3_binned(self):
+        
+        import ncempy.algo.binning
+        
+        file_route = self._get_image_route("06_lowLoss.dm3")
+        ds = ncempy.io.dm.dmReader(file_route)
+        ds_bin = ncempy.io.dm.dmReader(file_route, binning=(1,2))
+        
+        self.assertTrue(np.array_equal(ds_bin['data'], ncempy.algo.binning.bin_array(ds['data'], (1,2))))
+        self.assertEqual(ds_bin['pixelSize'], [ds['pixelSize'][0], 2*ds['pixelSize'][1]])
+        # bin centers keep their calibrated positions
+        self.assertEqual(ds_bin["pixelOrigin"], [0.0, 99.75])
+    
     def test_read_dm3_on_memory(self):
         
         metadata, img = self._read_dm3_data(self._get_image_route(
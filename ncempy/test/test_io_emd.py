@@ -5,6 +5,7 @@ Tests for the emd io module.
 import unittest
 import os
 import os.path
+import tempfile
 import numpy as np
 
 import ncempy.io.emd
@@ -105,6 +106,29 @@ class test_emd(unittest.TestCase):
         femd.put_comment('something happened', 'today')
         femd.put_comment('even more happened', 'today')
 
+    def test_binning(self):
+        
+        # write a small dataset to a temporary file
+        with tempfile.TemporaryDirectory() as tmp:
+            femd = ncempy.io.emd.fileEMD(os.path.join(tmp, 'binning.emd'))
+            data = np.random.randint(0, 100, (6,10,12)).astype('uint16')
+            dims = ( (np.arange(6), 'tilt', '[deg]'),
+                     (np.arange(10)*0.5, 'x', '[nm]'),
+                     (np.arange(12)*0.5, 'y', '[nm]') )
+            femd.put_emdgroup('dataset_1', data, dims)
+            
+            binned, bdims = femd.get_emdgroup(femd.list_emds[0], binning=(1,2,4))
+            self.assertEqual(binned.shape, (6,5,3))
+            self.assertTrue(np.array_equal(binned, data.reshape((6,5,2,3,4)).sum(axis=(2,4))))
+            self.assertTrue(np.allclose(bdims[1][0], np.arange(5) + 0.25))
+            self.assertTrue(np.allclose(bdims[2][0], np.arange(3)*2 + 0.75))
+            self.assertEqual(bdims[2][1:], ('y', '[nm]'))
+            
+            with self.assertRaises(TypeError):
+                femd.get_emdgroup(femd.list_emds[0], binning=(1,2))
+            
+            del femd
+
 # to test with unittest runner
 if __name__ == '__main__':
     unittest.main()
@@ -13,6 +13,8 @@ parser.add_argument('input', help='path to the emd evaluation file')
 parser.add_argument('-f', action='store_true', help='overwrite existing results')
 parser.add_argument('-v', action='store_true', help='verbose mode')
 parser.add_argument('-p', action='store_true', help='show the plots')
+parser.add_argument('-j', '--jobs', type=int, default=1, help='number of worker processes, plots are only shown for 1')
+parser.add_argument('--profile', action='store_true', help='record timings of the processing stages and print a summary')
 
 args = parser.parse_args()
 
@@ -21,7 +23,15 @@ args = parser.parse_args()
 femd = ncempy.io.emd.fileEMD(args.input)
 
 # execute
-ncempy.eval.ring_diff.run_all(femd.file_hdl, femd, args.f, args.v, args.p)
+summaries = ncempy.eval.ring_diff.run_all(femd.file_hdl, femd, args.f, args.v, args.p, jobs=args.jobs, profile=args.profile)
+
+if args.profile:
+    for name in summaries:
+        summary = summaries[name]
+        print('{}: {} frames'.format(name, summary['frames']))
+        for stage in summary['time']:
+            nfev = ' ({:.1f} fevs)'.format(summary['nfev'][stage]['mean']) if stage in summary['nfev'] else ''
+            print('.. {:<12} {:8.2f} ms/frame{}'.format(stage, 1e3*summary['time'][stage]['mean'], nfev))
 
 # close output    
 del femd